@@ -1,15 +1,22 @@
 import abc
+import asyncio
+import copy
+import ctypes
+import gc
 import importlib
 import inspect
 import json
 import os
+import sys
+import time
 import nltk
 import logging
 import logging.config
+import threading
 from types import SimpleNamespace
 from dataclasses import dataclass
 
-from typing import Dict, List, Tuple, Any, Type, Union
+from typing import Dict, List, Tuple, Any, Type, Union, Optional
 
 import yaml
 
@@ -28,6 +35,9 @@ def get_logger(name):
     return logging.getLogger(name)
 
 
+logger = get_logger(__name__)
+
+
 # Load backend dynamically from "backends" sibling directory
 # Note: The backends might use get_logger (circular import)
 def load_credentials(backend, file_name="key.json") -> Dict:
@@ -134,6 +144,12 @@ class Model(abc.ABC):
         """
         self.__gen_args[arg_name] = arg_value
 
+    def get_gen_args(self) -> Dict:
+        """
+        :return: a copy of all arguments for the generation process
+        """
+        return dict(self.__gen_args)
+
     def get_gen_arg(self, arg_name):
         assert arg_name in self.__gen_args, f"No '{arg_name}' in gen_args given but is expected"
         return self.__gen_args[arg_name]
@@ -164,6 +180,21 @@ class Model(abc.ABC):
             return False
         return self.get_name() == other.get_name()
 
+    def get_memory_footprint(self) -> int:
+        """
+        Local backends should overwrite this method, so that their models can be evicted from the model pool.
+
+        :return: the bytes of memory held by the model e.g. for its weights (default: 0, e.g. for remote models)
+        """
+        return 0
+
+    def unload(self):
+        """
+        Release the memory held by the model (when it is evicted from the model pool). The model cannot be used anymore.
+        Local backends should overwrite this method.
+        """
+        pass
+
     @abc.abstractmethod
     def generate_response(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
         """Put prompt in model-specific format and get its response.
@@ -191,6 +222,37 @@ class Model(abc.ABC):
         """
         pass
 
+    async def agenerate_response(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
+        """Asynchronous variant of generate_response().
+
+        Backends with a native async client should overwrite this method. The default implementation runs the
+        blocking generate_response() in the event loop's default executor, so that the event loop is not blocked.
+
+        Args:
+            messages (List[Dict]): The dialogue context (see generate_response()).
+
+        Returns:
+            Tuple[Any, Any, str]: The prompt object, the response object and the response text
+            (see generate_response()).
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.generate_response, messages)
+
+    def generate_batch(self, batch_messages: List[List[Dict]]) -> List[Tuple[Any, Any, str]]:
+        """Get the responses to several independent dialogues at once.
+
+        Local backends that can generate several sequences together should overwrite this method. The default
+        implementation calls generate_response() for one dialogue after the other.
+
+        Args:
+            batch_messages (List[List[Dict]]): The dialogue contexts (see generate_response()).
+
+        Returns:
+            List[Tuple[Any, Any, str]]: The prompt object, the response object and the response text for each dialogue
+            (see generate_response()).
+        """
+        return [self.generate_response(messages) for messages in batch_messages]
+
 
 class Backend(abc.ABC):
     """ Marker class for a model provider."""
@@ -234,6 +296,11 @@ def is_backend(obj):
 
 _backend_registry: Dict[str, Backend] = dict()  # we store references to the class constructor
 _model_registry: List[ModelSpec] = list()  # we store model specs so that users might use model_name for lookup
+_model_pool: Dict[Tuple[str, str], Model] = dict()  # the loaded models by their unified model spec and gen args
+_model_pool_lock = threading.RLock()
+_model_last_used: Dict[str, float] = dict()  # by unified model spec
+_model_footprints: Dict[str, int] = dict()  # by unified model spec (also of evicted models)
+_model_memory_budget: Optional[int] = None
 
 
 def load_custom_model_registry(_model_registry_path: str = None, is_optional=True):
@@ -301,6 +368,131 @@ def get_model_for(model_spec: Union[str, Dict, ModelSpec]) -> Model:
     :param model_spec: the model spec for which a supporting backend has to be found
     :return: the backend registered that supports the model
     """
+    model_spec = unify_model_spec(model_spec)
+    if model_spec.is_human():
+        return HumanModel(model_spec)
+    if model_spec.is_programmatic():
+        return CustomResponseModel(model_spec)
+    return _load_model_for(model_spec)
+
+
+def load_model(model_spec: Union[str, Dict, ModelSpec], gen_args: Dict = None) -> Model:
+    """
+    Get a model from the pool of this process, so that a model is only loaded once (e.g. the weights of local models),
+    also when it plays several roles or is used by several games. The models are pooled by their unified model spec
+    and their generation arguments. A model with other generation arguments shares the already loaded model.
+
+    :param model_spec: the model spec for which a supporting backend has to be found
+    :param gen_args: the arguments for the generation process (see Model.set_gen_args)
+    :return: the pooled model
+    """
+    return load_models([model_spec], gen_args)[0]
+
+
+def load_models(model_specs: List[Union[str, Dict, ModelSpec]], gen_args: Dict = None) -> List[Model]:
+    """
+    Get the models (e.g. of a dialogue pair) from the pool of this process (see load_model). When the pool has a
+    memory budget (see set_model_memory_budget), then the least recently used models (except the given ones) are
+    evicted before a model is loaded that would exceed the budget.
+
+    :return: the pooled models in the order of the model specs
+    """
+    model_specs = [unify_model_spec(model_spec) for model_spec in model_specs]
+    gen_args = dict(gen_args or {})
+    spec_keys = [_model_spec_key(model_spec) for model_spec in model_specs]
+    gen_args_key = json.dumps(gen_args, sort_keys=True, default=str)
+    models = []
+    with _model_pool_lock:  # models are loaded one after the other
+        for model_spec, spec_key in zip(model_specs, spec_keys):
+            pool_key = (spec_key, gen_args_key)
+            if pool_key not in _model_pool:
+                loaded_model = next((model for (other_spec_key, _), model in _model_pool.items()
+                                     if other_spec_key == spec_key), None)
+                if loaded_model is None:
+                    _evict_models(_model_footprints.get(spec_key, max(_model_footprints.values(), default=0)),
+                                  keep=spec_keys)
+                    model = get_model_for(model_spec)
+                    _model_footprints[spec_key] = model.get_memory_footprint()
+                    _evict_models(0, keep=spec_keys)
+                else:  # share the loaded model, but not the gen args
+                    model = copy.copy(loaded_model)
+                    model.set_gen_args(**loaded_model.get_gen_args())  # a dict of its own
+                if gen_args:
+                    model.set_gen_args(**gen_args)
+                _model_pool[pool_key] = model
+            _model_last_used[spec_key] = time.monotonic()
+            models.append(_model_pool[pool_key])
+    return models
+
+
+def set_model_memory_budget(max_bytes: Optional[int]):
+    """
+    :param max_bytes: the memory the models in the pool may hold (see Model.get_memory_footprint);
+                      or None for no budget
+    """
+    global _model_memory_budget
+    _model_memory_budget = max_bytes
+
+
+def is_model_loaded(model_spec: Union[str, Dict, ModelSpec]) -> bool:
+    """
+    :return: True, if the model is in the pool (with any gen args)
+    """
+    spec_key = _model_spec_key(unify_model_spec(model_spec))
+    with _model_pool_lock:
+        return any(other_spec_key == spec_key for other_spec_key, _ in _model_pool)
+
+
+def _model_spec_key(model_spec: ModelSpec) -> str:
+    return json.dumps(model_spec.__dict__, sort_keys=True, default=str)
+
+
+def _evict_models(required_bytes: int, keep: List[str]):
+    """
+    Evict the least recently used models (except the ones to keep), until the required bytes fit into the budget.
+    """
+    if _model_memory_budget is None:
+        return
+    loaded_footprints = {spec_key: _model_footprints.get(spec_key, 0) for spec_key, _ in _model_pool}
+    used_bytes = sum(loaded_footprints.values())
+    evicted = False
+    for spec_key in sorted(loaded_footprints, key=lambda key: _model_last_used.get(key, 0)):
+        if used_bytes + required_bytes <= _model_memory_budget:
+            break
+        if spec_key in keep or loaded_footprints[spec_key] == 0:
+            continue
+        for pool_key in [pool_key for pool_key in _model_pool if pool_key[0] == spec_key]:
+            model = _model_pool.pop(pool_key)
+            logger.info("Evict model %s from the pool (%d MB)", model.get_name(), loaded_footprints[spec_key] >> 20)
+            model.unload()
+            del model
+        used_bytes -= loaded_footprints[spec_key]
+        evicted = True
+    if evicted:
+        _release_memory()
+    if used_bytes + required_bytes > _model_memory_budget:
+        logger.warning("The models in the pool exceed the memory budget of %d MB", _model_memory_budget >> 20)
+
+
+def _release_memory():
+    """
+    Collect the garbage and return the freed memory to the operating system (as far as possible).
+    """
+    gc.collect()
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)  # glibc only
+    except (OSError, AttributeError):
+        pass
+
+
+def unify_model_spec(model_spec: Union[str, Dict, ModelSpec]) -> ModelSpec:
+    """
+    :param model_spec: a model name, model entry or model spec
+    :return: the model spec unified with the first unifying entry of the model registry (if any)
+    """
     assert len(_model_registry) > 0, "Model registry is empty. Load a model registry and try again."
 
     if isinstance(model_spec, str):
@@ -308,10 +500,8 @@ def get_model_for(model_spec: Union[str, Dict, ModelSpec]) -> Model:
     if isinstance(model_spec, dict):
         model_spec = ModelSpec.from_dict(model_spec)
 
-    if model_spec.is_human():
-        return HumanModel(model_spec)
-    if model_spec.is_programmatic():
-        return CustomResponseModel(model_spec)
+    if model_spec.is_human() or model_spec.is_programmatic():
+        return model_spec
 
     for registered_spec in _model_registry:
         try:
@@ -325,8 +515,7 @@ def get_model_for(model_spec: Union[str, Dict, ModelSpec]) -> Model:
             f"Model spec requires 'backend' after unification, but not found in model spec '{model_spec}'. "
             f"Check or update the backends/model_registry.json or pass the backend directly and try again. "
             f"A minimal model spec is {{'model_id':<id>,'backend':<backend>}}.")
-    model = _load_model_for(model_spec)
-    return model
+    return model_spec
 
 
 class ContextExceededError(Exception):
@@ -4,7 +4,7 @@ import anthropic
 import backends
 import json
 
-from backends.utils import ensure_messages_format
+from backends.utils import ensure_messages_format, async_retry, AsyncClientProvider
 
 logger = backends.get_logger(__name__)
 
@@ -15,15 +15,18 @@ class Anthropic(backends.Backend):
     def __init__(self):
         creds = backends.load_credentials(NAME)
         self.client = anthropic.Anthropic(api_key=creds[NAME]["api_key"])
+        self.async_client = AsyncClientProvider(lambda: anthropic.AsyncAnthropic(api_key=creds[NAME]["api_key"]))
 
     def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
-        return AnthropicModel(self.client, model_spec)
+        return AnthropicModel(self.client, model_spec, async_client=self.async_client)
 
 
 class AnthropicModel(backends.Model):
-    def __init__(self, client: anthropic.Client, model_spec: backends.ModelSpec):
+    def __init__(self, client: anthropic.Client, model_spec: backends.ModelSpec,
+                 async_client: AsyncClientProvider = None):
         super().__init__(model_spec)
         self.client = client
+        self.async_client = async_client
 
     @retry(tries=3, delay=0, logger=logger)
     @ensure_messages_format
@@ -38,6 +41,41 @@ class AnthropicModel(backends.Model):
                 ]
         :return: the continuation
         """
+        prompt, system_message = self._to_claude_messages(messages)
+        completion = self.client.messages.create(
+            messages=prompt,
+            system=system_message,
+            model=self.model_spec.model_id,
+            temperature=self.get_temperature(),
+            max_tokens=self.get_max_tokens()
+        )
+
+        json_output = completion.model_dump_json()
+        response_text = completion.content[0].text
+
+        return prompt, json.loads(json_output), response_text
+
+    @async_retry(tries=3, delay=0, logger=logger)
+    @ensure_messages_format
+    async def agenerate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
+        if self.async_client is None:
+            return await super().agenerate_response(messages)
+        prompt, system_message = self._to_claude_messages(messages)
+        completion = await self.async_client().messages.create(
+            messages=prompt,
+            system=system_message,
+            model=self.model_spec.model_id,
+            temperature=self.get_temperature(),
+            max_tokens=self.get_max_tokens()
+        )
+
+        json_output = completion.model_dump_json()
+        response_text = completion.content[0].text
+
+        return prompt, json.loads(json_output), response_text
+
+    @staticmethod
+    def _to_claude_messages(messages: List[Dict]) -> Tuple[List[Dict], str]:
         prompt = []
         system_message = ''
         for message in messages:
@@ -54,17 +92,4 @@ class AnthropicModel(backends.Model):
                     ]
                 }
                 prompt.append(claude_message)
-
-
-        completion = self.client.messages.create(
-            messages=prompt,
-            system=system_message,
-            model=self.model_spec.model_id,
-            temperature=self.get_temperature(),
-            max_tokens=self.get_max_tokens()
-        )
-
-        json_output = completion.model_dump_json()
-        response_text = completion.content[0].text
-
-        return prompt, json.loads(json_output), response_text
+        return prompt, system_message
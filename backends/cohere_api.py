@@ -2,7 +2,7 @@ from typing import List, Dict, Tuple, Any
 from retry import retry
 import cohere
 import backends
-from backends.utils import ensure_messages_format
+from backends.utils import ensure_messages_format, async_retry, AsyncClientProvider
 import json
 
 logger = backends.get_logger(__name__)
@@ -15,16 +15,19 @@ class Cohere(backends.Backend):
     def __init__(self):
         creds = backends.load_credentials(NAME)
         self.client = cohere.Client(creds[NAME]["api_key"])
+        self.async_client = AsyncClientProvider(lambda: cohere.AsyncClient(creds[NAME]["api_key"]))
 
     def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
-        return CohereModel(self.client, model_spec)
+        return CohereModel(self.client, model_spec, async_client=self.async_client)
 
 
 class CohereModel(backends.Model):
 
-    def __init__(self, client: cohere.Client, model_spec: backends.ModelSpec):
+    def __init__(self, client: cohere.Client, model_spec: backends.ModelSpec,
+                 async_client: AsyncClientProvider = None):
         super().__init__(model_spec)
         self.client = client
+        self.async_client = async_client
 
     @retry(tries=3, delay=0, logger=logger)
     @ensure_messages_format
@@ -39,6 +42,33 @@ class CohereModel(backends.Model):
                 ]
         :return: the continuation
         """
+        message, chat_history = self._to_chat_history(messages)
+        output = self.client.chat(
+            message=message,
+            model=self.model_spec.model_id,
+            chat_history=chat_history,
+            temperature=self.get_temperature(),
+            max_tokens = self.get_max_tokens()
+        )
+        return self._to_response(message, chat_history, output)
+
+    @async_retry(tries=3, delay=0, logger=logger)
+    @ensure_messages_format
+    async def agenerate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
+        if self.async_client is None:
+            return await super().agenerate_response(messages)
+        message, chat_history = self._to_chat_history(messages)
+        output = await self.async_client().chat(
+            message=message,
+            model=self.model_spec.model_id,
+            chat_history=chat_history,
+            temperature=self.get_temperature(),
+            max_tokens=self.get_max_tokens()
+        )
+        return self._to_response(message, chat_history, output)
+
+    @staticmethod
+    def _to_chat_history(messages: List[Dict]) -> Tuple[str, List[Dict]]:
         chat_history = []
 
         # all other messages except the last one. It is passed to the API with the variable message.
@@ -52,15 +82,10 @@ class CohereModel(backends.Model):
                 chat_history.append(m)
 
         message = messages[-1]["content"]
+        return message, chat_history
 
-        output = self.client.chat(
-            message=message,
-            model=self.model_spec.model_id,
-            chat_history=chat_history,
-            temperature=self.get_temperature(),
-            max_tokens = self.get_max_tokens()
-        )
-
+    @staticmethod
+    def _to_response(message: str, chat_history: List[Dict], output) -> Tuple[str, Any, str]:
         response_text = output.text
         prompt = json.dumps({"message": message, "chat_history": chat_history})
 
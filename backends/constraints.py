@@ -0,0 +1,202 @@
+"""
+Constrained decoding of responses in the format that a game expects, i.e. responses that match the response pattern
+of the calling player (see Player.response_pattern).
+
+A response pattern is a regular expression that a valid response matches at its start (like re.match) after leading
+whitespace. The huggingface_local backend checks the most likely next tokens by partial matching (see
+ResponseConstraint) and the llama.cpp backend translates the pattern to a GBNF grammar (see regex_to_gbnf()). Both are
+compiled once per pattern.
+"""
+import functools
+from typing import List, Tuple
+
+try:  # Python >= 3.11
+    import re._parser as sre_parse
+    import re._constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+import regex  # supports partial matching
+
+
+class ResponseConstraint:
+    """
+    Tells whether a generated text is a valid response or might be continued to one.
+    """
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.compiled = regex.compile(pattern)
+
+    def allows(self, text: str) -> bool:
+        """
+        :return: True, if the text is a valid response or the prefix of one
+        """
+        return self.compiled.match(text.lstrip(), partial=True) is not None
+
+    def is_complete(self, text: str) -> bool:
+        """
+        :return: True, if the text is a valid response
+        """
+        match = self.compiled.match(text.lstrip(), partial=True)
+        return match is not None and not match.partial
+
+
+@functools.lru_cache(maxsize=None)
+def get_response_constraint(pattern: str) -> ResponseConstraint:
+    return ResponseConstraint(pattern)
+
+
+@functools.lru_cache(maxsize=None)
+def regex_to_gbnf(pattern: str) -> str:
+    """
+    Translate a response pattern to a GBNF grammar of the valid responses. The grammar allows leading whitespace and,
+    unless the pattern ends with $, any text after the match.
+    :raise ValueError: if the pattern uses constructs without a grammar equivalent (e.g. lookarounds or backreferences)
+    """
+    parsed = sre_parse.parse(pattern)
+    items = list(parsed)
+    root = r"[ \t\n]* " + _sequence(items, parsed.state.flags)
+    if not _ends_anchored(items):
+        root += r" [^\x00]*"
+    return f"root ::= {root}\n"
+
+
+_ANY_CHAR = r"[^\x00]"
+_CATEGORY_RANGES = {
+    sre_constants.CATEGORY_DIGIT: [(48, 57)],
+    sre_constants.CATEGORY_SPACE: [(9, 13), (32, 32)],
+    sre_constants.CATEGORY_WORD: [(48, 57), (65, 90), (95, 95), (97, 122)],
+}
+_NEGATED_CATEGORIES = {
+    sre_constants.CATEGORY_NOT_DIGIT: sre_constants.CATEGORY_DIGIT,
+    sre_constants.CATEGORY_NOT_SPACE: sre_constants.CATEGORY_SPACE,
+    sre_constants.CATEGORY_NOT_WORD: sre_constants.CATEGORY_WORD,
+}
+_REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT, getattr(sre_constants, "POSSESSIVE_REPEAT", None)}
+
+
+def _sequence(items: List[Tuple], flags: int) -> str:
+    parts, literal = [], ""
+    for op, av in items:
+        if op is sre_constants.LITERAL and not _has_case_variant(av, flags):
+            literal += _gbnf_char(av, in_class=False)
+            continue
+        if literal:
+            parts.append(f'"{literal}"')
+            literal = ""
+        part = _item(op, av, flags)
+        if part:
+            parts.append(part)
+    if literal:
+        parts.append(f'"{literal}"')
+    return "(" + " ".join(parts) + ")" if parts else '""'
+
+
+def _item(op, av, flags: int) -> str:
+    if op is sre_constants.LITERAL:
+        return _char_class([(av, av)], False, flags)
+    if op is sre_constants.NOT_LITERAL:
+        return _char_class([(av, av)], True, flags)
+    if op is sre_constants.ANY:
+        return _ANY_CHAR if flags & sre_constants.SRE_FLAG_DOTALL else r"[^\n]"
+    if op is sre_constants.IN:
+        return _in(av, flags)
+    if op is sre_constants.BRANCH:
+        return "(" + " | ".join(_sequence(branch, flags) for branch in av[1]) + ")"
+    if op is sre_constants.SUBPATTERN:
+        _, add_flags, del_flags, items = av
+        return _sequence(items, (flags | add_flags) & ~del_flags)
+    if op is getattr(sre_constants, "ATOMIC_GROUP", None):
+        return _sequence(av, flags)
+    if op in _REPEATS:
+        min_count, max_count, items = av
+        return _repeat(_sequence(items, flags), min_count, max_count)
+    if op is sre_constants.AT and av in (sre_constants.AT_BEGINNING, sre_constants.AT_BEGINNING_STRING,
+                                         sre_constants.AT_END, sre_constants.AT_END_STRING):
+        return ""  # the grammar spans the whole response (see _ends_anchored())
+    raise ValueError(f"No grammar equivalent of {op} {av}")
+
+
+def _repeat(expression: str, min_count: int, max_count: int) -> str:
+    parts = [expression] * min_count
+    if max_count == sre_constants.MAXREPEAT:
+        parts.append(expression + "*")
+    else:
+        optional = ""
+        for _ in range(max_count - min_count):
+            optional = f"({expression} {optional})?" if optional else f"{expression}?"
+        if optional:
+            parts.append(optional)
+    return "(" + " ".join(parts) + ")" if parts else ""
+
+
+def _in(items: List[Tuple], flags: int) -> str:
+    negate = bool(items) and items[0][0] is sre_constants.NEGATE
+    items = items[1:] if negate else items
+    if len(items) == 1 and items[0][0] is sre_constants.CATEGORY and items[0][1] in _NEGATED_CATEGORIES:
+        return _char_class(_CATEGORY_RANGES[_NEGATED_CATEGORIES[items[0][1]]], not negate, flags)
+    ranges = []
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            ranges.append((av, av))
+        elif op is sre_constants.RANGE:
+            ranges.append(av)
+        elif op is sre_constants.CATEGORY and av in _CATEGORY_RANGES:
+            ranges.extend(_CATEGORY_RANGES[av])
+        else:
+            raise ValueError(f"No grammar equivalent of {op} {av} in a character set")
+    return _char_class(ranges, negate, flags)
+
+
+def _char_class(ranges: List[Tuple[int, int]], negate: bool, flags: int) -> str:
+    if flags & sre_constants.SRE_FLAG_IGNORECASE:
+        ranges = ranges + [variant for low, high in ranges for variant in _case_variants(low, high)]
+    chars = "".join(_gbnf_char(low, in_class=True) if low == high
+                    else _gbnf_char(low, in_class=True) + "-" + _gbnf_char(high, in_class=True)
+                    for low, high in sorted(set(ranges)))
+    return "[" + ("^" if negate else "") + chars + "]"
+
+
+def _case_variants(low: int, high: int) -> List[Tuple[int, int]]:
+    if low == high:
+        return [(ord(variant), ord(variant)) for variant in (chr(low).lower(), chr(low).upper())
+                if len(variant) == 1 and ord(variant) != low]
+    variants = []
+    for first, last, offset in [(97, 122, -32), (65, 90, 32)]:  # the ASCII letters within the range
+        if low <= last and high >= first:
+            variants.append((max(low, first) + offset, min(high, last) + offset))
+    return variants
+
+
+def _has_case_variant(code: int, flags: int) -> bool:
+    return bool(flags & sre_constants.SRE_FLAG_IGNORECASE) and bool(_case_variants(code, code))
+
+
+def _gbnf_char(code: int, in_class: bool) -> str:
+    char = chr(code)
+    escapes = {"\n": r"\n", "\r": r"\r", "\t": r"\t", "\\": r"\\"}
+    if char in escapes:
+        return escapes[char]
+    if (in_class and char in "[]^-") or (not in_class and char == '"') or code < 32 or code == 127:
+        return f"\\x{code:02X}"
+    return char
+
+
+def _ends_anchored(items: List[Tuple]) -> bool:
+    """
+    :return: True, if each match of the items ends with $
+    """
+    if not items:
+        return False
+    op, av = items[-1]
+    if op is sre_constants.AT:
+        return av in (sre_constants.AT_END, sre_constants.AT_END_STRING)
+    if op is sre_constants.SUBPATTERN:
+        return _ends_anchored(av[3])
+    if op is getattr(sre_constants, "ATOMIC_GROUP", None):
+        return _ends_anchored(av)
+    if op is sre_constants.BRANCH:
+        return all(_ends_anchored(branch) for branch in av[1])
+    return False
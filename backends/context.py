@@ -0,0 +1,89 @@
+"""
+The state of the current call that the game framework makes available to the backends (in the current thread or
+task): the episode that is played, and the programmatic response, stop sequences and response pattern of the player
+that is called (see clemgame.clemgame.Player).
+"""
+import contextvars
+from contextlib import contextmanager
+from typing import List, Optional, Callable
+
+
+class EpisodeContext:
+    """
+    The episode that is currently played (in the current thread or task), e.g. for backends that depend on it.
+    """
+
+    def __init__(self, game_name: str, dialogue_pair_desc: str, episode_dir: str):
+        """
+        :param episode_dir: the episode directory relative to the game results e.g. 0_experiment/episode_0
+        """
+        self.game_name = game_name
+        self.dialogue_pair_desc = dialogue_pair_desc
+        self.episode_dir = episode_dir
+
+
+_current_episode: contextvars.ContextVar = contextvars.ContextVar("current_episode", default=None)
+_programmatic_response: contextvars.ContextVar = contextvars.ContextVar("programmatic_response", default=None)
+_stop_sequences: contextvars.ContextVar = contextvars.ContextVar("stop_sequences", default=())
+_response_pattern: contextvars.ContextVar = contextvars.ContextVar("response_pattern", default=None)
+
+
+@contextmanager
+def episode_context(game_name: str, dialogue_pair_desc: str, episode_dir: str):
+    token = _current_episode.set(EpisodeContext(game_name, dialogue_pair_desc, episode_dir))
+    try:
+        yield
+    finally:
+        _current_episode.reset(token)
+
+
+def get_current_episode() -> Optional[EpisodeContext]:
+    """
+    :return: the episode that is currently played; or None, if no episode is played
+    """
+    return _current_episode.get()
+
+
+@contextmanager
+def player_call_context(custom_response_fn: Callable[[], str], stop_sequences: List[str],
+                        response_pattern: Optional[str]):
+    """
+    Make the programmatic response, the stop sequences and the response pattern of the called player available to
+    the backend during a call.
+    :param custom_response_fn: returns the response of the player as a programmatic player
+    """
+    tokens = [
+        (_programmatic_response, _programmatic_response.set(custom_response_fn)),
+        (_stop_sequences, _stop_sequences.set(tuple(stop_sequences))),
+        (_response_pattern, _response_pattern.set(response_pattern))
+    ]
+    try:
+        yield
+    finally:
+        for variable, token in reversed(tokens):
+            variable.reset(token)
+
+
+def get_programmatic_response() -> str:
+    """
+    :return: the response of the currently called player as a programmatic player (see Player._custom_response),
+             e.g. for backends that simulate a model with game-valid responses
+    """
+    custom_response_fn = _programmatic_response.get()
+    if custom_response_fn is None:
+        raise RuntimeError("No player is currently called")
+    return custom_response_fn()
+
+
+def get_stop_sequences() -> List[str]:
+    """
+    :return: the stop sequences of the currently called player (see Player.stop_sequences); or an empty list
+    """
+    return list(_stop_sequences.get())
+
+
+def get_response_pattern() -> Optional[str]:
+    """
+    :return: the response pattern of the currently called player (see Player.response_pattern); or None
+    """
+    return _response_pattern.get()
@@ -2,20 +2,32 @@
     Backend using HuggingFace transformers models.
     Uses HF tokenizers instruct/chat templates for proper input format per model.
 """
-from typing import List, Dict, Tuple, Any, Union
+import threading
+from typing import List, Dict, Tuple, Any, Union, Optional
 import torch
 import backends
 
-from transformers import AutoTokenizer, AutoModelForCausalLM, AutoConfig
+from transformers import AutoTokenizer, AutoModelForCausalLM, AutoConfig, StoppingCriteria, StoppingCriteriaList, \
+    LogitsProcessor, LogitsProcessorList
 import copy
 
 from jinja2 import TemplateError
 
-from backends.utils import ensure_alternating_roles
+from backends.utils import ensure_alternating_roles, PrefixStateCache, IncrementalTokenizer, DialogueKVCache, \
+    GenerationBatcher, assisted_generation_info, common_prefix_length, find_stop_sequence, truncate_at_stop_sequence, \
+    collect_stop_sequences, uses_player_stop_sequences, uses_constrained_decoding
+from backends.constraints import ResponseConstraint, get_response_constraint
+from backends.context import get_stop_sequences, get_response_pattern
 
 logger = backends.get_logger(__name__)
 
 FALLBACK_CONTEXT_SIZE = 256
+DEFAULT_KV_CACHE_DIALOGUES = 8
+DEFAULT_PREFIX_CACHE_STATES = 4
+DEFAULT_PREFIX_CACHE_MIN_TOKENS = 64
+DEFAULT_MAX_BATCH_SIZE = 1
+DEFAULT_MAX_WAIT_MS = 10
+NUM_CONSTRAINED_CANDIDATES = 32
 
 
 def load_config_and_tokenizer(model_spec: backends.ModelSpec) -> Union[AutoTokenizer, AutoConfig, int]:
@@ -119,6 +131,136 @@ def load_model(model_spec: backends.ModelSpec) -> Any:
     return model
 
 
+def load_draft_model(model_spec: backends.ModelSpec) -> Any:
+    """
+    Load the weights of the draft model for assisted generation, a smaller model with the same tokenizer given by the
+    huggingface ID in the draft_model of the model entry.
+    :param model_spec: The ModelSpec for the model.
+    :return: The transformers model class instance of the loaded draft model; or None, if the entry has no draft_model.
+    """
+    if 'draft_model' not in model_spec:
+        return None
+    draft_model_str = model_spec['draft_model']
+    logger.info(f'Start loading draft model weights for {model_spec.model_name}: {draft_model_str}')
+    if 'requires_api_key' in model_spec and model_spec['requires_api_key']:
+        creds = backends.load_credentials("huggingface")
+        api_key = creds["huggingface"]["api_key"]
+        draft_model = AutoModelForCausalLM.from_pretrained(draft_model_str, token=api_key, device_map="auto",
+                                                           torch_dtype="auto")
+    else:
+        draft_model = AutoModelForCausalLM.from_pretrained(draft_model_str, device_map="auto", torch_dtype="auto")
+    logger.info(f"Finished loading draft model: {draft_model_str}")
+    return draft_model
+
+
+def _to_legacy_cache(past_key_values: Any) -> Tuple:
+    """
+    :return: the past key values as tuple of (key, value) tensors per layer
+    """
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return past_key_values.to_legacy_cache()
+    return past_key_values
+
+
+def _crop_cache(past_key_values: Tuple, num_tokens: int, copy_tensors: bool = False) -> Tuple:
+    """
+    :param copy_tensors: to copy the cropped tensors, so that the memory of the remaining tokens can be released
+    :return: the past key values of the first num_tokens tokens (the stored tensors are not changed)
+    """
+    if copy_tensors:
+        return tuple((key[:, :, :num_tokens, :].clone(), value[:, :, :num_tokens, :].clone())
+                     for key, value in past_key_values)
+    return tuple((key[:, :, :num_tokens, :], value[:, :, :num_tokens, :]) for key, value in past_key_values)
+
+
+class StopSequenceCriteria(StoppingCriteria):
+    """
+    Stops the generation as soon as each sequence of the batch contains a stop sequence (see find_stop_sequence())
+    or an EOS token.
+    """
+
+    def __init__(self, tokenizer: AutoTokenizer, stop_sequences: List[str], prompt_length: int,
+                 eos_token_ids: List[int]):
+        """
+        :param prompt_length: the number of (padded) prompt tokens of the sequences
+        """
+        self.tokenizer = tokenizer
+        self.stop_sequences = stop_sequences
+        self.prompt_length = prompt_length
+        self.eos_token_ids = set(eos_token_ids)
+        self.stopped = set()  # the indices of the sequences that are finished
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        for idx, output_ids in enumerate(input_ids[:, self.prompt_length:].tolist()):
+            if idx in self.stopped:
+                continue
+            if self.eos_token_ids.intersection(output_ids) \
+                    or find_stop_sequence(self.tokenizer.decode(output_ids), self.stop_sequences) >= 0:
+                self.stopped.add(idx)
+            else:
+                return False
+        return True
+
+
+class StepCounter(StoppingCriteria):
+    """
+    Counts the decoding steps of the model, i.e. its forward passes after the prompt (one per generated token, unless
+    the generation is assisted by a draft model). Never stops the generation.
+    """
+
+    def __init__(self):
+        self.num_steps = 0
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        self.num_steps += 1
+        return False
+
+
+class ResponsePatternLogitsProcessor(LogitsProcessor):
+    """
+    Restricts the next token of each sequence to the most likely tokens that continue a valid response (see
+    ResponseConstraint). If none of these does, then the model chooses freely.
+    """
+
+    def __init__(self, tokenizer: AutoTokenizer, constraint: ResponseConstraint, prompt_length: int,
+                 eos_token_ids: List[int], greedy: bool, num_candidates: int = NUM_CONSTRAINED_CANDIDATES):
+        """
+        :param prompt_length: the number of (padded) prompt tokens of the sequences
+        :param greedy: whether only the most likely valid token is needed
+        :param num_candidates: the number of most likely tokens that are checked
+        """
+        self.tokenizer = tokenizer
+        self.constraint = constraint
+        self.prompt_length = prompt_length
+        self.eos_token_ids = set(eos_token_ids)
+        self.greedy = greedy
+        self.num_candidates = num_candidates
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        num_candidates = min(self.num_candidates, scores.shape[-1])
+        for idx, output_ids in enumerate(input_ids[:, self.prompt_length:].tolist()):
+            if self.eos_token_ids.intersection(output_ids):  # finished sequences are padded
+                continue
+            allowed = []
+            for token_id in torch.topk(scores[idx], num_candidates).indices.tolist():
+                if self._allows(output_ids, token_id):
+                    allowed.append(token_id)
+                    if self.greedy:
+                        break
+            if allowed:
+                mask = torch.full_like(scores[idx], -float("inf"))
+                mask[allowed] = 0
+                scores[idx] = scores[idx] + mask
+        return scores
+
+    def _allows(self, output_ids: List[int], token_id: int) -> bool:
+        if token_id in self.eos_token_ids:
+            return self.constraint.is_complete(self.tokenizer.decode(output_ids))
+        text = self.tokenizer.decode(output_ids + [token_id])
+        # the token might end with an incomplete character (of byte fallback tokens)
+        return text.endswith("\ufffd") or self.constraint.allows(text)
+
+
 class HuggingfaceLocal(backends.Backend):
     """
     Model/backend handler class for locally-run Huggingface models.
@@ -156,6 +298,72 @@ class HuggingfaceLocalModel(backends.Model):
 
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
 
+        # greedy generations are assisted by the draft model (if any); its forward passes are the proposed tokens
+        self.draft_model = load_draft_model(model_spec)
+        self.draft_forwards = threading.local()
+        if self.draft_model is not None:
+            self.draft_model.register_forward_hook(self._count_draft_forward)
+
+        # as in apply_chat_template, the special tokens are part of the template:
+        self.tokenize_prompt = IncrementalTokenizer(
+            lambda text: self.tokenizer.encode(text, add_special_tokens=False))
+
+        kv_cache_dialogues = model_spec["kv_cache_dialogues"] if model_spec.has_attr("kv_cache_dialogues") \
+            else DEFAULT_KV_CACHE_DIALOGUES
+        self.kv_cache = DialogueKVCache(kv_cache_dialogues) if kv_cache_dialogues > 0 else None
+        prefix_cache_states = model_spec["prefix_cache_states"] if model_spec.has_attr("prefix_cache_states") \
+            else DEFAULT_PREFIX_CACHE_STATES
+        prefix_cache_min_tokens = model_spec["prefix_cache_min_tokens"] \
+            if model_spec.has_attr("prefix_cache_min_tokens") else DEFAULT_PREFIX_CACHE_MIN_TOKENS
+        self.prefix_cache = PrefixStateCache(prefix_cache_states, prefix_cache_min_tokens) \
+            if prefix_cache_states > 0 else None
+
+        max_batch_size = model_spec["max_batch_size"] if model_spec.has_attr("max_batch_size") \
+            else DEFAULT_MAX_BATCH_SIZE
+        max_wait_ms = model_spec["max_wait_ms"] if model_spec.has_attr("max_wait_ms") else DEFAULT_MAX_WAIT_MS
+        self.batcher = GenerationBatcher(self._generate_padded, max_batch_size, max_wait_ms) \
+            if max_batch_size > 1 else None
+
+        self.constrained_decoding = uses_constrained_decoding(model_spec)
+
+    def get_memory_footprint(self) -> int:
+        footprint = self.model.get_memory_footprint()
+        if self.draft_model is not None:
+            footprint += self.draft_model.get_memory_footprint()
+        return footprint
+
+    def unload(self):
+        if self.batcher is not None:
+            self.batcher.stop()
+        if self.kv_cache is not None:
+            self.kv_cache.clear()
+        if self.prefix_cache is not None:
+            self.prefix_cache.clear()
+        self.tokenize_prompt.clear()
+        self.model = None
+        self.draft_model = None
+        self.tokenizer = None
+
+    def _cached_prefix(self, messages: List[Dict], prompt_token_ids: List[int]) -> Tuple[int, Optional[Tuple], bool]:
+        """
+        :return: the number of prompt tokens whose past key values are cached, these and whether they are the ones
+                 of the dialogue (otherwise the ones of a prompt prefix common to several dialogues)
+        """
+        num_cached, past_key_values, of_dialogue = 0, None, False
+        cached = self.kv_cache.lookup(messages) if self.kv_cache is not None else None
+        if cached is not None:
+            cached_token_ids, past_key_values = cached
+            # the chat template might render previous turns differently
+            num_cached, of_dialogue = common_prefix_length(cached_token_ids, prompt_token_ids), True
+        if num_cached <= 0 and self.prefix_cache is not None:
+            num_cached, past_key_values = self.prefix_cache.lookup(prompt_token_ids)
+            of_dialogue = False
+        # at least the last token must be prefilled
+        num_cached = min(num_cached, len(prompt_token_ids) - 1)
+        if num_cached <= 0:
+            return 0, None, False
+        return num_cached, _crop_cache(past_key_values, num_cached), of_dialogue
+
     def generate_response(self, messages: List[Dict],
                           return_full_text: bool = False,
                           log_messages: bool = False) -> Tuple[Any, Any, str]:
@@ -181,17 +389,62 @@ class HuggingfaceLocalModel(backends.Model):
         if log_messages:
             logger.info(f"Flattened messages: {current_messages}")
 
-        # apply chat template & tokenize:
-        prompt_tokens = self.tokenizer.apply_chat_template(current_messages, add_generation_prompt=True,
-                                                           return_tensors="pt")
-        prompt_tokens = prompt_tokens.to(self.device)
-
-        prompt_text = self.tokenizer.batch_decode(prompt_tokens)[0]
+        prompt_token_ids, prompt_text = self._prepare_prompt(current_messages)
         prompt = {"inputs": prompt_text, "max_new_tokens": self.get_max_tokens(),
                   "temperature": self.get_temperature(), "return_full_text": return_full_text}
+        prompt.update(self._call_constraints())
+
+        # generate together with concurrent requests, if there are any:
+        batched = None
+        if self.batcher is not None:
+            batched = self.batcher.generate(prompt_token_ids, self._generation_kwargs())
+        if batched is not None:
+            model_output_ids, batch_size = batched
+            generation_info = {'batch_size': batch_size}
+        else:
+            model_output_ids, generation_info = self._generate_with_cache(current_messages, prompt_token_ids)
+
+        # only the generated tokens are decoded:
+        model_output = self.tokenizer.decode(model_output_ids[len(prompt_token_ids):])
+
+        response = {'response': model_output, **generation_info}
+
+        response_text = self._cull_response(model_output, prompt_text, return_full_text)
+
+        return prompt, response, response_text
+
+    def generate_batch(self, batch_messages: List[List[Dict]],
+                       return_full_text: bool = False) -> List[Tuple[Any, Any, str]]:
+        """
+        Generate the continuations of several dialogues at once as a left-padded batch.
+        :param batch_messages: the messages of each dialogue (see generate_response())
+        :param return_full_text: If True, whole input context is returned.
+        :return: the prompt, response and response text of each dialogue
+        """
+        prompts = [self._prepare_prompt(ensure_alternating_roles(messages)) for messages in batch_messages]
+        batch_output_ids = self._generate_padded([prompt_token_ids for prompt_token_ids, _ in prompts],
+                                                 self._generation_kwargs())
+        results = []
+        for (prompt_token_ids, prompt_text), model_output_ids in zip(prompts, batch_output_ids):
+            prompt = {"inputs": prompt_text, "max_new_tokens": self.get_max_tokens(),
+                      "temperature": self.get_temperature(), "return_full_text": return_full_text}
+            prompt.update(self._call_constraints())
+            model_output = self.tokenizer.decode(model_output_ids[len(prompt_token_ids):])
+            response = {'response': model_output, 'batch_size': len(batch_messages)}
+            results.append((prompt, response, self._cull_response(model_output, prompt_text, return_full_text)))
+        return results
+
+    def _prepare_prompt(self, messages: List[Dict]) -> Tuple[List[int], str]:
+        """
+        Apply the chat template and check the context limit.
+        :return: the prompt token ids and the prompt text
+        """
+        # apply chat template & tokenize (only the text appended to a previous prompt of the dialogue):
+        prompt_text = self.tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+        prompt_token_ids = self.tokenize_prompt(messages, prompt_text)
 
         # check context limit:
-        context_check = _check_context_limit(self.context_size, prompt_tokens[0],
+        context_check = _check_context_limit(self.context_size, prompt_token_ids,
                                              max_new_tokens=self.get_max_tokens())
         if not context_check[0]:  # if context is exceeded, context_check[0] is False
             logger.info(f"Context token limit for {self.model_spec.model_name} exceeded: "
@@ -200,36 +453,163 @@ class HuggingfaceLocalModel(backends.Model):
             raise backends.ContextExceededError(f"Context token limit for {self.model_spec.model_name} exceeded",
                                                 tokens_used=context_check[1], tokens_left=context_check[2],
                                                 context_size=context_check[3])
+        return prompt_token_ids, prompt_text
 
+    def _call_constraints(self) -> Dict:
+        """
+        :return: the stop sequences and the response pattern (if used) of the calling player, to be recorded with
+                 the prompt
+        """
+        constraints = dict()
+        if uses_player_stop_sequences(self.model_spec) and get_stop_sequences():
+            constraints["stop_sequences"] = get_stop_sequences()
+        if self.constrained_decoding and get_response_pattern():
+            constraints["response_pattern"] = get_response_pattern()
+        return constraints
+
+    def _generation_kwargs(self) -> Dict:
+        """
+        :return: the arguments of model.generate for the generation arguments of this model
+        """
         # greedy decoding:
         do_sample: bool = False
         if self.get_temperature() > 0.0:
             do_sample = True
 
+        generation_kwargs = dict(max_new_tokens=self.get_max_tokens(), do_sample=do_sample)
         if do_sample:
-            model_output_ids = self.model.generate(
-                prompt_tokens,
-                temperature=self.get_temperature(),
-                max_new_tokens=self.get_max_tokens(),
-                do_sample=do_sample
-            )
-        else:
-            model_output_ids = self.model.generate(
-                prompt_tokens,
-                max_new_tokens=self.get_max_tokens(),
-                do_sample=do_sample
-            )
-
-        model_output = self.tokenizer.batch_decode(model_output_ids)[0]
-
-        response = {'response': model_output}
-
-        # cull input context; equivalent to transformers.pipeline method:
+            generation_kwargs["temperature"] = self.get_temperature()
+        stop_sequences = collect_stop_sequences(self.model_spec, get_stop_sequences())
+        if stop_sequences:
+            generation_kwargs["stop_sequences"] = stop_sequences  # see _generate()
+        if self.constrained_decoding and get_response_pattern():
+            generation_kwargs["response_pattern"] = get_response_pattern()  # see _generate()
+        return generation_kwargs
+
+    def _generate(self, input_ids: torch.Tensor, generation_kwargs: Dict, **kwargs) -> Any:
+        """
+        Call model.generate, stopping at the stop sequences of the generation arguments and constraining the response
+        to the response pattern (if any).
+        """
+        generation_kwargs = dict(generation_kwargs)
+        stop_sequences = generation_kwargs.pop("stop_sequences", None)
+        response_pattern = generation_kwargs.pop("response_pattern", None)
+        eos_token_ids = self.model.generation_config.eos_token_id
+        if not isinstance(eos_token_ids, list):
+            eos_token_ids = [eos_token_ids]
+        stopping_criteria = StoppingCriteriaList(kwargs.pop("stopping_criteria", []))
+        if stop_sequences:
+            stopping_criteria.append(StopSequenceCriteria(
+                self.tokenizer, stop_sequences, input_ids.shape[1], eos_token_ids))
+        if stopping_criteria:
+            generation_kwargs["stopping_criteria"] = stopping_criteria
+        if response_pattern:
+            generation_kwargs["logits_processor"] = LogitsProcessorList([ResponsePatternLogitsProcessor(
+                self.tokenizer, get_response_constraint(response_pattern), input_ids.shape[1], eos_token_ids,
+                greedy=not generation_kwargs["do_sample"])])
+        return self.model.generate(input_ids, **generation_kwargs, **kwargs)
+
+    def _generate_with_cache(self, messages: List[Dict], prompt_token_ids: List[int]) -> Tuple[List[int], Dict]:
+        """
+        Generate the continuation of a single prompt, reusing the cached past key values of its dialogue or prefix.
+        Greedy generations are assisted by the draft model instead (if any), which does not take past key values.
+        :return: the prompt and generated token ids and the number of prompt tokens taken from the cache (or the
+                 statistics of the assisted generation)
+        """
+        prompt_tokens = torch.tensor([prompt_token_ids], device=self.device)
+        generation_kwargs = self._generation_kwargs()
+        generation_kwargs["return_dict_in_generate"] = True
+        if self.draft_model is not None and not generation_kwargs["do_sample"]:
+            return self._generate_assisted(prompt_tokens, generation_kwargs)
+
+        # reuse the past key values of the previous turns of the dialogue:
+        num_cached_tokens, past_key_values, of_dialogue = self._cached_prefix(messages, prompt_token_ids)
+        if past_key_values is not None:
+            generation_kwargs["past_key_values"] = past_key_values
+        model_outputs = self._generate(prompt_tokens, generation_kwargs)
+        model_output_ids = model_outputs.sequences
+
+        output_past_key_values = getattr(model_outputs, "past_key_values", None)
+        if output_past_key_values is not None:
+            output_past_key_values = _to_legacy_cache(output_past_key_values)
+            if self.kv_cache is not None:
+                # the past key values cover all tokens but the last generated one
+                num_output_cached = output_past_key_values[0][0].shape[-2]
+                self.kv_cache.store(messages, model_output_ids[0][:num_output_cached].tolist(),
+                                    output_past_key_values)
+            if self.prefix_cache is not None and not of_dialogue:
+                # later turns of a dialogue share their prefix with its first turn; only those are common prefixes
+                self.prefix_cache.update(prompt_token_ids, lambda num_tokens: _crop_cache(
+                    output_past_key_values, num_tokens, copy_tensors=True))
+
+        return model_output_ids[0].tolist(), {'cached_prompt_tokens': num_cached_tokens}
+
+    def _generate_assisted(self, prompt_tokens: torch.Tensor, generation_kwargs: Dict) -> Tuple[List[int], Dict]:
+        """
+        Generate the continuation of a single prompt with the draft model proposing the next tokens, which the model
+        verifies in a single forward pass (greedy outputs stay the same).
+        :return: the prompt and generated token ids and the statistics of the draft tokens
+        """
+        step_counter = StepCounter()
+        self.draft_forwards.count = 0
+        try:
+            model_outputs = self._generate(prompt_tokens, generation_kwargs, assistant_model=self.draft_model,
+                                           stopping_criteria=[step_counter])
+            num_draft_tokens = self.draft_forwards.count
+        finally:
+            self.draft_forwards.count = None
+        model_output_ids = model_outputs.sequences[0].tolist()
+
+        num_generated = len(model_output_ids) - prompt_tokens.shape[1]
+        assisted_info = assisted_generation_info(num_generated, step_counter.num_steps, num_draft_tokens)
+        logger.info(f"Assisted generation of {self.model_spec.model_name}: {num_generated} tokens in "
+                    f"{step_counter.num_steps} steps, {assisted_info['accepted_draft_tokens']} of "
+                    f"{num_draft_tokens} draft tokens accepted")
+        return model_output_ids, {'assisted_generation': assisted_info}
+
+    def _count_draft_forward(self, module, args, output):
+        if getattr(self.draft_forwards, "count", None) is not None:  # only within _generate_assisted()
+            self.draft_forwards.count += 1
+
+    def _generate_padded(self, prompt_token_ids: List[List[int]], generation_kwargs: Dict) -> List[List[int]]:
+        """
+        Generate the continuations of several prompts at once as a left-padded batch.
+        :return: the prompt and generated token ids of each prompt (without padding and up to the first EOS token)
+        """
+        max_length = max(len(token_ids) for token_ids in prompt_token_ids)
+        pad_token_id = self.model.generation_config.pad_token_id
+        input_ids = torch.tensor([[pad_token_id] * (max_length - len(token_ids)) + token_ids
+                                  for token_ids in prompt_token_ids], device=self.device)
+        attention_mask = torch.tensor([[0] * (max_length - len(token_ids)) + [1] * len(token_ids)
+                                       for token_ids in prompt_token_ids], device=self.device)
+        model_output_ids = self._generate(input_ids, generation_kwargs, attention_mask=attention_mask)
+
+        eos_token_ids = self.model.generation_config.eos_token_id
+        if not isinstance(eos_token_ids, list):
+            eos_token_ids = [eos_token_ids]
+        outputs = []
+        for token_ids, output_ids in zip(prompt_token_ids, model_output_ids[:, max_length:].tolist()):
+            # finished sequences are padded until the longest one is finished
+            for idx, token_id in enumerate(output_ids):
+                if token_id in eos_token_ids:
+                    output_ids = output_ids[:idx + 1]
+                    break
+            outputs.append(token_ids + output_ids)
+        return outputs
+
+    def _cull_response(self, model_output: str, prompt_text: str, return_full_text: bool) -> str:
+        """
+        :param model_output: the decoded generated tokens
+        :return: the response text
+        """
+        # the generation stops only after the token that completes a stop sequence:
+        stop_sequences = collect_stop_sequences(self.model_spec, get_stop_sequences())
+        model_output = truncate_at_stop_sequence(model_output, stop_sequences)
         if not return_full_text:
-            response_text = model_output.replace(prompt_text, '').strip()
+            response_text = model_output.strip()
 
-            if 'output_split_prefix' in self.model_spec:
-                response_text = model_output.rsplit(self.model_spec['output_split_prefix'], maxsplit=1)[1]
+            if 'output_split_prefix' in self.model_spec and self.model_spec['output_split_prefix'] in response_text:
+                response_text = response_text.rsplit(self.model_spec['output_split_prefix'], maxsplit=1)[1]
 
             eos_len = len(self.model_spec['eos_to_cull'])
 
@@ -237,9 +617,9 @@ class HuggingfaceLocalModel(backends.Model):
                 response_text = response_text[:-eos_len]
 
         else:
-            response_text = model_output.strip()
+            response_text = (prompt_text + model_output).strip()
 
-        return prompt, response, response_text
+        return response_text
 
 
 def _check_context_limit(context_size, prompt_tokens, max_new_tokens: int = 100) -> Tuple[bool, int, int, int]:
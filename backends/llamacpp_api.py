@@ -2,10 +2,16 @@
     Backend using llama.cpp for GGUF/GGML models.
 """
 
+import functools
+import os
+import threading
 from typing import List, Dict, Tuple, Any
 
 import backends
-from backends.utils import check_context_limit_generic
+from backends.utils import check_context_limit_generic, IncrementalTokenizer, collect_stop_sequences, \
+    find_stop_sequence, truncate_at_stop_sequence, uses_player_stop_sequences, uses_constrained_decoding
+from backends.constraints import regex_to_gbnf
+from backends.context import get_stop_sequences, get_response_pattern
 
 import llama_cpp
 from llama_cpp import Llama
@@ -53,6 +59,41 @@ def load_model(model_spec: backends.ModelSpec) -> Any:
     return model
 
 
+def load_state_cache(model_spec: backends.ModelSpec) -> Any:
+    """
+    Create the cache of the model states after the evaluated prompts and responses, configured by the cache_capacity
+    (bytes) and the cache_type ('ram' or 'disk') of the model entry. A call starts from the cached state with the
+    longest common token prefix, so that the next turn of a dialogue and prompts with a common prefix (like the
+    instructions of a game) only evaluate the new tokens.
+    :param model_spec: The ModelSpec for the model.
+    :return: The llama_cpp cache instance; or None, if the model entry has no (positive) cache_capacity.
+    """
+    cache_capacity = model_spec['cache_capacity'] if 'cache_capacity' in model_spec else 0
+    if not cache_capacity:
+        return None
+    cache_type = model_spec['cache_type'] if 'cache_type' in model_spec else "ram"
+    if cache_type == "ram":
+        return llama_cpp.LlamaRAMCache(capacity_bytes=cache_capacity)
+    if cache_type == "disk":
+        cache_dir = model_spec['cache_dir'] if 'cache_dir' in model_spec \
+            else os.path.join(".cache", "llama_cache", model_spec.model_name)
+        return llama_cpp.LlamaDiskCache(cache_dir=cache_dir, capacity_bytes=cache_capacity)
+    raise ValueError(f"Unknown cache_type '{cache_type}' for {model_spec.model_name}; use 'ram' or 'disk'")
+
+
+@functools.lru_cache(maxsize=None)
+def load_grammar(response_pattern: str) -> Any:
+    """
+    Compile the grammar of the responses that match a response pattern (see backends/constraints.py).
+    :return: The LlamaGrammar instance; or None, if the pattern cannot be translated to a grammar.
+    """
+    try:
+        return llama_cpp.LlamaGrammar.from_string(regex_to_gbnf(response_pattern), verbose=False)
+    except ValueError as e:
+        logger.warning("Responses are not constrained to the pattern %r: %s", response_pattern, e)
+        return None
+
+
 def get_chat_formatter(model: Llama, model_spec: backends.ModelSpec) -> llama_cpp.llama_chat_format.Jinja2ChatFormatter:
     # placeholders for BOS/EOS:
     bos_string = None
@@ -141,6 +182,38 @@ class LlamaCPPLocalModel(backends.Model):
         # get context size from model instance:
         self.context_size = self.model._n_ctx
 
+        # the evaluated prefix of the last call is reused by llama.cpp, the state cache restores the one of others:
+        self.state_cache = load_state_cache(model_spec)
+        if self.state_cache is not None:
+            self.model.set_cache(self.state_cache)
+        # the model holds a single evaluation context, which concurrent calls must not interleave
+        self.lock = threading.Lock()
+
+        # only the text appended to a previous prompt of the dialogue is tokenized; the special tokens (e.g. the BOS
+        # token) are part of the chat template, the model adds a BOS token like for a prompt text
+        self.tokenize_prompt = IncrementalTokenizer(
+            lambda text: self.model.tokenize(text.encode(), add_bos=False, special=True))
+        self.bos_token_ids = self.model.tokenize(b"", add_bos=True, special=True)
+
+        self.constrained_decoding = uses_constrained_decoding(model_spec)
+
+    def get_memory_footprint(self) -> int:
+        # the weights are mapped from the model file
+        footprint = os.path.getsize(self.model.model_path)
+        if isinstance(self.state_cache, llama_cpp.LlamaRAMCache):
+            footprint += self.state_cache.capacity_bytes
+        return footprint
+
+    def _detokenize(self, token_ids: List[int]) -> str:
+        return self.model.detokenize(list(token_ids)).decode("utf-8", errors="ignore")
+
+    def unload(self):
+        self.state_cache = None
+        self.tokenize_prompt.clear()
+        if hasattr(self.model, "close"):  # frees the llama.cpp context and weights (llama-cpp-python >= 0.2.73)
+            self.model.close()
+        self.model = None
+
     def generate_response(self, messages: List[Dict], return_full_text: bool = False) -> Tuple[Any, Any, str]:
         """
         :param messages: for example
@@ -158,8 +231,14 @@ class LlamaCPPLocalModel(backends.Model):
 
         prompt = {"inputs": prompt_text, "max_new_tokens": self.get_max_tokens(),
                   "temperature": self.get_temperature(), "return_full_text": return_full_text}
+        if uses_player_stop_sequences(self.model_spec) and get_stop_sequences():
+            prompt["stop_sequences"] = get_stop_sequences()
+        response_pattern = get_response_pattern() if self.constrained_decoding else None
+        grammar = load_grammar(response_pattern) if response_pattern else None
+        if grammar is not None:
+            prompt["response_pattern"] = response_pattern
 
-        prompt_tokens = self.model.tokenize(prompt_text.encode(), add_bos=False)  # BOS expected in template
+        prompt_tokens = self.tokenize_prompt(messages, prompt_text)
 
         # check context limit:
         check_context_limit_generic(self.context_size, prompt_tokens, self.model_spec.model_name,
@@ -172,17 +251,30 @@ class LlamaCPPLocalModel(backends.Model):
         # NOTE: llama.cpp has a set sampling order, which differs from that of HF transformers. The latter allows
         # individual sampling orders defined in the generation config that comes with HF models.
 
-        model_output = self.model(
-            prompt_text,
-            temperature=self.get_temperature(),
-            max_tokens=self.get_max_tokens()
-        )
+        input_tokens = self.bos_token_ids + prompt_tokens
+        stop_sequences = collect_stop_sequences(self.model_spec, get_stop_sequences())
+        stopping_criteria = None
+        if stop_sequences:
+            # unlike the stop argument of llama.cpp, the criteria ignore stop sequences before the response content
+            stopping_criteria = llama_cpp.StoppingCriteriaList([
+                lambda input_ids, logits: find_stop_sequence(self._detokenize(input_ids[len(input_tokens):]),
+                                                             stop_sequences) >= 0])
+
+        with self.lock:
+            model_output = self.model(
+                input_tokens,
+                temperature=self.get_temperature(),
+                max_tokens=self.get_max_tokens(),
+                stopping_criteria=stopping_criteria,
+                grammar=grammar
+            )
 
         response = {'response': model_output}
+        output_text = truncate_at_stop_sequence(model_output['choices'][0]['text'], stop_sequences)
 
         # cull input context:
         if not return_full_text:
-            response_text = model_output['choices'][0]['text'].strip()
+            response_text = output_text.strip()
 
             if 'output_split_prefix' in self.model_spec:
                 response_text = response_text.rsplit(self.model_spec['output_split_prefix'], maxsplit=1)[1]
@@ -193,6 +285,6 @@ class LlamaCPPLocalModel(backends.Model):
                 response_text = response_text[:-eos_len]
 
         else:
-            response_text = prompt_text + model_output['choices'][0]['text'].strip()
+            response_text = prompt_text + output_text.strip()
 
         return prompt, response, response_text
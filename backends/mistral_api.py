@@ -1,10 +1,11 @@
 from mistralai.client import MistralClient
+from mistralai.async_client import MistralAsyncClient
 from mistralai.models.chat_completion import ChatMessage
 from typing import List, Dict, Tuple, Any
 from retry import retry
 import json
 import backends
-from backends.utils import ensure_messages_format
+from backends.utils import ensure_messages_format, async_retry, AsyncClientProvider
 
 logger = backends.get_logger(__name__)
 
@@ -16,6 +17,7 @@ class Mistral(backends.Backend):
     def __init__(self):
         creds = backends.load_credentials(NAME)
         self.client = MistralClient(api_key=creds[NAME]["api_key"])
+        self.async_client = AsyncClientProvider(lambda: MistralAsyncClient(api_key=creds[NAME]["api_key"]))
 
     def list_models(self):
         models = self.client.models.list()
@@ -24,14 +26,16 @@ class Mistral(backends.Backend):
         return names
 
     def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
-        return MistralModel(self.client, model_spec)
+        return MistralModel(self.client, model_spec, async_client=self.async_client)
 
 
 class MistralModel(backends.Model):
 
-    def __init__(self, client: MistralClient, model_spec: backends.ModelSpec):
+    def __init__(self, client: MistralClient, model_spec: backends.ModelSpec,
+                 async_client: AsyncClientProvider = None):
         super().__init__(model_spec)
         self.client = client
+        self.async_client = async_client
 
     @retry(tries=3, delay=0, logger=logger)
     @ensure_messages_format
@@ -54,6 +58,24 @@ class MistralModel(backends.Model):
                                         messages=prompt,
                                         temperature=self.get_temperature(),
                                         max_tokens=self.get_max_tokens())
+        return self._to_response(messages, api_response)
+
+    @async_retry(tries=3, delay=0, logger=logger)
+    @ensure_messages_format
+    async def agenerate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
+        if self.async_client is None:
+            return await super().agenerate_response(messages)
+        prompt = []
+        for m in messages:
+            prompt.append(ChatMessage(role=m['role'], content=m['content']))
+        api_response = await self.async_client().chat(model=self.model_spec.model_id,
+                                                      messages=prompt,
+                                                      temperature=self.get_temperature(),
+                                                      max_tokens=self.get_max_tokens())
+        return self._to_response(messages, api_response)
+
+    @staticmethod
+    def _to_response(messages: List[Dict], api_response) -> Tuple[str, Any, str]:
         message = api_response.choices[0].message
         if message.role != "assistant":  # safety check
             raise AttributeError("Response message role is " + message.role + " but should be 'assistant'")
@@ -4,7 +4,7 @@ from retry import retry
 import json
 import openai
 import backends
-from backends.utils import ensure_messages_format
+from backends.utils import ensure_messages_format, async_retry, AsyncClientProvider
 
 logger = backends.get_logger(__name__)
 
@@ -18,6 +18,8 @@ class OpenAI(backends.Backend):
         api_key = creds[NAME]["api_key"]
         organization = creds[NAME]["organisation"] if "organisation" in creds[NAME] else None
         self.client = openai.OpenAI(api_key=api_key, organization=organization)
+        self.async_client = AsyncClientProvider(
+            lambda: openai.AsyncOpenAI(api_key=api_key, organization=organization))
 
     def list_models(self):
         models = self.client.models.list()
@@ -27,14 +29,16 @@ class OpenAI(backends.Backend):
         # [print(n) for n in names]   # 2024-01-10: what was this? a side effect-only method?
 
     def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
-        return OpenAIModel(self.client, model_spec)
+        return OpenAIModel(self.client, model_spec, async_client=self.async_client)
 
 
 class OpenAIModel(backends.Model):
 
-    def __init__(self, client: openai.OpenAI, model_spec: backends.ModelSpec):
+    def __init__(self, client: openai.OpenAI, model_spec: backends.ModelSpec,
+                 async_client: AsyncClientProvider = None):
         super().__init__(model_spec)
         self.client = client
+        self.async_client = async_client
 
     @retry(tries=3, delay=0, logger=logger)
     @ensure_messages_format
@@ -54,6 +58,22 @@ class OpenAIModel(backends.Model):
                                                            messages=prompt,
                                                            temperature=self.get_temperature(),
                                                            max_tokens=self.get_max_tokens())
+        return self._to_response(prompt, api_response)
+
+    @async_retry(tries=3, delay=0, logger=logger)
+    @ensure_messages_format
+    async def agenerate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
+        if self.async_client is None:
+            return await super().agenerate_response(messages)
+        prompt = messages
+        api_response = await self.async_client().chat.completions.create(model=self.model_spec.model_id,
+                                                                         messages=prompt,
+                                                                         temperature=self.get_temperature(),
+                                                                         max_tokens=self.get_max_tokens())
+        return self._to_response(prompt, api_response)
+
+    @staticmethod
+    def _to_response(prompt: List[Dict], api_response) -> Tuple[str, Any, str]:
         message = api_response.choices[0].message
         if message.role != "assistant":  # safety check
             raise AttributeError("Response message role is " + message.role + " but should be 'assistant'")
@@ -6,7 +6,7 @@ import openai
 import backends
 import httpx
 
-from backends.utils import ensure_messages_format
+from backends.utils import ensure_messages_format, async_retry, AsyncClientProvider
 
 logger = backends.get_logger(__name__)
 
@@ -25,6 +25,11 @@ class GenericOpenAI(backends.Backend):
             ### issues with the certificates on our GPU server.
             http_client=httpx.Client(verify=False)
         )
+        self.async_client = AsyncClientProvider(lambda: openai.AsyncOpenAI(
+            base_url=creds[NAME]["base_url"],
+            api_key=creds[NAME]["api_key"],
+            http_client=httpx.AsyncClient(verify=False)  # see above
+        ))
 
     def list_models(self):
         models = self.client.models.list()
@@ -33,14 +38,16 @@ class GenericOpenAI(backends.Backend):
         return names
 
     def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
-        return GenericOpenAIModel(self.client, model_spec)
+        return GenericOpenAIModel(self.client, model_spec, async_client=self.async_client)
 
 
 class GenericOpenAIModel(backends.Model):
 
-    def __init__(self, client: openai.OpenAI, model_spec: backends.ModelSpec):
+    def __init__(self, client: openai.OpenAI, model_spec: backends.ModelSpec,
+                 async_client: AsyncClientProvider = None):
         super().__init__(model_spec)
         self.client = client
+        self.async_client = async_client
 
     @retry(tries=3, delay=0, logger=logger)
     @ensure_messages_format
@@ -59,6 +66,22 @@ class GenericOpenAIModel(backends.Model):
         api_response = self.client.chat.completions.create(model=self.model_spec.model_id, messages=prompt,
                                                            temperature=self.get_temperature(),
                                                            max_tokens=self.get_max_tokens())
+        return self._to_response(prompt, api_response)
+
+    @async_retry(tries=3, delay=0, logger=logger)
+    @ensure_messages_format
+    async def agenerate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
+        if self.async_client is None:
+            return await super().agenerate_response(messages)
+        prompt = messages
+        api_response = await self.async_client().chat.completions.create(model=self.model_spec.model_id,
+                                                                         messages=prompt,
+                                                                         temperature=self.get_temperature(),
+                                                                         max_tokens=self.get_max_tokens())
+        return self._to_response(prompt, api_response)
+
+    @staticmethod
+    def _to_response(prompt: List[Dict], api_response) -> Tuple[str, Any, str]:
         message = api_response.choices[0].message
         if message.role != "assistant":  # safety check
             raise AttributeError("Response message role is " + message.role + " but should be 'assistant'")
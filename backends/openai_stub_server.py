@@ -0,0 +1,233 @@
+"""
+A local OpenAI-compatible HTTP server with scripted responses, e.g. to load test the openai_compatible backend
+(connection pooling, retries and concurrency of the openai client) without network access or inference.
+
+The server answers the chat completions (POST .../chat/completions) and lists the models (GET .../models).
+The responses are taken in turn from a JSON file with a list of strings (or echo the last message). Each request
+waits for a configurable latency and might fail with a 429 (with a Retry-After header), a 500 or hang until the
+client times out. GET .../stats returns the number of requests by status.
+
+To start the server:
+    $> python3 -m backends.openai_stub_server --port 8000 --latency 0.5 --latency_sigma 0.3 --rate_429 0.05
+
+Then point the openai_compatible backend to it in the key.json:
+    "generic_openai_compatible": {"api_key": "stub", "base_url": "http://localhost:8000/v1"}
+"""
+import argparse
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+import backends
+
+logger = backends.get_logger(__name__)
+
+
+class StubOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "localhost", port: int = 8000, models: List[str] = None,
+                 responses: List[str] = None, latency: float = 0., latency_sigma: float = 0.,
+                 rate_429: float = 0., rate_500: float = 0., rate_timeout: float = 0., retry_after: float = None,
+                 hang_seconds: float = 600., max_concurrent: int = None, seed: int = None):
+        """
+        :param port: the port to listen to (0 to choose a free port, see server_port)
+        :param models: the model ids to be listed (default: ["stub"])
+        :param responses: the response texts to be returned in turn (default: echo the last message)
+        :param latency: the (median) seconds of a request
+        :param latency_sigma: the sigma of the lognormal latency distribution (default: 0, i.e. a fixed latency)
+        :param rate_429: the probability of a 429 Too Many Requests error
+        :param rate_500: the probability of a 500 Internal Server Error
+        :param rate_timeout: the probability that the request hangs for hang_seconds
+        :param retry_after: the seconds given in the Retry-After header of the 429 errors (default: no header)
+        :param max_concurrent: the number of concurrent requests, before further requests are answered with a 429
+        """
+        super().__init__((host, port), StubOpenAIRequestHandler)
+        self.models = models or ["stub"]
+        self.responses = itertools.cycle(responses) if responses else None
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.rate_429 = rate_429
+        self.rate_500 = rate_500
+        self.rate_timeout = rate_timeout
+        self.retry_after = retry_after
+        self.hang_seconds = hang_seconds
+        self.max_concurrent = max_concurrent
+        self.random = random.Random(seed)
+        self.stats: Dict[str, int] = dict()
+        self.num_concurrent = 0
+        self.lock = threading.Lock()
+        self.thread: threading.Thread = None
+
+    def start(self) -> "StubOpenAIServer":
+        """ Serve the requests in a background thread """
+        self.thread = threading.Thread(target=self.serve_forever, name="stub-openai-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def base_url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_port}/v1"
+
+    def count(self, status: str):
+        with self.lock:
+            self.stats[status] = self.stats.get(status, 0) + 1
+
+    def next_response(self, messages: List[Dict]) -> str:
+        if self.responses is None:
+            return messages[-1]["content"] if messages else ""
+        with self.lock:
+            return next(self.responses)
+
+    def sample_latency(self) -> float:
+        if self.latency_sigma <= 0 or self.latency <= 0:
+            return self.latency
+        return self.random.lognormvariate(math.log(self.latency), self.latency_sigma)
+
+    def sample_fault(self) -> str:
+        """
+        :return: '429', '500', 'timeout' or None
+        """
+        value = self.random.random()
+        for fault, rate in [("429", self.rate_429), ("500", self.rate_500), ("timeout", self.rate_timeout)]:
+            if value < rate:
+                return fault
+            value -= rate
+        return None
+
+
+class StubOpenAIRequestHandler(BaseHTTPRequestHandler):
+    server: StubOpenAIServer
+    protocol_version = "HTTP/1.1"  # keep-alive, so that the connection pooling of the clients is used
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [
+                {"id": model, "object": "model", "created": 0, "owned_by": "stub"} for model in self.server.models]})
+        elif self.path.rstrip("/").endswith("/stats"):
+            with self.server.lock:
+                stats = dict(self.server.stats)
+            self._send_json(200, stats)
+        else:
+            self._send_error(404, f"Unknown path {self.path}", "invalid_request_error")
+
+    def do_POST(self):
+        content_length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(content_length)
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_error(404, f"Unknown path {self.path}", "invalid_request_error")
+            return
+        try:
+            request = json.loads(body)
+            messages = request["messages"]
+        except (ValueError, KeyError) as e:
+            self._send_error(400, f"Invalid request: {e}", "invalid_request_error")
+            return
+        server = self.server
+        with server.lock:
+            server.num_concurrent += 1
+            too_many = server.max_concurrent is not None and server.num_concurrent > server.max_concurrent
+        try:
+            fault = "429" if too_many else server.sample_fault()
+            if fault == "timeout":
+                server.count("timeout")
+                time.sleep(server.hang_seconds)
+                self.close_connection = True  # the client has most likely given up already
+                return
+            time.sleep(server.sample_latency())
+            if fault == "429":
+                headers = {} if server.retry_after is None else {"Retry-After": str(server.retry_after)}
+                self._send_error(429, "Rate limit reached", "rate_limit_error", headers)
+            elif fault == "500":
+                self._send_error(500, "The server had an error while processing your request", "server_error")
+            else:
+                self._send_completion(request, messages)
+        finally:
+            with server.lock:
+                server.num_concurrent -= 1
+
+    def _send_completion(self, request: Dict, messages: List[Dict]):
+        response_text = self.server.next_response(messages)
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in messages) // 4
+        completion_tokens = len(response_text) // 4
+        self._send_json(200, {
+            "id": f"chatcmpl-stub-{time.time_ns()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", self.server.models[0]),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": response_text},
+                         "finish_reason": "stop", "logprobs": None}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens}
+        })
+
+    def _send_error(self, status_code: int, message: str, error_type: str, headers: Dict = None):
+        self._send_json(status_code, {"error": {"message": message, "type": error_type, "code": status_code}},
+                        headers)
+
+    def _send_json(self, status_code: int, obj: Dict, headers: Dict = None):
+        self.server.count(str(status_code))
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="A local OpenAI-compatible server with scripted responses")
+    parser.add_argument("--host", type=str, default="localhost")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--models", type=str, nargs="+", default=["stub"],
+                        help="The model ids to be listed. Default: stub.")
+    parser.add_argument("--responses", type=str,
+                        help="A JSON file with a list of response texts to be returned in turn. "
+                             "Default: echo the last message.")
+    parser.add_argument("--latency", type=float, default=0.,
+                        help="The (median) seconds of a request. Default: 0.")
+    parser.add_argument("--latency_sigma", type=float, default=0.,
+                        help="The sigma of a lognormal latency distribution. Default: 0 (fixed latency).")
+    parser.add_argument("--rate_429", type=float, default=0., help="The probability of a 429 error. Default: 0.")
+    parser.add_argument("--rate_500", type=float, default=0., help="The probability of a 500 error. Default: 0.")
+    parser.add_argument("--rate_timeout", type=float, default=0.,
+                        help="The probability that a request hangs for --hang_seconds. Default: 0.")
+    parser.add_argument("--hang_seconds", type=float, default=600.)
+    parser.add_argument("--retry_after", type=float,
+                        help="The seconds given in the Retry-After header of the 429 errors. Default: no header.")
+    parser.add_argument("--max_concurrent", type=int,
+                        help="The number of concurrent requests, before further ones are answered with a 429.")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    responses = None
+    if args.responses:
+        with open(args.responses, encoding="utf-8") as f:
+            responses = json.load(f)
+    server = StubOpenAIServer(args.host, args.port, args.models, responses, args.latency, args.latency_sigma,
+                              args.rate_429, args.rate_500, args.rate_timeout, args.retry_after, args.hang_seconds,
+                              args.max_concurrent, args.seed)
+    print(f"Serving at {server.base_url()} (stop with Ctrl+C)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Requests by status: {server.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+A backend that replays the responses recorded in the results of a previous run, e.g. to re-validate the results
+after a change of a game master or scorer without any model calls.
+
+A model is replayed by giving its name with the replay backend and the root of the recorded results, for example
+{"model_name": "gpt-4-0613", "backend": "replay", "replay_root": "results/v1.5"}. The recorded episode is
+looked up in the same dialogue pair, game, experiment and episode directory as the currently played episode.
+The n-th call of a model in the episode is answered with the response of the n-th recorded request of this model.
+
+The replay fails with a ReplayDivergenceError, when there is no recorded request for a call or when a message
+passed to the model does not occur in the recorded prompt (the game has taken a different course).
+"""
+import json
+import os
+import threading
+import weakref
+from typing import List, Dict, Tuple, Any
+
+import backends
+from backends.context import get_current_episode, EpisodeContext
+from backends.utils import results_root
+
+logger = backends.get_logger(__name__)
+
+NAME = "replay"
+
+
+class ReplayDivergenceError(Exception):
+    """
+    Exception to be raised when a replayed episode takes a different course than the recorded one.
+    """
+    pass
+
+
+class Replay(backends.Backend):
+
+    def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
+        return ReplayModel(model_spec)
+
+
+class ReplayModel(backends.Model):
+
+    def __init__(self, model_spec: backends.ModelSpec):
+        super().__init__(model_spec)
+        replay_root = model_spec["replay_root"] if model_spec.has_attr("replay_root") else None
+        self.replay_root = results_root(replay_root)
+        self.__requests: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()  # the requests left by episode
+        self.__lock = threading.Lock()
+
+    def generate_response(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
+        """
+        :return: the recorded prompt, response (without the clem_player info) and response text
+        """
+        episode = get_current_episode()
+        if episode is None:
+            raise ReplayDivergenceError("The replay backend can only be used when playing an episode")
+        with self.__lock:
+            if episode not in self.__requests:
+                self.__requests[episode] = self._load_requests(episode)
+            recorded_requests = self.__requests[episode]
+            if not recorded_requests:
+                raise ReplayDivergenceError(f"No more recorded requests of {self.get_name()} in "
+                                            f"{self._requests_file(episode)}")
+            recorded_request = recorded_requests.pop(0)
+        recorded_prompt = recorded_request["manipulated_prompt_obj"]
+        recorded_strings = list(_strings_of(recorded_prompt))
+        for message in messages:
+            content = message["content"].strip()
+            if not any(content in recorded_string for recorded_string in recorded_strings):
+                raise ReplayDivergenceError(f"Message not in the recorded prompt of {self.get_name()} "
+                                            f"({recorded_request['timestamp']}) in {self._requests_file(episode)}: "
+                                            f"{message}")
+        response = dict(recorded_request["raw_response_obj"])
+        response_text = response.pop("clem_player")["response"]
+        return recorded_prompt, response, response_text
+
+    async def agenerate_response(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
+        # the replay does not block, but needs the current episode of the calling task
+        return self.generate_response(messages)
+
+    def _requests_file(self, episode: EpisodeContext) -> str:
+        return os.path.join(self.replay_root, episode.dialogue_pair_desc, episode.game_name, episode.episode_dir,
+                            "requests.json")
+
+    def _load_requests(self, episode: EpisodeContext) -> List[Dict]:
+        """
+        :return: the recorded requests of this model in the episode (in the order of the calls)
+        """
+        requests_file = self._requests_file(episode)
+        if not os.path.isfile(requests_file):
+            raise ReplayDivergenceError(f"No recorded requests at {requests_file}")
+        with open(requests_file, encoding="utf-8") as f:
+            recorded_requests = json.load(f)
+        return [request for request in recorded_requests
+                if isinstance(request["raw_response_obj"], Dict)
+                and request["raw_response_obj"].get("clem_player", {}).get("model_name") == self.get_name()]
+
+
+def _strings_of(obj: Any):
+    """
+    :return: all strings in a (nested) prompt object, e.g. the contents of the messages or a prompt text
+    """
+    if isinstance(obj, str):
+        yield obj
+    elif isinstance(obj, Dict):
+        for value in obj.values():
+            yield from _strings_of(value)
+    elif isinstance(obj, List):
+        for value in obj:
+            yield from _strings_of(value)
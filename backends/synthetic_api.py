@@ -0,0 +1,138 @@
+"""
+A backend that simulates the latency, errors and token usage of a remote model, e.g. to measure the concurrency
+and scheduling of the framework offline.
+
+The response texts are the ones of the players as programmatic players (see Player._custom_response), so that all
+games whose players implement these (like the shipped games) can be played end to end. The model entry configures:
+
+    - latency: the seconds of a call as {"distribution": "fixed", "seconds": 1.0},
+      {"distribution": "lognormal", "median": 1.0, "sigma": 0.5} or
+      {"distribution": "replay", "results_root": "results", "model_name": "gpt-4-0613"} to sample the recorded
+      call durations (clem_player.call_duration) of a model (or of all models) in the results (default: no latency);
+      as the model cannot be loaded without such results, the registry has no entry with a replayed latency, e.g.
+      {"model_name": "synthetic-recorded-latency", "backend": "synthetic",
+       "latency": {"distribution": "replay", "results_root": "results"}}
+    - completion_tokens: the reported completion tokens in the same format (fixed: "tokens"; lognormal: "median")
+      (default: the response text length divided by four)
+    - error_rate: the probability of a call to fail with a SyntheticAPIError (default: 0)
+    - error_status_code: the HTTP status code of the errors (default: 503, i.e. a transient error)
+    - seed: for the random numbers of the model (default: None)
+"""
+import asyncio
+import glob
+import json
+import math
+import os
+import random
+import time
+from typing import List, Dict, Tuple, Any, Callable
+
+import backends
+from backends.context import get_programmatic_response
+from backends.utils import results_root, to_timedelta
+
+logger = backends.get_logger(__name__)
+
+NAME = "synthetic"
+
+
+class SyntheticAPIError(Exception):
+    """
+    Exception to be raised for the injected errors. The status_code tells whether the error is transient.
+    """
+
+    def __init__(self, status_code: int):
+        super().__init__(f"Synthetic API error with status code {status_code}")
+        self.status_code = status_code
+
+
+class Synthetic(backends.Backend):
+
+    def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
+        return SyntheticModel(model_spec)
+
+
+class SyntheticModel(backends.Model):
+
+    def __init__(self, model_spec: backends.ModelSpec):
+        super().__init__(model_spec)
+        self.random = random.Random(model_spec["seed"] if model_spec.has_attr("seed") else None)
+        self.sample_latency = self._sampler(model_spec["latency"]) if model_spec.has_attr("latency") else None
+        self.sample_completion_tokens = self._sampler(model_spec["completion_tokens"]) \
+            if model_spec.has_attr("completion_tokens") else None
+        self.error_rate = model_spec["error_rate"] if model_spec.has_attr("error_rate") else 0.
+        self.error_status_code = model_spec["error_status_code"] if model_spec.has_attr("error_status_code") else 503
+
+    def generate_response(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
+        latency, error = self._sample_call()
+        time.sleep(latency)
+        return self._respond(messages, latency, error)
+
+    async def agenerate_response(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
+        latency, error = self._sample_call()
+        await asyncio.sleep(latency)
+        return self._respond(messages, latency, error)
+
+    def _sample_call(self) -> Tuple[float, bool]:
+        latency = max(0., self.sample_latency()) if self.sample_latency else 0.
+        return latency, self.random.random() < self.error_rate
+
+    def _respond(self, messages: List[Dict], latency: float, error: bool) -> Tuple[Any, Any, str]:
+        if error:
+            raise SyntheticAPIError(self.error_status_code)
+        response_text = get_programmatic_response()
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        if self.sample_completion_tokens:
+            completion_tokens = max(1, round(self.sample_completion_tokens()))
+        else:
+            completion_tokens = len(response_text) // 4
+        response = {
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+            "latency": latency
+        }
+        return messages, response, response_text
+
+    def _sampler(self, config: Dict) -> Callable[[], float]:
+        """
+        :return: a function that returns a random number of the configured distribution
+        """
+        distribution = config["distribution"]
+        if distribution == "fixed":
+            value = config["seconds"] if "seconds" in config else config["tokens"]
+            return lambda: value
+        if distribution == "lognormal":
+            mu, sigma = math.log(config["median"]), config["sigma"]
+            return lambda: self.random.lognormvariate(mu, sigma)
+        if distribution == "replay":
+            durations = load_call_durations(config.get("results_root"), config.get("model_name"))
+            return lambda: self.random.choice(durations)
+        raise ValueError(f"Unknown distribution '{distribution}' for model {self.get_name()}")
+
+
+def load_call_durations(results_dir: str = None, model_name: str = None) -> List[float]:
+    """
+    :param model_name: only the durations of this model (default: of all models)
+    :return: the recorded call durations (clem_player.call_duration) in seconds
+    """
+    results_dir = results_root(results_dir)
+    pattern = os.path.join(glob.escape(results_dir), "*", "*", "*", "episode_*", "requests.json")
+    durations = []
+    for requests_file in glob.glob(pattern):
+        try:
+            with open(requests_file, encoding="utf-8") as f:
+                recorded_requests = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.debug("Ignore %s for call durations: %s", requests_file, e)
+            continue
+        for request in recorded_requests:
+            response = request.get("raw_response_obj")
+            call_info = response.get("clem_player") if isinstance(response, Dict) else None
+            if not isinstance(call_info, Dict) or "call_duration" not in call_info:
+                continue
+            if model_name and call_info.get("model_name") != model_name:
+                continue
+            durations.append(to_timedelta(call_info["call_duration"]).total_seconds())
+    if not durations:
+        raise ValueError(f"No recorded call durations of {model_name or 'any model'} in {results_dir}")
+    return durations
@@ -1,8 +1,20 @@
+import asyncio
 import copy
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import timedelta
 from functools import wraps
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Callable, Any, Optional, Sequence
 
-from backends import get_logger, ContextExceededError
+from backends import get_logger, ContextExceededError, project_root
+from backends.context import get_current_episode
 
 logger = get_logger(__name__)
 
@@ -62,6 +74,496 @@ def ensure_messages_format(generate_response_fn):
     return wrapped_fn
 
 
+def async_retry(tries: int = 3, delay: float = 0, logger=logger):
+    """
+    Retry decorator for coroutine functions with the same semantics as retry.retry(tries, delay, logger),
+    which cannot be used for coroutines, because these only fail when they are awaited.
+
+    :param tries: the maximal number of attempts
+    :param delay: the seconds to wait between the attempts
+    :param logger: to log the failed attempts to
+    """
+
+    def decorator(generate_response_fn):
+        @wraps(generate_response_fn)
+        async def wrapped_fn(*args, **kwargs):
+            for attempt in range(1, tries + 1):
+                try:
+                    return await generate_response_fn(*args, **kwargs)
+                except Exception as e:
+                    if attempt == tries:
+                        raise
+                    logger.warning('%s, retrying in %s seconds...', e, delay)
+                    await asyncio.sleep(delay)
+
+        return wrapped_fn
+
+    return decorator
+
+
+class AsyncClientProvider:
+    """
+    Creates the async client of an API backend lazily and once per event loop.
+
+    The async clients keep connection pools that are bound to the event loop in which they are used first.
+    Because each benchmark run might use its own event loop (e.g. when games are played concurrently),
+    the clients must not be shared between event loops.
+    """
+
+    def __init__(self, create_client_fn: Callable[[], Any]):
+        """
+        :param create_client_fn: to create a new async client
+        """
+        self.create_client_fn = create_client_fn
+        self.clients = weakref.WeakKeyDictionary()
+
+    def __call__(self) -> Any:
+        """
+        :return: the async client for the currently running event loop
+        """
+        loop = asyncio.get_running_loop()
+        if loop not in self.clients:
+            self.clients[loop] = self.create_client_fn()
+        return self.clients[loop]
+
+
+class TokenPrefixTrie:
+    """
+    A radix tree of token id sequences, whose nodes might hold a value (e.g. the model state after a prompt prefix).
+    The edges are labeled with token id tuples, so that the tree has at most two nodes per inserted sequence.
+    """
+
+    class _Node:
+        __slots__ = ("children", "value")
+
+        def __init__(self):
+            self.children: Dict[int, Tuple[Tuple[int, ...], "TokenPrefixTrie._Node"]] = dict()
+            self.value: Any = None
+
+    def __init__(self):
+        self.root = TokenPrefixTrie._Node()
+
+    def insert(self, token_ids: Sequence[int]) -> int:
+        """
+        :return: the length of the longest prefix that the sequence shares with the sequences inserted before
+        """
+        node, depth = self.root, 0
+        while depth < len(token_ids):
+            if token_ids[depth] not in node.children:
+                node.children[token_ids[depth]] = (tuple(token_ids[depth:]), TokenPrefixTrie._Node())
+                return depth
+            edge, child = node.children[token_ids[depth]]
+            shared = common_prefix_length(edge, token_ids[depth:])
+            if shared < len(edge):
+                middle = self._split(node, edge, child, shared)
+                if depth + shared < len(token_ids):
+                    middle.children[token_ids[depth + shared]] = (tuple(token_ids[depth + shared:]),
+                                                                  TokenPrefixTrie._Node())
+                return depth + shared
+            node, depth = child, depth + len(edge)
+        return depth
+
+    def longest_value(self, token_ids: Sequence[int]) -> Tuple[int, Any]:
+        """
+        :return: the length of the longest prefix of the sequence whose node holds a value and this value; or 0, None
+        """
+        node, depth = self.root, 0
+        length, value = 0, None
+        while depth < len(token_ids) and token_ids[depth] in node.children:
+            edge, child = node.children[token_ids[depth]]
+            if common_prefix_length(edge, token_ids[depth:]) < len(edge):
+                break
+            node, depth = child, depth + len(edge)
+            if node.value is not None:
+                length, value = depth, node.value
+        return length, value
+
+    def set_value(self, token_ids: Sequence[int], value: Any):
+        """
+        Set the value of the node of a sequence; the sequence is inserted, if necessary.
+        :param value: None to remove the value
+        """
+        self.insert(token_ids)
+        node, depth = self.root, 0
+        while depth < len(token_ids):
+            edge, child = node.children[token_ids[depth]]
+            shared = common_prefix_length(edge, token_ids[depth:])
+            if shared < len(edge):
+                child = self._split(node, edge, child, shared)
+            node, depth = child, depth + shared
+        node.value = value
+
+    def _split(self, node: "TokenPrefixTrie._Node", edge: Tuple[int, ...], child: "TokenPrefixTrie._Node",
+               length: int) -> "TokenPrefixTrie._Node":
+        """
+        :return: a new node after the first length tokens of the edge from node to child
+        """
+        middle = TokenPrefixTrie._Node()
+        middle.children[edge[length]] = (edge[length:], child)
+        node.children[edge[0]] = (edge[:length], middle)
+        return middle
+
+
+class PrefixStateCache:
+    """
+    The model states (e.g. the past key values) after the prompt prefixes that are common to the prompts of several
+    calls, for example the game instructions at the start of all episodes of an experiment. A new prompt starts from
+    the state of its longest cached prefix instead of being evaluated from scratch.
+
+    The common prefixes are detected by inserting the prompts into a TokenPrefixTrie: when a prompt shares at least
+    min_tokens tokens with an earlier prompt, the state after the shared tokens is stored. At most max_states states
+    are kept (least recently used states are removed first).
+    """
+
+    def __init__(self, max_states: int = 4, min_tokens: int = 64):
+        self.max_states = max_states
+        self.min_tokens = min_tokens
+        self.trie = TokenPrefixTrie()
+        self.states: OrderedDict = OrderedDict()  # the prefixes with states in the order of their use
+        self.lock = threading.Lock()
+
+    def lookup(self, token_ids: Sequence[int]) -> Tuple[int, Any]:
+        """
+        :return: the number of tokens of the longest prefix with a state and this state; or 0, None
+        """
+        with self.lock:
+            length, state = self.trie.longest_value(token_ids)
+            if state is not None:
+                self.states.move_to_end(tuple(token_ids[:length]))
+            return length, state
+
+    def update(self, token_ids: Sequence[int], get_state: Callable[[int], Any]):
+        """
+        Insert the prompt and store the state of the prefix shared with an earlier prompt (if it is long enough).
+        :param get_state: returns the state after the given number of tokens of the prompt
+        """
+        with self.lock:
+            cached_length, _ = self.trie.longest_value(token_ids)
+            shared_length = self.trie.insert(token_ids)
+            if shared_length < self.min_tokens or shared_length <= cached_length:
+                return
+            prefix = tuple(token_ids[:shared_length])
+            self.trie.set_value(prefix, get_state(shared_length))
+            self.states[prefix] = None
+            while len(self.states) > self.max_states:
+                evicted, _ = self.states.popitem(last=False)
+                self.trie.set_value(evicted, None)
+            logger.info("Cached the state of a common prompt prefix of %s tokens", shared_length)
+
+    def clear(self):
+        with self.lock:
+            self.trie = TokenPrefixTrie()
+            self.states.clear()
+
+
+class DialogueKVCache:
+    """
+    The past key values of the recent dialogues of a model, so that the next turn of a dialogue only prefills the
+    tokens of the newly appended messages instead of the whole history.
+
+    An entry is stored under the hash of the messages of a call and looked up by the hashes of the message prefixes
+    of a later call. Whether the cached tokens actually match the new prompt is checked token by token by the caller.
+    The entries of finished episodes are removed and at most max_dialogues entries are kept (least recently used
+    entries are removed first).
+    """
+
+    def __init__(self, max_dialogues: int = 8):
+        self.max_dialogues = max_dialogues
+        self.entries: OrderedDict = OrderedDict()  # hash -> (episode ref, token ids, legacy past key values)
+        self.lock = threading.Lock()
+
+    def lookup(self, messages: List[Dict]) -> Optional[Tuple[List[int], Any]]:
+        """
+        :return: the token ids and past key values of the longest cached message prefix; or None
+        """
+        with self.lock:
+            for prefix_hash in reversed(message_prefix_hashes(messages)):
+                if prefix_hash in self.entries:
+                    _, token_ids, past_key_values = self.entries.pop(prefix_hash)  # the dialogue moves on
+                    return token_ids, past_key_values
+        return None
+
+    def store(self, messages: List[Dict], token_ids: List[int], past_key_values: Any):
+        episode = get_current_episode()
+        episode_ref = weakref.ref(episode) if episode is not None else None
+        with self.lock:
+            for key in [key for key, (ref, _, _) in self.entries.items() if ref is not None and ref() is None]:
+                del self.entries[key]  # the episode is finished
+            self.entries[message_prefix_hashes(messages)[-1]] = (episode_ref, token_ids, past_key_values)
+            while len(self.entries) > self.max_dialogues:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class GenerationBatcher:
+    """
+    Coalesces the generation requests that concurrent episodes make to the same model into padded batches.
+
+    A background thread takes the first pending request and waits up to max_wait_ms for further requests (with the
+    same generation arguments) until max_batch_size requests are collected. These are generated at once and the
+    results are routed back to the waiting callers. A request that is not joined by others is handed back to its
+    caller, so that it is generated on its own (with the dialogue and prefix caches).
+    """
+
+    def __init__(self, generate_batch_fn: Callable[[List[List[int]], Dict], List[List[int]]],
+                 max_batch_size: int, max_wait_ms: float = 10):
+        """
+        :param generate_batch_fn: to generate the continuations of several prompts with the given generation arguments
+        """
+        self.generate_batch_fn = generate_batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests: queue.Queue = queue.Queue()
+        self.thread: threading.Thread = None
+        self.lock = threading.Lock()
+
+    def generate(self, prompt_token_ids: List[int], generation_kwargs: Dict) -> Optional[Tuple[List[int], int]]:
+        """
+        :return: the prompt and generated token ids and the batch size; or None, if the request was not batched
+        """
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="generation-batcher", daemon=True)
+                self.thread.start()
+        future = Future()
+        self.requests.put((prompt_token_ids, generation_kwargs, future))
+        return future.result()
+
+    def stop(self):
+        with self.lock:
+            if self.thread is not None:
+                self.requests.put(None)
+                self.thread = None
+
+    def _run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            pending = [request]
+            deadline = time.monotonic() + self.max_wait
+            while len(pending) < self.max_batch_size:
+                try:
+                    request = self.requests.get(timeout=max(0., deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.requests.put(None)  # stop after this batch
+                    break
+                pending.append(request)
+            batches: Dict[str, List] = dict()
+            for request in pending:
+                batches.setdefault(json.dumps(request[1], sort_keys=True), []).append(request)
+            for batch in batches.values():
+                self._generate(batch)
+
+    def _generate(self, batch: List[Tuple[List[int], Dict, Future]]):
+        if len(batch) == 1:
+            batch[0][2].set_result(None)
+            return
+        try:
+            outputs = self.generate_batch_fn([prompt_token_ids for prompt_token_ids, _, _ in batch], batch[0][1])
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, _, future), output_ids in zip(batch, outputs):
+            future.set_result((output_ids, len(batch)))
+
+
+class IncrementalTokenizer:
+    """
+    Tokenizes the prompts of growing chat histories incrementally: the prompt text and token ids of a call are kept
+    under the hash of its messages, and a later call whose messages extend these only tokenizes the appended text.
+
+    This requires that the chat template renders the history as a prefix of the longer history (checked for each
+    call) and that the tokenization of the appended text does not depend on the text before. The latter is checked by
+    comparing incremental tokenizations with full ones: the first one of each shape (the role of the last kept message
+    and the roles of the appended ones, which determine the text at the junction) and then every verify_every-th one.
+    On a mismatch, e.g. because the tokenizer adds a prefix space, each prompt is tokenized in full.
+    """
+
+    def __init__(self, tokenize_fn: Callable[[str], List[int]], max_dialogues: int = 32, verify_every: int = 64):
+        """
+        :param tokenize_fn: to tokenize a text (without adding special tokens like BOS)
+        :param verify_every: the interval of the sampled verifications; or 0, to verify no tokenization
+        """
+        self.tokenize_fn = tokenize_fn
+        self.max_dialogues = max_dialogues
+        self.verify_every = verify_every
+        self.is_incremental = True
+        self.entries: OrderedDict = OrderedDict()  # hash of the messages -> (prompt text, token ids)
+        self.verified_shapes = set()
+        self.num_incremental = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, messages: List[Dict], prompt_text: str) -> List[int]:
+        """
+        :param prompt_text: the messages rendered by the chat template
+        :return: the token ids of the prompt text
+        """
+        prefix_hashes = message_prefix_hashes(messages)
+        cached, verify = None, False
+        with self.lock:
+            if self.is_incremental:
+                for prefix_idx in reversed(range(len(prefix_hashes))):
+                    if prefix_hashes[prefix_idx] in self.entries:
+                        cached = self.entries.pop(prefix_hashes[prefix_idx])  # the dialogue moves on
+                        break
+            if cached is not None and prompt_text.startswith(cached[0]) and self.verify_every > 0:
+                shape = tuple(message["role"] for message in messages[prefix_idx:])
+                self.num_incremental += 1
+                verify = shape not in self.verified_shapes or self.num_incremental % self.verify_every == 0
+                self.verified_shapes.add(shape)
+        if cached is not None and prompt_text.startswith(cached[0]):
+            token_ids = cached[1] + self.tokenize_fn(prompt_text[len(cached[0]):])
+            if verify:
+                full_token_ids = self.tokenize_fn(prompt_text)
+                if full_token_ids != token_ids:
+                    logger.warning("The incremental tokenization differs from the full one; tokenize in full")
+                    token_ids = full_token_ids
+                    with self.lock:
+                        self.is_incremental = False
+                        self.entries.clear()
+        else:
+            token_ids = self.tokenize_fn(prompt_text)
+        with self.lock:
+            if self.is_incremental:
+                self.entries[prefix_hashes[-1]] = (prompt_text, token_ids)
+                while len(self.entries) > self.max_dialogues:
+                    self.entries.popitem(last=False)
+        return token_ids
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def message_prefix_hashes(messages: List[Dict]) -> List[str]:
+    """
+    :return: the hashes of messages[:1], messages[:2], ..., messages
+    """
+    digest = hashlib.sha256()
+    hashes = []
+    for message in messages:
+        digest.update(json.dumps(message, sort_keys=True).encode("utf-8"))
+        hashes.append(digest.hexdigest())
+    return hashes
+
+
+def find_stop_sequence(text: str, stop_sequences: List[str]) -> int:
+    """
+    Find the first stop sequence that occurs after the first non-whitespace character of a generated text, so that
+    e.g. a newline stop sequence does not end a response that starts with a newline.
+    :return: the index of the first stop sequence in the text; or -1, if there is none
+    """
+    content_start = len(text) - len(text.lstrip())
+    indices = [text.find(stop_sequence, content_start + 1) for stop_sequence in stop_sequences if stop_sequence]
+    indices = [index for index in indices if index >= 0]
+    return min(indices) if indices else -1
+
+
+def uses_player_stop_sequences(model_spec: Any) -> bool:
+    """
+    The stop sequences of the players cut off the rest of a response before the game master checks it, so that they
+    change the game results; they are only used, if the model entry opts in with player_stop_sequences.
+    :param model_spec: the ModelSpec of a local model
+    """
+    return model_spec.has_attr("player_stop_sequences") and bool(model_spec["player_stop_sequences"])
+
+
+def uses_constrained_decoding(model_spec: Any) -> bool:
+    """
+    Responses constrained to the response pattern of the players cannot violate the format that the game master
+    checks, so that they change the game results; they are only constrained, if the model entry opts in with
+    constrained_decoding.
+    :param model_spec: the ModelSpec of a local model
+    """
+    return model_spec.has_attr("constrained_decoding") and bool(model_spec["constrained_decoding"])
+
+
+def collect_stop_sequences(model_spec: Any, stop_sequences: List[str]) -> List[str]:
+    """
+    :param model_spec: the ModelSpec of a local model
+    :param stop_sequences: the stop sequences of the calling player (only used, see uses_player_stop_sequences())
+    :return: the stop sequences of the model entry, its EOS string to cull and the given ones (without duplicates)
+    """
+    collected = list(model_spec["stop_sequences"]) if model_spec.has_attr("stop_sequences") else []
+    if model_spec.has_attr("eos_to_cull") and model_spec["eos_to_cull"]:
+        collected.append(model_spec["eos_to_cull"])
+    if not uses_player_stop_sequences(model_spec):
+        return collected
+    for stop_sequence in stop_sequences:
+        if stop_sequence not in collected:
+            collected.append(stop_sequence)
+    return collected
+
+
+def truncate_at_stop_sequence(text: str, stop_sequences: List[str]) -> str:
+    """
+    :return: the text before the first stop sequence (see find_stop_sequence())
+    """
+    index = find_stop_sequence(text, stop_sequences)
+    return text[:index] if index >= 0 else text
+
+
+def assisted_generation_info(num_generated: int, num_steps: int, num_draft_tokens: int) -> Dict:
+    """
+    The statistics of an assisted generation, in which each step of the model adds the accepted draft tokens and one
+    token of its own.
+    :param num_generated: the number of generated tokens
+    :param num_steps: the number of forward passes of the model
+    :param num_draft_tokens: the number of tokens proposed by the draft model
+    :return: the draft tokens, the accepted ones, their acceptance rate and the generated tokens per step
+    """
+    num_accepted = max(0, num_generated - num_steps)
+    return {
+        'draft_tokens': num_draft_tokens,
+        'accepted_draft_tokens': num_accepted,
+        'acceptance_rate': round(num_accepted / num_draft_tokens, 3) if num_draft_tokens else 0.,
+        'tokens_per_step': round(num_generated / num_steps, 3) if num_steps else 0.
+    }
+
+
+def common_prefix_length(token_ids: Sequence[int], other_token_ids: Sequence[int]) -> int:
+    """
+    :return: the number of leading token ids that both sequences have in common
+    """
+    length = 0
+    for token_id, other_token_id in zip(token_ids, other_token_ids):
+        if token_id != other_token_id:
+            break
+        length += 1
+    return length
+
+
+def results_root(results_dir: str = None) -> str:
+    """
+    :param results_dir: the results directory (default: 'results'); relative ones are relative to the project root
+    :return: the absolute path of the results directory
+    """
+    results_dir = "results" if results_dir is None else results_dir
+    if os.path.isabs(results_dir):
+        return results_dir
+    return os.path.join(project_root, results_dir)
+
+
+def to_timedelta(duration: str) -> timedelta:
+    """
+    :param duration: as produced by str(timedelta) e.g. '0:01:23.456789' or '1 day, 2:03:04'
+    :return: the parsed timedelta
+    """
+    days = 0
+    if "day" in duration:
+        days_str, duration = duration.split(",")
+        days = int(days_str.split()[0])
+    hours, minutes, seconds = duration.strip().split(":")
+    return timedelta(days=days, hours=int(hours), minutes=int(minutes), seconds=float(seconds))
+
+
 def check_context_limit_generic(context_size: int, prompt_tokens: List, model_name: str, max_new_tokens: int = 100) \
         -> Tuple[bool, int, int, int]:
     """
@@ -1,12 +1,24 @@
 """ Main entry point """
-from typing import List, Dict
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import List, Dict, Union, Tuple
 
 import backends
 import clemgame
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from clemgame.clemgame import load_benchmarks, load_benchmark
+from clemgame import file_utils
+from clemgame.budget import RunBudget, EPISODE_PLAYED, EPISODE_FAILED, EPISODE_FAILED_TRANSIENT, \
+    EPISODE_ABORTED_BY_TIMEOUT
+from clemgame.failures import is_transient_error
+from clemgame.clemgame import load_benchmarks, load_benchmark, GameBenchmark
+from clemgame.response_cache import ResponseCache, CACHE_OFF, CACHE_FILE_NAME
+from clemgame.scheduling import EpisodeCostEstimator, longest_first, order_for_model_reuse
+from clemgame.workqueue import WorkQueue, Heartbeat, Job
 
 logger = clemgame.get_logger(__name__)
 stdout_logger = clemgame.get_logger("benchmark.run")
@@ -26,23 +38,133 @@ def list_games():
         stdout_logger.info(" Game: %s -> %s", game.name, game.get_description())
 
 
-def run(game_name: str, model_specs: List[backends.ModelSpec], gen_args: Dict,
-        experiment_name: str = None, instances_name: str = None, results_dir: str = None):
+def run(game_name: Union[str, List[str]], model_specs: List[backends.ModelSpec], gen_args: Dict,
+        experiment_name: str = None, instances_name: str = None, results_dir: str = None,
+        parallel_episodes: int = 1, max_concurrent_games: int = 1, use_async: bool = False,
+        resume: bool = False, shard: Tuple[int, int] = None, max_wall_time: timedelta = None,
+        max_requests: int = None, max_total_tokens: int = None, episode_retries: int = 2,
+        retry_backoff: float = 10., call_timeout: float = None, episode_timeout: float = None,
+        cache_mode: str = CACHE_OFF, cache_path: str = None, cache_max_mb: float = 1024., lockstep: bool = False):
+    """
+    Run one or more games in this process. The player models are loaded only once and shared by all games.
+
+    :param game_name: a game name, a list of game names or 'all'
+    :param max_concurrent_games: the number of games to be played at the same time (default: 1)
+    :param use_async: play the concurrent episodes of an experiment with asyncio instead of threads
+    :param resume: skip the episodes that have already been completed by a previous run to the results_dir
+    :param shard: a tuple (i, n) to only play the i-th of n disjoint slices of the game instances
+    :param max_wall_time: stop the run (gracefully) after this time
+    :param max_requests: stop the run (gracefully) after this number of model requests
+    :param max_total_tokens: stop the run (gracefully) after this number of tokens
+    :param episode_retries: the number of times an episode with a transient failure (e.g. a rate limit) is retried
+    :param retry_backoff: the seconds to wait before the first retry of an episode (doubled for further retries)
+    :param call_timeout: the seconds after which a model call is aborted (unless the model spec has a call_timeout)
+    :param episode_timeout: the seconds after which an episode is aborted
+    :param cache_mode: 'read' or 'write' to look up the responses of deterministic calls in a response cache
+    :param cache_path: the cache file (default: response_cache.sqlite in the results root)
+    :param cache_max_mb: the maximal size of the cache file, before the least recently used responses are removed
+    :param lockstep: advance the concurrent episodes of an experiment together, so that the calls to local models
+                     are generated in batches
+    """
+    game_names = [game_name] if isinstance(game_name, str) else list(game_name)
     if experiment_name:
         logger.info("Only running experiment: %s", experiment_name)
     try:
-        player_models = []
-        for model_spec in model_specs:
-            model = backends.get_model_for(model_spec)
-            model.set_gen_args(**gen_args)  # todo make this somehow available in generate method?
-            player_models.append(model)
-        benchmark = load_benchmark(game_name, instances_name=instances_name)
-        logger.info("Running benchmark for '%s' (models=%s)", game_name,
+        # identical model specs share the same (loaded) model
+        player_models = backends.load_models(model_specs, gen_args)
+        if "all" in game_names:
+            games_list = load_benchmarks(do_setup=False)
+        else:
+            games_list = [load_benchmark(name, do_setup=False) for name in game_names]
+    except Exception as e:
+        stdout_logger.exception(e)
+        logger.error(e, exc_info=True)
+        return
+    with _response_cache(cache_mode, cache_path, cache_max_mb, results_dir):
+        if max_wall_time is None and max_requests is None and max_total_tokens is None:
+            _run_games(games_list, player_models, experiment_name, instances_name, results_dir, parallel_episodes,
+                       max_concurrent_games, use_async, resume, shard, episode_retries, retry_backoff, call_timeout,
+                       episode_timeout, lockstep)
+            return
+        with RunBudget(max_wall_time, max_requests, max_total_tokens) as budget:
+            _run_games(games_list, player_models, experiment_name, instances_name, results_dir, parallel_episodes,
+                       max_concurrent_games, use_async, resume, shard, episode_retries, retry_backoff, call_timeout,
+                       episode_timeout, lockstep)
+    budget.store_summary(results_dir)
+
+
+def sweep(game_name: Union[str, List[str]], dialogue_pairs: List[List[backends.ModelSpec]], gen_args: Dict,
+          max_model_memory: float = None, **run_kwargs):
+    """
+    Run the games for each of the dialogue pairs in this process, e.g. to evaluate several local models one after the
+    other. The dialogue pairs are ordered, so that the models in the pool are reused as far as possible.
+
+    :param dialogue_pairs: the model specs of each dialogue pair (a single model plays all roles)
+    :param max_model_memory: the gigabytes the loaded models may hold, before the least recently used ones are
+                             evicted from the model pool (default: no limit)
+    :param run_kwargs: the further arguments of run()
+    """
+    if max_model_memory is not None:
+        backends.set_model_memory_budget(int(max_model_memory * 1024 ** 3))
+    dialogue_pairs = order_for_model_reuse(dialogue_pairs, backends.is_model_loaded,
+                                           key=lambda model_spec: str(backends.unify_model_spec(model_spec)))
+    for idx, dialogue_pair in enumerate(dialogue_pairs):
+        stdout_logger.info(f"Run dialogue pair {idx + 1} of {len(dialogue_pairs)}: "
+                           f"{[model_spec.model_name for model_spec in dialogue_pair]}")
+        run(game_name, dialogue_pair, gen_args, **run_kwargs)
+
+
+def _response_cache(cache_mode: str, cache_path: str = None, cache_max_mb: float = 1024., results_dir: str = None):
+    """
+    :return: the response cache to be activated for the run; or a null context, when the cache is off
+    """
+    if cache_mode is None or cache_mode == CACHE_OFF:
+        return nullcontext()
+    if cache_path is None:
+        cache_path = os.path.join(file_utils.results_root(results_dir), CACHE_FILE_NAME)
+    return ResponseCache(cache_path, cache_mode, cache_max_mb)
+
+
+def _run_games(games_list: List[GameBenchmark], player_models: List[backends.Model], experiment_name: str = None,
+               instances_name: str = None, results_dir: str = None, parallel_episodes: int = 1,
+               max_concurrent_games: int = 1, use_async: bool = False, resume: bool = False,
+               shard: Tuple[int, int] = None, episode_retries: int = 2, retry_backoff: float = 10.,
+               call_timeout: float = None, episode_timeout: float = None, lockstep: bool = False):
+    total_games = len(games_list)
+    if max_concurrent_games <= 1 or total_games <= 1:
+        for idx, benchmark in enumerate(games_list):
+            stdout_logger.info(f"Run game {idx + 1} of {total_games}: {benchmark.name}")
+            _run_benchmark(benchmark, player_models, experiment_name, instances_name, results_dir,
+                           parallel_episodes, use_async, resume, shard, episode_retries, retry_backoff,
+                           call_timeout, episode_timeout, lockstep)
+        return
+    # start the most expensive games first, so that they do not run alone at the end
+    games_list = _longest_expected_first(games_list, experiment_name, instances_name, results_dir)
+    with ThreadPoolExecutor(max_workers=max_concurrent_games) as executor:
+        for benchmark in games_list:
+            executor.submit(_run_benchmark, benchmark, player_models, experiment_name, instances_name, results_dir,
+                            parallel_episodes, use_async, resume, shard, episode_retries, retry_backoff,
+                            call_timeout, episode_timeout, lockstep)
+
+
+def _run_benchmark(benchmark: GameBenchmark, player_models: List[backends.Model], experiment_name: str = None,
+                   instances_name: str = None, results_dir: str = None, parallel_episodes: int = 1,
+                   use_async: bool = False, resume: bool = False, shard: Tuple[int, int] = None,
+                   episode_retries: int = 2, retry_backoff: float = 10., call_timeout: float = None,
+                   episode_timeout: float = None, lockstep: bool = False):
+    try:
+        if benchmark.instances is None:  # might have been set up for scheduling already
+            benchmark.setup(instances_name)
+        logger.info("Running benchmark for '%s' (models=%s)", benchmark.name,
                     player_models if player_models is not None else "see experiment configs")
-        if experiment_name:
+        if experiment_name and experiment_name not in benchmark.filter_experiment:
             benchmark.filter_experiment.append(experiment_name)
         time_start = datetime.now()
-        benchmark.run(player_models=player_models, results_dir=results_dir)
+        # copy the list, because a game might expand the models for two players
+        benchmark.run(player_models=list(player_models), results_dir=results_dir,
+                      parallel_episodes=parallel_episodes, use_async=use_async, resume=resume, shard=shard,
+                      episode_retries=episode_retries, retry_backoff=retry_backoff,
+                      call_timeout=call_timeout, episode_timeout=episode_timeout, lockstep=lockstep)
         time_end = datetime.now()
         logger.info(f"Run {benchmark.name} took {str(time_end - time_start)}")
     except Exception as e:
@@ -50,6 +172,143 @@ def run(game_name: str, model_specs: List[backends.ModelSpec], gen_args: Dict,
         logger.error(e, exc_info=True)
 
 
+def _longest_expected_first(games_list: List[GameBenchmark], experiment_name: str = None,
+                            instances_name: str = None, results_dir: str = None) -> List[GameBenchmark]:
+    """
+    :return: the games sorted by their expected number of requests (descending)
+    """
+    cost_estimator = EpisodeCostEstimator(file_utils.results_root(results_dir))
+    costs = []
+    for benchmark in games_list:
+        try:
+            benchmark.setup(instances_name)
+            if experiment_name:
+                benchmark.filter_experiment.append(experiment_name)
+            costs.append(benchmark.expected_cost(cost_estimator))
+        except Exception as e:  # the error is reported, when the game is run
+            logger.warning("Cannot estimate the cost of %s: %s", benchmark.name, e)
+            costs.append(0.)
+    logger.info("Expected requests by game: %s", {b.name: cost for b, cost in zip(games_list, costs)})
+    return longest_first(games_list, costs)
+
+
+def work(game_name: Union[str, List[str]] = None, model_specs: List[backends.ModelSpec] = None,
+         gen_args: Dict = None, experiment_name: str = None, instances_name: str = None,
+         results_dir: str = None, worker_id: str = None, lease_seconds: float = 300.,
+         max_attempts: int = 3, poll_seconds: float = 10., call_timeout: float = None,
+         episode_timeout: float = None, cache_mode: str = CACHE_OFF, cache_path: str = None,
+         cache_max_mb: float = 1024., max_model_memory: float = None):
+    """
+    Play the jobs of the work queue in the results directory until all jobs are done. Several workers
+    (also on different machines that share the results directory) can be started at any time.
+
+    When games are given, then their episodes are added to the queue first. Jobs that are already in the queue
+    are not added again, so that all workers can be started with the same arguments.
+
+    :param game_name: a game name, a list of game names or 'all' (optional)
+    :param worker_id: a name for this worker in the queue (default: hostname-pid)
+    :param lease_seconds: a job is given to another worker, when it is not renewed (every lease_seconds/3)
+    :param max_attempts: the number of times a job with transient failures is played before it is marked as failed
+    :param poll_seconds: the time to wait, when all remaining jobs are currently leased by other workers
+    :param call_timeout: the seconds after which a model call is aborted (unless the model spec has a call_timeout)
+    :param episode_timeout: the seconds after which an episode is aborted
+    :param cache_mode: 'read' or 'write' to look up the responses of deterministic calls in a response cache
+    :param cache_path: the cache file (default: response_cache.sqlite in the results root)
+    :param cache_max_mb: the maximal size of the cache file, before the least recently used responses are removed
+    :param max_model_memory: the gigabytes the loaded models may hold, before the least recently used ones are
+                             evicted from the model pool (default: no limit)
+    """
+    if max_model_memory is not None:
+        backends.set_model_memory_budget(int(max_model_memory * 1024 ** 3))
+    results_root = file_utils.results_root(results_dir)
+    queue = WorkQueue(results_root)
+    if game_name:
+        if not enqueue(queue, game_name, model_specs, gen_args, experiment_name, instances_name):
+            return
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    stdout_logger.info(f"Worker {worker_id} started with jobs: {queue.count_by_status()}")
+    benchmarks: Dict[Tuple[str, str], GameBenchmark] = dict()
+    with _response_cache(cache_mode, cache_path, cache_max_mb, results_root):
+        while True:
+            job = queue.lease(worker_id, lease_seconds)
+            if job is None:
+                job_counts = queue.count_by_status()
+                if job_counts.get("leased", 0) == 0:
+                    break  # the leases of the other workers might still expire, so we wait for them
+                time.sleep(poll_seconds)
+                continue
+            stdout_logger.info(f"Worker {worker_id} plays job {job.job_id}: {job.game_name} "
+                               f"{job.experiment_idx}_{job.experiment_name}/episode_{job.episode_idx}")
+            with Heartbeat(queue, job, worker_id, lease_seconds):
+                status = _play_job(job, benchmarks, results_root, call_timeout, episode_timeout)
+            if status in [EPISODE_PLAYED, EPISODE_ABORTED_BY_TIMEOUT]:
+                queue.complete(job, worker_id)
+            elif status == EPISODE_FAILED_TRANSIENT:
+                queue.fail(job, worker_id, max_attempts)
+            else:  # the job would fail again
+                queue.fail(job, worker_id, max_attempts=job.attempts)
+    stdout_logger.info(f"Worker {worker_id} stopped with jobs: {queue.count_by_status()}")
+
+
+def enqueue(queue: WorkQueue, game_name: Union[str, List[str]], model_specs: List[backends.ModelSpec],
+            gen_args: Dict, experiment_name: str = None, instances_name: str = None) -> bool:
+    """
+    Add a job for each episode of the games to the queue. The dialogue partners configured in an experiment
+    are used, when no model specs are given.
+
+    :return: False, if the games could not be loaded
+    """
+    game_names = [game_name] if isinstance(game_name, str) else list(game_name)
+    instances_name = instances_name or "instances"
+    try:
+        if "all" in game_names:
+            game_names = [benchmark.name for benchmark in load_benchmarks(do_setup=False)]
+        games_list = [load_benchmark(name, instances_name=instances_name) for name in game_names]
+    except Exception as e:
+        stdout_logger.exception(e)
+        logger.error(e, exc_info=True)
+        return False
+    jobs = []
+    cost_estimator = EpisodeCostEstimator(queue.results_root)
+    for benchmark in games_list:
+        for experiment_idx, experiment in enumerate(benchmark.instances["experiments"]):
+            if experiment_name and experiment["name"] != experiment_name:
+                continue
+            if model_specs:
+                dialogue_partners = [[model_spec.__dict__ for model_spec in model_specs]]
+            else:
+                dialogue_partners = [[{"model_name": model_name} for model_name in dialogue_pair_names]
+                                     for dialogue_pair_names in experiment.get("dialogue_partners", [])]
+            for dialogue_pair in dialogue_partners:
+                for episode_idx, game_instance in enumerate(experiment["game_instances"]):
+                    expected_cost = benchmark.expected_episode_cost(experiment_idx, experiment, episode_idx,
+                                                                    game_instance, cost_estimator)
+                    jobs.append(dict(game_name=benchmark.name, instances_name=instances_name,
+                                     experiment_idx=experiment_idx, experiment_name=experiment["name"],
+                                     episode_idx=episode_idx, model_specs=dialogue_pair, gen_args=gen_args,
+                                     expected_cost=expected_cost))
+    added = queue.add_jobs(jobs)
+    stdout_logger.info(f"Added {added} of {len(jobs)} jobs to the queue at {queue.db_path}")
+    return True
+
+
+def _play_job(job: Job, benchmarks: Dict[Tuple[str, str], GameBenchmark], results_root: str,
+              call_timeout: float = None, episode_timeout: float = None) -> str:
+    try:
+        benchmark_key = (job.game_name, job.instances_name)
+        if benchmark_key not in benchmarks:
+            benchmarks[benchmark_key] = load_benchmark(job.game_name, instances_name=job.instances_name)
+        # models are loaded only once per worker
+        player_models = backends.load_models(job.model_specs, job.gen_args)
+        return benchmarks[benchmark_key].play_job(job.experiment_idx, job.episode_idx, player_models,
+                                                  results_dir=results_root, call_timeout=call_timeout,
+                                                  episode_timeout=episode_timeout)
+    except Exception as e:
+        stdout_logger.exception(e)
+        logger.error(e, exc_info=True)
+        return EPISODE_FAILED_TRANSIENT if is_transient_error(e) else EPISODE_FAILED
+
+
 def score(game_name: str, experiment_name: str = None, results_dir: str = None):
     logger.info("Scoring benchmark for: %s", game_name)
     if experiment_name:
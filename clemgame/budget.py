@@ -0,0 +1,162 @@
+"""
+Run-wide budgets for the wall-clock time, the number of model requests and the number of tokens.
+
+The budget of a run is activated as a context manager (`with RunBudget(...) as budget: ...`) and then checked by
+each Player before a model is requested. When the budget is exhausted, the next request raises a
+BudgetExceededError, which interrupts the episode, and no new episodes are started. At the end of the run
+a summary of the played, failed, interrupted and not started episodes is stored to the results root.
+
+Note: Concurrent requests that have passed the check before the budget was exhausted are still completed.
+Hence, a run might exceed the request and token limits by the requests of at most the concurrent episodes.
+"""
+import json
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import clemgame
+from clemgame import file_utils
+
+logger = clemgame.get_logger(__name__)
+stdout_logger = clemgame.get_logger("benchmark.run")
+
+EPISODE_PLAYED = "played"
+EPISODE_FAILED = "failed"
+EPISODE_FAILED_TRANSIENT = "failed_transient"
+EPISODE_INTERRUPTED = "interrupted"
+EPISODE_NOT_STARTED = "not_started"
+EPISODE_ABORTED_BY_TIMEOUT = "aborted_by_timeout"
+
+_active_budget: Optional["RunBudget"] = None
+
+
+class BudgetExceededError(Exception):
+    """
+    Exception to be raised when a model would be requested, although the budget of the run is exhausted.
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(f"Run budget exhausted: {reason}")
+        self.reason = reason
+
+
+class RunBudget:
+
+    def __init__(self, max_wall_time: timedelta = None, max_requests: int = None, max_tokens: int = None):
+        """
+        :param max_wall_time: the time after which no more requests are allowed (counted from activation)
+        :param max_requests: the number of model requests allowed for the whole run
+        :param max_tokens: the number of tokens (prompt and completion) allowed for the whole run
+        """
+        self.max_wall_time = max_wall_time
+        self.max_requests = max_requests
+        self.max_tokens = max_tokens
+        self.start_time: datetime = None
+        self.num_requests = 0
+        self.num_tokens = 0
+        self.episodes: List[Dict] = []
+        self.__lock = threading.Lock()
+
+    def __enter__(self):
+        global _active_budget
+        self.start_time = datetime.now()
+        _active_budget = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _active_budget
+        _active_budget = None
+
+    def exhausted_reason(self, delay: float = 0.) -> Optional[str]:
+        """
+        :param delay: the seconds to wait before the next request
+        :return: a description of the exhausted limit; or None, when the budget is not exhausted yet
+        """
+        if self.max_wall_time is not None \
+                and datetime.now() + timedelta(seconds=delay) - self.start_time >= self.max_wall_time:
+            return f"max_wall_time of {self.max_wall_time} reached"
+        if self.max_requests is not None and self.num_requests >= self.max_requests:
+            return f"max_requests of {self.max_requests} reached"
+        if self.max_tokens is not None and self.num_tokens >= self.max_tokens:
+            return f"max_tokens of {self.max_tokens} reached"
+        return None
+
+    def check(self):
+        """
+        :raises BudgetExceededError: when the budget is exhausted
+        """
+        reason = self.exhausted_reason()
+        if reason:
+            raise BudgetExceededError(reason)
+
+    def add_request(self, prompt: Any, response: Any, response_text: str):
+        num_tokens = count_tokens(prompt, response, response_text)
+        with self.__lock:
+            self.num_requests += 1
+            self.num_tokens += num_tokens
+
+    def add_episode(self, status: str, game_name: str, dialogue_pair_desc: str, episode_dir: str):
+        """
+        :param status: one of 'played', 'aborted_by_timeout', 'failed', 'failed_transient', 'interrupted'
+                       or 'not_started'
+        :param episode_dir: the episode directory relative to the game results e.g. 0_experiment/episode_0
+        """
+        with self.__lock:
+            self.episodes.append(dict(status=status, game=game_name, dialogue_pair=dialogue_pair_desc,
+                                      episode=episode_dir))
+
+    def summary(self) -> Dict:
+        episodes_by_status = {status: [episode for episode in self.episodes if episode["status"] == status]
+                              for status in [EPISODE_PLAYED, EPISODE_ABORTED_BY_TIMEOUT, EPISODE_FAILED,
+                                             EPISODE_FAILED_TRANSIENT, EPISODE_INTERRUPTED, EPISODE_NOT_STARTED]}
+        return {
+            "budget": {
+                "max_wall_time": None if self.max_wall_time is None else str(self.max_wall_time),
+                "max_requests": self.max_requests,
+                "max_tokens": self.max_tokens
+            },
+            "used": {
+                "wall_time": str(datetime.now() - self.start_time),
+                "requests": self.num_requests,
+                "tokens": self.num_tokens
+            },
+            "exhausted": self.exhausted_reason(),
+            "counts": {status: len(episodes) for status, episodes in episodes_by_status.items()},
+            "episodes": episodes_by_status
+        }
+
+    def store_summary(self, results_dir: str = None) -> str:
+        """
+        Store the summary as run_summary_<start time>.json to the results root.
+
+        :return: the file path
+        """
+        summary = self.summary()
+        file_name = f"run_summary_{self.start_time.strftime('%Y%m%d-%H%M%S')}.json"
+        file_path = file_utils.store_file(summary, file_name, file_utils.results_root(results_dir))
+        if summary["exhausted"]:
+            stdout_logger.warning(f"Run stopped early, because the {summary['exhausted']}: {summary['counts']}")
+        stdout_logger.info(f"Run summary stored to {file_path}")
+        return file_path
+
+
+def get_active_budget() -> Optional[RunBudget]:
+    """
+    :return: the budget of the current run; or None, if the run has no budget
+    """
+    return _active_budget
+
+
+def count_tokens(prompt: Any, response: Any, response_text: str) -> int:
+    """
+    :return: the total tokens reported in the usage of the response (OpenAI, Mistral, Anthropic);
+             otherwise a rough estimate of four characters per token of the prompt and response text
+    """
+    usage = response.get("usage") if isinstance(response, Dict) else None
+    if isinstance(usage, Dict):
+        if isinstance(usage.get("total_tokens"), int):
+            return usage["total_tokens"]
+        if isinstance(usage.get("input_tokens"), int):
+            return usage["input_tokens"] + usage.get("output_tokens", 0)
+    prompt_text = prompt if isinstance(prompt, str) else json.dumps(prompt, ensure_ascii=False, default=str)
+    return (len(prompt_text) + len(response_text or "")) // 4
@@ -1,16 +1,33 @@
 import abc
+import asyncio
 import collections
+import contextvars
 import copy
+import functools
 import os.path
-from datetime import datetime
-from typing import List, Dict, Tuple, Any
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import List, Dict, Tuple, Any, Optional
 
 from tqdm import tqdm
 
 import backends
 from backends import Model, CustomResponseModel, HumanModel
+from backends.context import episode_context, player_call_context
+from backends.utils import to_timedelta
 import clemgame
 from clemgame import file_utils, transcript_utils
+from clemgame.budget import get_active_budget, BudgetExceededError, \
+    EPISODE_PLAYED, EPISODE_FAILED, EPISODE_FAILED_TRANSIENT, EPISODE_INTERRUPTED, EPISODE_NOT_STARTED, \
+    EPISODE_ABORTED_BY_TIMEOUT
+from clemgame.failures import is_transient_error
+from clemgame.lockstep import Lockstep
+from clemgame.response_cache import get_active_cache
+from clemgame.scheduling import EpisodeCostEstimator, longest_first
+from clemgame.timeouts import call_with_timeout, acall_with_timeout, episode_timeouts, CallTimeoutError, \
+    EpisodeTimeoutError, STATUS_KEY, STATUS_ABORTED_BY_TIMEOUT, TIMEOUT_KEY
 import clemgame.metrics as ms
 
 logger = clemgame.get_logger(__name__)
@@ -27,11 +44,27 @@ class Player(abc.ABC):
     - the programmatic players are called via the _custom_response() method
     - the human players are called via the _terminal_response() method
     - the backend players are called via the generate_response() method of the backend
+
+    The backend players raise a BudgetExceededError instead, when the budget of the run is exhausted (see budget.py),
+    and a CallTimeoutError or EpisodeTimeoutError, when the model does not respond in time (see timeouts.py).
+    During a backend call, the response of the player as a programmatic player is available to the backend via
+    backends.context.get_programmatic_response() (e.g. for the synthetic backend).
+    A player might declare stop_sequences, so that local backends stop the generation as soon as the response contains
+    one of them (after its first non-whitespace character); the response then ends before the stop sequence. As this
+    cuts off the rest of a response before the game master checks it, only models whose entry opts in with
+    player_stop_sequences use them.
+    A player might also declare a response_pattern, a regular expression that its valid responses match at their start
+    (after leading whitespace), so that local backends only generate such responses, if the model entry opts in with
+    constrained_decoding (see backends/constraints.py).
+    When the run uses a response cache, then the cached responses are returned without requesting the model
+    (see response_cache.py).
     """
 
     def __init__(self, model: Model):
         self.model = model
         self.descriptor: str = None
+        self.stop_sequences: List[str] = []  # e.g. ["\n"] for single-line responses
+        self.response_pattern: str = None  # e.g. "GUESS:"
         logger.info("Player %s", self.get_description())
 
     def get_description(self) -> str:
@@ -46,7 +79,75 @@ class Player(abc.ABC):
         elif isinstance(self.model, HumanModel):
             response_text = self._terminal_response(messages, turn_idx)
         else:
-            prompt, response, response_text = self.model.generate_response(messages)
+            cache = get_active_cache()
+            cached = cache.lookup(self.model, messages, self.stop_sequences, self.response_pattern) \
+                if cache else None
+            if cached:
+                prompt, response, response_text = cached
+            else:
+                budget = get_active_budget()
+                if budget:
+                    budget.check()
+                with self._backend_call(messages, turn_idx):
+                    prompt, response, response_text = call_with_timeout(self.model, self.model.generate_response,
+                                                                        messages)
+                if budget:
+                    budget.add_request(prompt, response, response_text)
+                if cache:
+                    cache.store(self.model, messages, prompt, response, response_text, self.stop_sequences,
+                                self.response_pattern)
+            if cache:
+                response["clem_cache"] = {"hit": cached is not None}
+        self.__add_call_info(response, response_text, call_start)
+        return prompt, response, response_text
+
+    async def acall(self, messages: List[Dict], turn_idx) -> Tuple[Any, Any, str]:
+        """
+        Asynchronous variant of calling the player. Backend players are called via agenerate_response().
+        """
+        call_start = datetime.now()
+        prompt = messages
+        response = dict()
+        if isinstance(self.model, CustomResponseModel):
+            response_text = self._custom_response(messages, turn_idx)
+        elif isinstance(self.model, HumanModel):  # input() blocks, so we wait for it in another thread
+            loop = asyncio.get_running_loop()
+            response_text = await loop.run_in_executor(None, self._terminal_response, messages, turn_idx)
+        else:
+            cache = get_active_cache()
+            cached = cache.lookup(self.model, messages, self.stop_sequences, self.response_pattern) \
+                if cache else None
+            if cached:
+                prompt, response, response_text = cached
+            else:
+                budget = get_active_budget()
+                if budget:
+                    budget.check()
+                with self._backend_call(messages, turn_idx):
+                    prompt, response, response_text = await acall_with_timeout(self.model,
+                                                                                self.model.agenerate_response,
+                                                                                messages)
+                if budget:
+                    budget.add_request(prompt, response, response_text)
+                if cache:
+                    cache.store(self.model, messages, prompt, response, response_text, self.stop_sequences,
+                                self.response_pattern)
+            if cache:
+                response["clem_cache"] = {"hit": cached is not None}
+        self.__add_call_info(response, response_text, call_start)
+        return prompt, response, response_text
+
+    @contextmanager
+    def _backend_call(self, messages: List[Dict], turn_idx: int):
+        """
+        Make the programmatic response, the stop sequences and the response pattern of this player available to the
+        backend during a call.
+        """
+        with player_call_context(functools.partial(self._custom_response, messages, turn_idx), self.stop_sequences,
+                                 self.response_pattern):
+            yield
+
+    def __add_call_info(self, response: Dict, response_text: str, call_start: datetime):
         call_duration = datetime.now() - call_start
         response["clem_player"] = {
             "call_start": str(call_start),
@@ -54,7 +155,6 @@ class Player(abc.ABC):
             "response": response_text,
             "model_name": self.model.get_name()
         }
-        return prompt, response, response_text
 
     def _terminal_response(self, messages, turn_idx) -> str:
         """
@@ -300,6 +400,15 @@ class GameMaster(GameRecorder):
         """
         raise NotImplementedError()
 
+    async def aplay(self) -> None:
+        """
+        Asynchronous variant of play(). By default, the blocking play() is run in the event loop's default executor.
+        Game masters that support it natively should overwrite this method.
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()  # the players in the executor need the timeouts of the episode
+        await loop.run_in_executor(None, context.run, self.play)
+
 
 class GameScorer(GameResourceLocator):
 
@@ -369,6 +478,18 @@ class GameScorer(GameResourceLocator):
         self.log_episode_score(ms.METRIC_REQUEST_COUNT_VIOLATED, violated_requests)
         self.log_episode_score(ms.METRIC_REQUEST_SUCCESS, parsed_requests / request_count)
 
+    def score_aborted_by_timeout(self, episode_interactions: Dict) -> None:
+        """
+        Log the scores of an episode that has been aborted by a timeout (see timeouts.py) as for an aborted game.
+        """
+        request_count = sum(1 for turn in episode_interactions["turns"] for event in turn
+                            if event["action"]["type"] == "get message")
+        self.log_episode_score(ms.METRIC_ABORTED, 1)
+        self.log_episode_score(ms.METRIC_LOSE, 0)
+        self.log_episode_score(ms.METRIC_SUCCESS, 0)
+        self.log_episode_score(ms.METRIC_REQUEST_COUNT, request_count)
+        self.log_episode_score(ms.BENCH_SCORE, float("nan"))
+
     def log_main_score(self, episode_interactions: Dict):
         # Replace this function call with a function that logs your main score aka BENCH_SCORE
         raise NotImplementedError()
@@ -436,7 +557,43 @@ class DialogueGameMaster(GameMaster):
             self.current_turn += 1
         self._on_after_game()
 
+    async def aplay(self) -> None:
+        """
+        Asynchronous variant of play() with the same turn loop, but the players are awaited.
+        Games that overwrite play() or prompt() are still run via their blocking play() in an executor.
+        """
+        if type(self).play is not DialogueGameMaster.play or type(self).prompt is not DialogueGameMaster.prompt:
+            await super().aplay()
+            return
+        self._on_before_game()
+        inner_break = False
+        while not inner_break and self._does_game_proceed():
+            self.log_next_turn()
+            self._on_before_turn(self.current_turn)
+            self.logger.info(f"{self.name}: %s turn: %d", self.name, self.current_turn)
+            for player in self.__player_sequence():
+                if not self._does_game_proceed():
+                    inner_break = True  # break outer loop without calling _does_game_proceed again
+                    break  # potentially stop in between player turns
+                await self.aprompt(player)
+                while self._should_reprompt(player):
+                    self._on_before_reprompt(player)
+                    await self.aprompt(player, is_reprompt=True)
+            self._on_after_turn(self.current_turn)
+            self.current_turn += 1
+        self._on_after_game()
+
     def prompt(self, player: Player, is_reprompt=False):
+        history = self.__log_prompt(player, is_reprompt)
+        _prompt, _response, response_message = player(history, self.current_turn)
+        self.__log_and_add_response(player, _prompt, _response, response_message)
+
+    async def aprompt(self, player: Player, is_reprompt=False):
+        history = self.__log_prompt(player, is_reprompt)
+        _prompt, _response, response_message = await player.acall(history, self.current_turn)
+        self.__log_and_add_response(player, _prompt, _response, response_message)
+
+    def __log_prompt(self, player: Player, is_reprompt: bool) -> List[Dict]:
         # GM -> Player
         history = self.messages_by_names[player.descriptor]
         assert history, f"messages history must not be empty for {player.descriptor}"
@@ -449,9 +606,9 @@ class DialogueGameMaster(GameMaster):
         action_type = 'send message' if not is_reprompt else 'send message (reprompt)'
         action = {'type': action_type, 'content': message}
         self.log_event(from_='GM', to=player.descriptor, action=action)
+        return history
 
-        _prompt, _response, response_message = player(history, self.current_turn)
-
+    def __log_and_add_response(self, player: Player, _prompt: Any, _response: Any, response_message: str):
         # Player -> GM
         action = {'type': 'get message', 'content': response_message}
         self.log_event(from_=player.descriptor, to="GM", action=action, call=(_prompt, _response))
@@ -602,6 +759,9 @@ class GameBenchmark(GameResourceLocator):
         super().__init__(name)
         self.instances = None
         self.filter_experiment: List[str] = []
+        self.call_timeout: float = None  # the seconds for a model call (if not given by the model spec)
+        self.episode_timeout: float = None  # the seconds for an episode
+        self.lockstep: bool = False  # to batch the model calls of the concurrent episodes
 
     def get_description(self) -> str:
         """
@@ -701,8 +861,13 @@ class GameBenchmark(GameResourceLocator):
                         game_interactions = self.load_results_json(f"{rel_episode_path}/interactions",
                                                                    results_root, dialogue_pair)
 
-                        game_scorer = self.create_game_scorer(experiment_config, game_instance)
-                        game_scorer.compute_scores(game_interactions)
+                        if game_interactions.get(STATUS_KEY) == STATUS_ABORTED_BY_TIMEOUT:
+                            # the game scorers expect complete episodes, but the episode was cut off
+                            game_scorer = GameScorer(self.name, experiment_config, game_instance)
+                            game_scorer.score_aborted_by_timeout(game_interactions)
+                        else:
+                            game_scorer = self.create_game_scorer(experiment_config, game_instance)
+                            game_scorer.compute_scores(game_interactions)
                         game_scorer.store_scores(results_root, dialogue_pair, rel_episode_path)
                     except Exception:  # continue with other episodes if something goes wrong
                         self.logger.exception(f"{self.name}: Cannot score {episode_dir} (but continue)")
@@ -711,7 +876,10 @@ class GameBenchmark(GameResourceLocator):
                     stdout_logger.error(
                         f"{self.name}: '{error_count}' exceptions occurred: See clembench.log for details.")
 
-    def run(self, player_models: List[Model], results_dir: str = None):
+    def run(self, player_models: List[Model], results_dir: str = None, parallel_episodes: int = 1,
+            use_async: bool = False, resume: bool = False, shard: Tuple[int, int] = None,
+            episode_retries: int = 2, retry_backoff: float = 10., call_timeout: float = None,
+            episode_timeout: float = None, lockstep: bool = False):
         """
         Runs game-play on all game instances for a game.
         There must be an instances.json with the following structure:
@@ -736,72 +904,67 @@ class GameBenchmark(GameResourceLocator):
                             - episode_id
                                 - instance.json
                                 - interaction.json
-        """
+
+        :param player_models: to use for the dialogue pair; the experiment's 'dialogue_partners' are used otherwise
+        :param results_dir: the results root directory
+        :param parallel_episodes: the number of episodes of an experiment to be played concurrently (default: 1)
+        :param use_async: play the concurrent episodes as tasks of a single event loop instead of worker threads
+        :param resume: only play the episodes that have not been completed by a previous run to results_dir
+        :param shard: a tuple (i, n) to only play the i-th of n disjoint slices of all (experiment, game instance)
+                      pairs with 1 <= i <= n; the episodes are still numbered by their index in the experiment
+        :param episode_retries: the number of times an episode that failed with a transient error (e.g. a rate limit)
+                                is played again at the end of the experiment
+        :param retry_backoff: the seconds to wait before the first retry (doubled for each further retry)
+        :param call_timeout: the seconds after which a model call is aborted (unless the model spec has a call_timeout)
+        :param episode_timeout: the seconds after which an episode is aborted
+        :param lockstep: advance the concurrent episodes (see parallel_episodes) together, so that the calls of all
+                         episodes to a local model are generated as one batch (see clemgame.lockstep);
+                         cannot be combined with use_async
+        """
+        if lockstep and use_async:
+            raise ValueError(f"{self.name}: lockstep cannot be combined with use_async")
+        self.call_timeout = call_timeout
+        self.episode_timeout = episode_timeout
+        self.lockstep = lockstep
         results_root = "results" if results_dir is None else results_dir
         experiments: List = self.instances["experiments"]
         if not experiments:
             self.logger.warning(f"{self.name}: No experiments for %s", self.name)
         total_experiments = len(experiments)
+        instances_offset = 0  # the shards are determined over the instances of all experiments
+        cost_estimator = EpisodeCostEstimator(file_utils.results_root(results_root))
         for experiment_idx, experiment in enumerate(experiments):
             experiment_name = experiment['name']
+            episodes = list(enumerate(experiment["game_instances"]))  # the index determines the episode directory
+            if shard:
+                episodes = self._select_shard(episodes, instances_offset, shard)
+            instances_offset += len(experiment["game_instances"])
             if self.filter_experiment and experiment_name not in self.filter_experiment:
                 stdout_logger.info(f"Skip experiment {experiment_idx + 1} of {total_experiments}: {experiment_name}")
                 continue
+            if not episodes:
+                reason = f"no episodes in shard {shard[0]}/{shard[1]}" if shard else "no game instances"
+                stdout_logger.info(f"Skip experiment {experiment_idx + 1} of {total_experiments}: {experiment_name} "
+                                   f"({reason})")
+                continue
             stdout_logger.info(f"Run experiment {experiment_idx + 1} of {total_experiments}: {experiment_name}")
-            # Determine dialogue partners: How often to run the experiment with different partners
-            dialogue_partners: List[List[Model]] = []
-
-            if player_models:  # favor runtime argument over experiment config
-                dialogue_partners = [player_models]
-            elif "dialogue_partners" in experiment:  # edge-case when names are given in experiment config
-                for dialogue_pair_names in experiment["dialogue_partners"]:
-                    player_models = []
-                    for model_name in dialogue_pair_names:
-                        player_model = backends.get_model_for(model_name)
-                        player_models.append(player_model)
-                    dialogue_partners.append(player_models)
-                self.logger.info(f"{self.name}: Detected 'dialogue_partners' in experiment config. "
-                                 f"Will run with: {dialogue_partners}")
-
-            if not dialogue_partners:
-                message = (f"{self.name}: Neither 'dialogue_partners' set in experiment instance"
-                           f" nor 'models' given as run arg")
-                stdout_logger.error(message)
-                raise ValueError(message)
-
+            dialogue_partners = self._dialogue_partners_for(experiment, player_models)
             for dialogue_pair in dialogue_partners:
-                if self.is_single_player():
-                    if len(dialogue_pair) > 1:
-                        message = f"Too many player for singe-player game '{self.name}': '{len(dialogue_partners)}'"
-                        stdout_logger.error(message)
-                        raise ValueError(message)
-                    model_0 = dialogue_pair[0]
-                    model_0 = f"{model_0.get_name()}-t{model_0.get_temperature()}"
-                    # still we store to model--model dir (virtual self-play)
-                    dialogue_pair_desc = f"{model_0}--{model_0}"
-                else:  # 2-players
-                    if len(dialogue_pair) > 2:
-                        message = f"Too many player for two-player game '{self.name}': '{len(dialogue_partners)}'"
-                        stdout_logger.error(message)
-                        raise ValueError(message)
-                    if len(dialogue_pair) == 1:
-                        dialogue_pair.append(dialogue_pair[0])  # model expansion
-                    model_0 = dialogue_pair[0]
-                    model_0 = f"{model_0.get_name()}-t{model_0.get_temperature()}"
-                    model_1 = dialogue_pair[1]
-                    model_1 = f"{model_1.get_name()}-t{model_1.get_temperature()}"
-                    dialogue_pair_desc = f"{model_0}--{model_1}"
+                dialogue_pair_desc = self._dialogue_pair_desc(dialogue_pair)
                 episode_counter = 0
 
                 self.logger.info("Activity: %s Experiment: %s Partners: %s Episode: %d",
                                  self.name, experiment_name, dialogue_pair_desc, episode_counter)
 
                 experiment_record_dir = f"{experiment_idx}_{experiment_name}"
-                experiment_config = {k: experiment[k] for k in experiment if k != 'game_instances'}
+                experiment_config = self._experiment_config_for(experiment, dialogue_pair_desc)
 
-                # Add some important infos to track
-                experiment_config["timestamp"] = datetime.now().isoformat()
-                experiment_config["dialogue_partners"] = dialogue_pair_desc
+                previous_duration = timedelta()
+                if resume:
+                    previous_duration = self._load_experiment_duration(results_root, dialogue_pair_desc,
+                                                                       experiment_record_dir, experiment_name)
+                if previous_duration:  # keep the duration of the previous runs, if this run is interrupted
+                    experiment_config["duration"] = str(previous_duration)
 
                 self.store_results_file(experiment_config,
                                         f"experiment_{experiment_name}.json",
@@ -809,40 +972,437 @@ class GameBenchmark(GameResourceLocator):
                                         sub_dir=experiment_record_dir,
                                         root_dir=results_root)
 
-                error_count = 0
                 time_experiment_start = datetime.now()
-                game_instances: List = experiment["game_instances"]
-                for game_instance in tqdm(game_instances, desc="Playing games"):
-                    game_id = game_instance["game_id"]
-                    self.logger.info("Activity: %s Experiment: %s Episode: %d Game: %s",
-                                     self.name, experiment_name, episode_counter, game_id)
-                    episode_dir = experiment_record_dir + f"/episode_{episode_counter}"
-                    self.store_results_file(game_instance,
-                                            f"instance.json",
-                                            dialogue_pair_desc,
-                                            sub_dir=episode_dir,
-                                            root_dir=results_root)
-                    try:
-                        game_master = self.create_game_master(experiment_config, dialogue_pair)
-                        game_master.setup(**game_instance)
-                        game_master.play()
-                        game_master.store_records(results_root, dialogue_pair_desc, episode_dir)
-                    except Exception:  # continue with other episodes if something goes wrong
-                        self.logger.exception(f"{self.name}: Exception for episode {game_id} (but continue)")
-                        error_count += 1
-                    episode_counter += 1
+                pending_episodes = episodes
+                if resume:
+                    pending_episodes = [(episode_idx, game_instance) for episode_idx, game_instance in episodes
+                                        if not self._is_episode_complete(
+                                            results_root, dialogue_pair_desc,
+                                            f"{experiment_record_dir}/episode_{episode_idx}", game_instance)]
+                    stdout_logger.info(f"Resume experiment {experiment_name}: "
+                                       f"{len(episodes) - len(pending_episodes)} of {len(episodes)} episodes "
+                                       f"already completed")
+                if parallel_episodes > 1:  # avoid that an expensive episode is started last
+                    pending_episodes = self._longest_expected_first(experiment_idx, experiment, pending_episodes,
+                                                                    cost_estimator)
+                error_count = self._play_episodes(pending_episodes, experiment_config, dialogue_pair,
+                                                  dialogue_pair_desc, experiment_record_dir, results_root,
+                                                  parallel_episodes, use_async, episode_retries, retry_backoff)
                 if error_count > 0:
                     stdout_logger.error(
                         f"{self.name}: '{error_count}' exceptions occurred: See clembench.log for details.")
                 # Add experiment duration and overwrite file
                 time_experiment_end = datetime.now() - time_experiment_start
-                experiment_config["duration"] = str(time_experiment_end)
+                experiment_config["duration"] = str(time_experiment_end + previous_duration)
                 self.store_results_file(experiment_config,
                                         f"experiment_{experiment_name}.json",
                                         dialogue_pair_desc,
                                         sub_dir=experiment_record_dir,
                                         root_dir=results_root)
 
+    def _dialogue_partners_for(self, experiment: Dict, player_models: List[Model]) -> List[List[Model]]:
+        """
+        Determine dialogue partners: How often to run the experiment with different partners
+
+        :return: the given player models; or the dialogue partners configured in the experiment
+        """
+        dialogue_partners: List[List[Model]] = []
+
+        if player_models:  # favor runtime argument over experiment config
+            dialogue_partners = [player_models]
+        elif "dialogue_partners" in experiment:  # edge-case when names are given in experiment config
+            for dialogue_pair_names in experiment["dialogue_partners"]:
+                player_models = []
+                for model_name in dialogue_pair_names:
+                    player_model = backends.load_model(model_name)
+                    player_models.append(player_model)
+                dialogue_partners.append(player_models)
+            self.logger.info(f"{self.name}: Detected 'dialogue_partners' in experiment config. "
+                             f"Will run with: {dialogue_partners}")
+
+        if not dialogue_partners:
+            message = (f"{self.name}: Neither 'dialogue_partners' set in experiment instance"
+                       f" nor 'models' given as run arg")
+            stdout_logger.error(message)
+            raise ValueError(message)
+        return dialogue_partners
+
+    def _dialogue_pair_desc(self, dialogue_pair: List[Model]) -> str:
+        """
+        Note: For two-player games a single model is expanded (in-place) to play both roles.
+
+        :return: the name of the results directory for the dialogue pair e.g. 'model-t0.0--model-t0.0'
+        """
+        if self.is_single_player():
+            if len(dialogue_pair) > 1:
+                message = f"Too many player for singe-player game '{self.name}': '{len(dialogue_pair)}'"
+                stdout_logger.error(message)
+                raise ValueError(message)
+            model_0 = dialogue_pair[0]
+            model_0 = f"{model_0.get_name()}-t{model_0.get_temperature()}"
+            # still we store to model--model dir (virtual self-play)
+            return f"{model_0}--{model_0}"
+        # 2-players
+        if len(dialogue_pair) > 2:
+            message = f"Too many player for two-player game '{self.name}': '{len(dialogue_pair)}'"
+            stdout_logger.error(message)
+            raise ValueError(message)
+        if len(dialogue_pair) == 1:
+            dialogue_pair.append(dialogue_pair[0])  # model expansion
+        model_0 = dialogue_pair[0]
+        model_0 = f"{model_0.get_name()}-t{model_0.get_temperature()}"
+        model_1 = dialogue_pair[1]
+        model_1 = f"{model_1.get_name()}-t{model_1.get_temperature()}"
+        return f"{model_0}--{model_1}"
+
+    @staticmethod
+    def _experiment_config_for(experiment: Dict, dialogue_pair_desc: str) -> Dict:
+        experiment_config = {k: experiment[k] for k in experiment if k != 'game_instances'}
+
+        # Add some important infos to track
+        experiment_config["timestamp"] = datetime.now().isoformat()
+        experiment_config["dialogue_partners"] = dialogue_pair_desc
+        return experiment_config
+
+    def play_job(self, experiment_idx: int, episode_idx: int, player_models: List[Model],
+                 results_dir: str = None, call_timeout: float = None, episode_timeout: float = None) -> str:
+        """
+        Play a single episode of an experiment e.g. a job leased from the work queue (see clemgame.workqueue).
+        The results are stored to the same episode directory as for a run() of the whole benchmark.
+
+        Note: The experiment file is only written, when it does not exist yet, and it has no duration,
+        because the episodes of an experiment might be played by several workers.
+
+        :param experiment_idx: the index of the experiment in the instances file
+        :param episode_idx: the index of the game instance in the experiment
+        :param player_models: the dialogue pair to play the episode
+        :param call_timeout: the seconds after which a model call is aborted (unless the model spec has a call_timeout)
+        :param episode_timeout: the seconds after which the episode is aborted
+        :return: the status of the episode (see _play_episode())
+        """
+        self.call_timeout = call_timeout
+        self.episode_timeout = episode_timeout
+        results_root = "results" if results_dir is None else results_dir
+        experiment = self.instances["experiments"][experiment_idx]
+        game_instance = experiment["game_instances"][episode_idx]
+        dialogue_pair_desc = self._dialogue_pair_desc(player_models)
+        experiment_record_dir = f"{experiment_idx}_{experiment['name']}"
+        experiment_config = self._experiment_config_for(experiment, dialogue_pair_desc)
+        experiment_file = f"experiment_{experiment['name']}.json"
+        experiment_path = os.path.join(self.results_path_for(results_root, dialogue_pair_desc),
+                                       experiment_record_dir, experiment_file)
+        if not os.path.exists(experiment_path):
+            self.store_results_file(experiment_config, experiment_file, dialogue_pair_desc,
+                                    sub_dir=experiment_record_dir, root_dir=results_root)
+        return self._play_episode(episode_idx, game_instance, experiment_config, player_models,
+                                  dialogue_pair_desc, experiment_record_dir, results_root)
+
+    def _longest_expected_first(self, experiment_idx: int, experiment: Dict, episodes: List[Tuple[int, Dict]],
+                                cost_estimator: EpisodeCostEstimator) -> List[Tuple[int, Dict]]:
+        """
+        Note: The experiments are played one after another, so that the episodes are only ordered within each
+        experiment (the work queue orders the episodes of all experiments and games, see clemgame.workqueue).
+
+        :return: the episodes sorted by their expected number of requests (descending)
+        """
+        costs = [self.expected_episode_cost(experiment_idx, experiment, episode_idx, game_instance, cost_estimator)
+                 for episode_idx, game_instance in episodes]
+        return longest_first(episodes, costs)
+
+    def expected_episode_cost(self, experiment_idx: int, experiment: Dict, episode_idx: int, game_instance: Dict,
+                              cost_estimator: EpisodeCostEstimator) -> float:
+        """
+        Overwrite this method, when the number of requests of an episode can be predicted better from the game
+        instance than by the previous runs and the max_turns metadata (see clemgame.scheduling).
+
+        :return: the expected number of model requests of the episode
+        """
+        num_players = 1 if self.is_single_player() else 2
+        return cost_estimator.estimate(self.name, num_players, experiment_idx, experiment, episode_idx,
+                                       game_instance)
+
+    def expected_cost(self, cost_estimator: EpisodeCostEstimator) -> float:
+        """
+        :return: the expected number of model requests of all (not filtered) experiments for a dialogue pair
+        """
+        total_cost = 0.
+        for experiment_idx, experiment in enumerate(self.instances["experiments"]):
+            if self.filter_experiment and experiment["name"] not in self.filter_experiment:
+                continue
+            for episode_idx, game_instance in enumerate(experiment["game_instances"]):
+                total_cost += self.expected_episode_cost(experiment_idx, experiment, episode_idx, game_instance,
+                                                         cost_estimator)
+        return total_cost
+
+    @staticmethod
+    def _select_shard(episodes: List[Tuple[int, Dict]], instances_offset: int,
+                      shard: Tuple[int, int]) -> List[Tuple[int, Dict]]:
+        """
+        Select the episodes of an experiment that belong to the shard. The instances of all experiments are
+        assigned round-robin to the shards by their position in the instances file, so that each shard gets
+        about the same number of episodes of each experiment.
+
+        :param episodes: all (episode index, game instance) tuples of an experiment
+        :param instances_offset: the number of game instances in the experiments before this experiment
+        :param shard: a tuple (i, n) with 1 <= i <= n
+        :return: the episodes that belong to the i-th shard
+        """
+        shard_idx, num_shards = shard
+        return [(episode_idx, game_instance) for episode_idx, game_instance in episodes
+                if (instances_offset + episode_idx) % num_shards == shard_idx - 1]
+
+    def _is_episode_complete(self, results_root: str, dialogue_pair_desc: str, episode_dir: str,
+                             game_instance: Dict) -> bool:
+        """
+        An episode is complete, when its interactions and requests have been stored (which only happens after
+        a successful play) and when the stored instance is the same as the given game instance. Episodes that have
+        been aborted by a timeout are incomplete, so that they are played again.
+
+        :return: True, if the episode does not need to be played again
+        """
+        try:
+            stored_instance = self.load_results_json(f"{episode_dir}/instance", results_root, dialogue_pair_desc)
+            interactions = self.load_results_json(f"{episode_dir}/interactions", results_root, dialogue_pair_desc)
+            requests = self.load_results_json(f"{episode_dir}/requests", results_root, dialogue_pair_desc)
+        except (OSError, ValueError):  # missing or truncated files
+            return False
+        if file_utils.json_hash(stored_instance) != file_utils.json_hash(game_instance):
+            self.logger.warning(f"{self.name}: Instance changed for {episode_dir}; the episode will be played again")
+            return False
+        if interactions.get(STATUS_KEY) == STATUS_ABORTED_BY_TIMEOUT:
+            return False
+        return "turns" in interactions and isinstance(requests, list)
+
+    def _load_experiment_duration(self, results_root: str, dialogue_pair_desc: str, experiment_record_dir: str,
+                                  experiment_name: str) -> timedelta:
+        """
+        :return: the duration stored by a previous run of the experiment; or zero, if there is none
+        """
+        try:
+            experiment_config = self.load_results_json(f"{experiment_record_dir}/experiment_{experiment_name}",
+                                                       results_root, dialogue_pair_desc)
+        except (OSError, ValueError):
+            return timedelta()
+        if "duration" not in experiment_config:  # the previous run stopped before the experiment was done
+            return timedelta()
+        return to_timedelta(experiment_config["duration"])
+
+    def _play_episodes(self, episodes: List[Tuple[int, Dict]], experiment_config: Dict,
+                       dialogue_pair: List[Model], dialogue_pair_desc: str, experiment_record_dir: str,
+                       results_root: str, parallel_episodes: int = 1, use_async: bool = False,
+                       episode_retries: int = 0, retry_backoff: float = 10.) -> int:
+        """
+        Play the given episodes of an experiment, either one after another or by a bounded pool of worker threads.
+
+        The episode directories are determined by the episode index (and not by the order of completion),
+        so that the results layout is the same for sequential and concurrent runs.
+
+        Episodes that failed because of a transient error (see failures.py) are deferred and played again after
+        all other episodes of the experiment, at most episode_retries times and with an exponential backoff.
+
+        :param episodes: a list of (episode index, game instance) tuples
+        :param parallel_episodes: the maximal number of episodes played at the same time
+        :param use_async: play the episodes as tasks of an event loop (see _aplay_episodes())
+        :param episode_retries: the number of times an episode with a transient failure is played again
+        :param retry_backoff: the seconds to wait before the first retry (doubled for each further retry)
+        :return: the number of episodes that could not be played due to an exception
+        """
+        statuses = dict(zip([episode_idx for episode_idx, _ in episodes],
+                            self._play_episodes_round(episodes, experiment_config, dialogue_pair, dialogue_pair_desc,
+                                                      experiment_record_dir, results_root, parallel_episodes,
+                                                      use_async)))
+        for retry_idx in range(episode_retries):
+            deferred_episodes = [(episode_idx, game_instance) for episode_idx, game_instance in episodes
+                                 if statuses[episode_idx] == EPISODE_FAILED_TRANSIENT]
+            if not deferred_episodes:
+                break
+            delay = retry_backoff * 2 ** retry_idx
+            budget = get_active_budget()
+            exhausted_reason = budget.exhausted_reason(delay) if budget else None
+            if exhausted_reason:  # do not wait for retries that would not be started anyway
+                stdout_logger.warning(f"{self.name}: No retry of {len(deferred_episodes)} episodes with transient "
+                                      f"errors ({exhausted_reason})")
+                break
+            stdout_logger.warning(f"{self.name}: Retry {len(deferred_episodes)} episodes with transient errors "
+                                  f"in {delay:.0f}s (retry {retry_idx + 1} of {episode_retries})")
+            time.sleep(delay)
+            statuses.update(zip([episode_idx for episode_idx, _ in deferred_episodes],
+                                self._play_episodes_round(deferred_episodes, experiment_config, dialogue_pair,
+                                                          dialogue_pair_desc, experiment_record_dir, results_root,
+                                                          parallel_episodes, use_async)))
+        budget = get_active_budget()
+        if budget:
+            for episode_idx, status in statuses.items():
+                budget.add_episode(status, self.name, dialogue_pair_desc,
+                                   f"{experiment_record_dir}/episode_{episode_idx}")
+        return sum(1 for status in statuses.values() if status in [EPISODE_FAILED, EPISODE_FAILED_TRANSIENT])
+
+    def _play_episodes_round(self, episodes: List[Tuple[int, Dict]], experiment_config: Dict,
+                             dialogue_pair: List[Model], dialogue_pair_desc: str, experiment_record_dir: str,
+                             results_root: str, parallel_episodes: int = 1, use_async: bool = False) -> List[str]:
+        """
+        :return: the status of each episode (in the order of the given episodes)
+        """
+        if use_async:
+            return asyncio.run(self._aplay_episodes(episodes, experiment_config, dialogue_pair, dialogue_pair_desc,
+                                                    experiment_record_dir, results_root, parallel_episodes))
+        if parallel_episodes <= 1:
+            return [self._play_episode(episode_idx, game_instance, experiment_config, dialogue_pair,
+                                       dialogue_pair_desc, experiment_record_dir, results_root)
+                    for episode_idx, game_instance in tqdm(episodes, desc="Playing games")]
+        play_episode = self._play_episode
+        if self.lockstep:
+            lockstep = Lockstep()
+            dialogue_pair = [lockstep.wrap(player_model) for player_model in dialogue_pair]
+
+            def play_episode(*args) -> str:
+                with lockstep.episode():
+                    return self._play_episode(*args)
+
+        with ThreadPoolExecutor(max_workers=parallel_episodes) as executor:
+            futures = [executor.submit(play_episode, episode_idx, game_instance, experiment_config,
+                                       dialogue_pair, dialogue_pair_desc, experiment_record_dir, results_root)
+                       for episode_idx, game_instance in episodes]
+            for _ in tqdm(as_completed(futures), total=len(futures), desc="Playing games"):
+                pass
+        return [future.result() for future in futures]
+
+    async def _aplay_episodes(self, episodes: List[Tuple[int, Dict]], experiment_config: Dict,
+                              dialogue_pair: List[Model], dialogue_pair_desc: str, experiment_record_dir: str,
+                              results_root: str, parallel_episodes: int = 1) -> List[str]:
+        """
+        Play the given episodes as tasks of the running event loop, at most parallel_episodes at the same time.
+        The players are awaited via agenerate_response(), so that in-flight episodes do not need a thread each.
+
+        Note: Blocking game masters and backends without native async support are run in the loop's default
+        executor, which is therefore bound to parallel_episodes workers as well.
+
+        :return: the status of each episode (in the order of the given episodes)
+        """
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=max(parallel_episodes, 1)))
+        semaphore = asyncio.Semaphore(max(parallel_episodes, 1))
+        progress = tqdm(total=len(episodes), desc="Playing games")
+
+        async def play_bounded(episode_idx: int, game_instance: Dict) -> str:
+            async with semaphore:
+                status = await self._aplay_episode(episode_idx, game_instance, experiment_config, dialogue_pair,
+                                                   dialogue_pair_desc, experiment_record_dir, results_root)
+            progress.update()
+            return status
+
+        statuses = await asyncio.gather(*[play_bounded(episode_idx, game_instance)
+                                          for episode_idx, game_instance in episodes])
+        progress.close()
+        return statuses
+
+    def _play_episode(self, episode_idx: int, game_instance: Dict, experiment_config: Dict,
+                      dialogue_pair: List[Model], dialogue_pair_desc: str, experiment_record_dir: str,
+                      results_root: str) -> str:
+        """
+        Play a single episode with a fresh game master and store its records to the episode directory.
+
+        When the budget of the run is exhausted, the episode is not started. An episode interrupted because of the
+        budget has no records (only the instance), so that it is played again on resume.
+
+        When the episode or one of its model calls times out (see timeouts.py), the records so far are stored with
+        the episode status 'aborted_by_timeout' in the interactions.json.
+
+        :return: the status of the episode: 'played', 'failed' or 'failed_transient' (if an exception occurred,
+                 which is logged), 'interrupted' or 'not_started' (because of the budget) or 'aborted_by_timeout'
+        """
+        if self.__is_budget_exhausted():
+            return EPISODE_NOT_STARTED
+        episode_dir = self.__store_episode_instance(episode_idx, game_instance, experiment_config,
+                                                    dialogue_pair_desc, experiment_record_dir, results_root)
+        try:
+            game_master = self.create_game_master(experiment_config, dialogue_pair)
+            game_master.setup(**game_instance)
+            with episode_context(self.name, dialogue_pair_desc, episode_dir), \
+                    episode_timeouts(self.call_timeout, self.episode_timeout):
+                game_master.play()
+            game_master.store_records(results_root, dialogue_pair_desc, episode_dir)
+        except (CallTimeoutError, EpisodeTimeoutError) as e:
+            return self.__store_aborted_by_timeout(game_master, e, game_instance, dialogue_pair_desc, episode_dir,
+                                                   results_root)
+        except BudgetExceededError as e:
+            self.logger.info(f"{self.name}: Interrupted episode {game_instance['game_id']}: {e}")
+            return EPISODE_INTERRUPTED
+        except Exception as e:  # continue with other episodes if something goes wrong
+            return self.__log_episode_failure(e, game_instance)
+        return EPISODE_PLAYED
+
+    async def _aplay_episode(self, episode_idx: int, game_instance: Dict, experiment_config: Dict,
+                             dialogue_pair: List[Model], dialogue_pair_desc: str, experiment_record_dir: str,
+                             results_root: str) -> str:
+        """
+        Asynchronous variant of _play_episode() which awaits the game master's aplay().
+        """
+        if self.__is_budget_exhausted():
+            return EPISODE_NOT_STARTED
+        episode_dir = self.__store_episode_instance(episode_idx, game_instance, experiment_config,
+                                                    dialogue_pair_desc, experiment_record_dir, results_root)
+        try:
+            game_master = self.create_game_master(experiment_config, dialogue_pair)
+            game_master.setup(**game_instance)
+            with episode_context(self.name, dialogue_pair_desc, episode_dir), \
+                    episode_timeouts(self.call_timeout, self.episode_timeout):
+                try:  # cancel the episode, also when it is not waiting for a model call
+                    await asyncio.wait_for(game_master.aplay(), self.episode_timeout)
+                except (CallTimeoutError, EpisodeTimeoutError):
+                    raise
+                except asyncio.TimeoutError:  # note: this is the builtin TimeoutError since Python 3.11
+                    raise EpisodeTimeoutError(self.episode_timeout)
+            game_master.store_records(results_root, dialogue_pair_desc, episode_dir)
+        except (CallTimeoutError, EpisodeTimeoutError) as e:
+            return self.__store_aborted_by_timeout(game_master, e, game_instance, dialogue_pair_desc, episode_dir,
+                                                   results_root)
+        except BudgetExceededError as e:
+            self.logger.info(f"{self.name}: Interrupted episode {game_instance['game_id']}: {e}")
+            return EPISODE_INTERRUPTED
+        except Exception as e:  # continue with other episodes if something goes wrong
+            return self.__log_episode_failure(e, game_instance)
+        return EPISODE_PLAYED
+
+    def __store_aborted_by_timeout(self, game_master: GameMaster, timeout_error: TimeoutError, game_instance: Dict,
+                                   dialogue_pair_desc: str, episode_dir: str, results_root: str) -> str:
+        """
+        Store the records of the episode so far, marked with the 'aborted_by_timeout' episode status.
+        """
+        self.logger.warning(f"{self.name}: Aborted episode {game_instance['game_id']}: {timeout_error}")
+        timeout_type = "call" if isinstance(timeout_error, CallTimeoutError) else "episode"
+        game_master.log_key(STATUS_KEY, STATUS_ABORTED_BY_TIMEOUT)
+        game_master.log_key(TIMEOUT_KEY, {"type": timeout_type, "seconds": timeout_error.seconds,
+                                          "message": str(timeout_error)})
+        game_master.store_records(results_root, dialogue_pair_desc, episode_dir)
+        return EPISODE_ABORTED_BY_TIMEOUT
+
+    @staticmethod
+    def __is_budget_exhausted() -> bool:
+        budget = get_active_budget()
+        return budget is not None and budget.exhausted_reason() is not None
+
+    def __log_episode_failure(self, exception: Exception, game_instance: Dict) -> str:
+        if is_transient_error(exception):
+            self.logger.exception(f"{self.name}: Transient exception for episode {game_instance['game_id']} "
+                                  f"(will be retried)")
+            return EPISODE_FAILED_TRANSIENT
+        self.logger.exception(f"{self.name}: Exception for episode {game_instance['game_id']} (but continue)")
+        return EPISODE_FAILED
+
+    def __store_episode_instance(self, episode_idx: int, game_instance: Dict, experiment_config: Dict,
+                                 dialogue_pair_desc: str, experiment_record_dir: str, results_root: str) -> str:
+        game_id = game_instance["game_id"]
+        self.logger.info("Activity: %s Experiment: %s Episode: %d Game: %s",
+                         self.name, experiment_config["name"], episode_idx, game_id)
+        episode_dir = experiment_record_dir + f"/episode_{episode_idx}"
+        self.store_results_file(game_instance,
+                                f"instance.json",
+                                dialogue_pair_desc,
+                                sub_dir=episode_dir,
+                                root_dir=results_root)
+        return episode_dir
+
     def is_single_player(self) -> bool:
         """
         Decide if only a single cLLM is part of the interaction.
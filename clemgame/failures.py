@@ -0,0 +1,52 @@
+"""
+Classify the exceptions that made an episode fail.
+
+Transient failures (network errors, rate limits, timeouts, overloaded servers) might not occur when the episode
+is played again later, so that these episodes are deferred and retried. All other failures (e.g. bugs in a game
+or a ContextExceededError) are deterministic and the episode would fail again.
+
+The backend libraries are optional, so that their exceptions are recognized by their names and HTTP status codes.
+"""
+from typing import Optional
+
+from backends import ContextExceededError
+
+TRANSIENT_STATUS_CODES = [408, 409, 425, 429, 500, 502, 503, 504, 529]
+
+TRANSIENT_ERROR_NAMES = [
+    "ConnectionError", "TimeoutError", "Timeout",  # builtins, requests
+    "RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError",  # openai, anthropic
+    "ServiceUnavailableError", "OverloadedError", "TooManyRequestsError",
+    "MistralConnectionException", "CohereConnectionError",
+    "TimeoutException", "ConnectError", "ReadError", "RemoteProtocolError",  # httpx
+]
+
+
+def is_transient_error(exception: BaseException) -> bool:
+    """
+    :param exception: the exception that made an episode fail (the exceptions it was raised from are checked as well)
+    :return: True, if playing the episode again later might succeed
+    """
+    seen = set()
+    while exception is not None and id(exception) not in seen:
+        seen.add(id(exception))
+        if isinstance(exception, ContextExceededError):
+            return False
+        if isinstance(exception, (ConnectionError, TimeoutError)):
+            return True
+        if _status_code(exception) in TRANSIENT_STATUS_CODES:
+            return True
+        if any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(exception).__mro__):
+            return True
+        exception = exception.__cause__ or exception.__context__
+    return False
+
+
+def _status_code(exception: BaseException) -> Optional[int]:
+    for attribute in ["status_code", "http_status", "status"]:
+        status_code = getattr(exception, attribute, None)
+        if isinstance(status_code, int):
+            return status_code
+    response = getattr(exception, "response", None)
+    status_code = getattr(response, "status_code", None)
+    return status_code if isinstance(status_code, int) else None
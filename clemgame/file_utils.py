@@ -1,8 +1,11 @@
 from typing import Dict
+import hashlib
 import os
 import json
 import csv
 
+import backends.utils
+
 
 def project_root():
     return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -13,10 +16,7 @@ def game_dir(game_name: str) -> str:
 
 
 def results_root(results_dir: str = None) -> str:
-    results_dir = "results" if results_dir is None else results_dir
-    if os.path.isabs(results_dir):
-        return results_dir
-    return os.path.join(project_root(), results_dir)
+    return backends.utils.results_root(results_dir)
 
 
 def game_results_dir_for(results_dir: str, dialogue_pair: str, game_name: str) -> str:
@@ -77,6 +77,15 @@ def __load_results_file(file_name: str, results_dir: str, dialogue_pair: str, ga
     return data
 
 
+def json_hash(data) -> str:
+    """
+    :param data: a JSON serializable object e.g. a game instance
+    :return: a hash of the object that does not depend on the order of the dictionary keys
+    """
+    json_str = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(json_str.encode("utf-8")).hexdigest()
+
+
 def store_game_results_file(data, file_name: str, dialogue_pair: str, game_name: str,
                             sub_dir: str = None, root_dir: str = None,
                             do_overwrite: bool = True) -> str:
@@ -0,0 +1,112 @@
+"""
+Lockstep play of the concurrent episodes of an experiment, so that local models generate the responses of all
+episodes at the same turn position with a single batched call (see Model.generate_batch).
+
+The calls of the episodes to models with a native generate_batch() are held back until each running episode is
+waiting for such a call (or has finished). Then the waiting calls are issued as one batch per model. Other models
+(e.g. remote APIs and programmatic players) are called directly as before. Calls with different stop sequences or
+response patterns (see Player) are batched separately.
+"""
+import contextvars
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import List, Dict, Tuple, Any
+
+import clemgame
+from backends import Model
+from backends.context import get_stop_sequences, get_response_pattern
+
+logger = clemgame.get_logger(__name__)
+
+
+def is_batching_model(model: Model) -> bool:
+    """
+    :return: True, if the model implements generate_batch() natively (and not by sequential calls)
+    """
+    return type(model).generate_batch is not Model.generate_batch
+
+
+class Lockstep:
+    """
+    The barrier of the episodes that are played in lockstep. Each episode is played within episode() and its
+    players use the models returned by wrap().
+    """
+
+    def __init__(self):
+        self.num_episodes = 0  # the running episodes
+        self.pending: List[Tuple[Model, List[Dict], Future, contextvars.Context]] = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def episode(self):
+        with self.lock:
+            self.num_episodes += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.num_episodes -= 1
+                batch = self._take_batch()
+            self._generate(batch)  # the others might have waited for this episode only
+
+    def wrap(self, model: Model) -> Model:
+        """
+        :return: a model whose calls are batched in lockstep; or the given model, if it does not batch natively
+        """
+        if not is_batching_model(model):
+            return model
+        return LockstepModel(model, self)
+
+    def generate(self, model: Model, messages: List[Dict]) -> Tuple[Any, Any, str]:
+        """
+        Wait until each running episode waits for a call, then generate the responses of all of them.
+        :return: the prompt, response and response text of the call
+        """
+        future = Future()
+        with self.lock:
+            self.pending.append((model, messages, future, contextvars.copy_context()))
+            batch = self._take_batch()
+        self._generate(batch)
+        result = future.result()
+        if result is None:  # the batch failed; fail (or succeed) on its own
+            return model.generate_response(messages)
+        return result
+
+    def _take_batch(self) -> List[Tuple[Model, List[Dict], Future, contextvars.Context]]:
+        # calls of episodes aborted by a timeout might still be pending, so that there can be more calls than episodes
+        if self.pending and len(self.pending) >= self.num_episodes:
+            batch, self.pending = self.pending, []
+            return batch
+        return []
+
+    def _generate(self, batch: List[Tuple[Model, List[Dict], Future, contextvars.Context]]):
+        calls_by_model: Dict[Tuple, List[Tuple[Model, List[Dict], Future, contextvars.Context]]] = dict()
+        for call in batch:
+            stop_sequences, response_pattern = call[3].run(lambda: (get_stop_sequences(), get_response_pattern()))
+            calls_by_model.setdefault((id(call[0]), tuple(stop_sequences), response_pattern), []).append(call)
+        for calls in calls_by_model.values():
+            model, context = calls[0][0], calls[0][3]  # the player context, e.g. for the stop sequences
+            try:
+                results = context.run(model.generate_batch, [messages for _, messages, _, _ in calls])
+            except Exception as e:
+                logger.warning("Batch of %s calls to %s failed, the calls are repeated one by one: %s",
+                               len(calls), model.get_name(), e)
+                results = [None] * len(calls)
+            for (_, _, future, _), result in zip(calls, results):
+                future.set_result(result)
+
+
+class LockstepModel(Model):
+    """
+    A model whose calls are generated in batches with the calls of the other episodes played in lockstep.
+    """
+
+    def __init__(self, model: Model, lockstep: Lockstep):
+        super().__init__(model.model_spec)
+        self.set_gen_args(**model.get_gen_args())
+        self.model = model
+        self.lockstep = lockstep
+
+    def generate_response(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
+        return self.lockstep.generate(self.model, messages)
@@ -0,0 +1,167 @@
+"""
+An on-disk cache for the responses of deterministic model calls.
+
+Most runs use a temperature of 0, so that playing a game again (e.g. after fixing a bug in the game master)
+would request the same responses again. The cache of a run is activated as a context manager
+(`with ResponseCache(...) as cache: ...`) and then looked up by each Player before a model is requested.
+
+The responses are stored in a single SQLite file and keyed by a hash of the model spec (backend, model id, ...),
+the messages and the generation arguments. Only calls with a temperature of 0 are cached. When the file exceeds
+its maximal size, then the least recently used responses are removed.
+
+The cache modes are
+    - 'read': look up the responses, but do not store new ones (the cache file is not changed)
+    - 'write': look up the responses and store the new ones
+    - 'off': do not use the cache
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Any, Dict, List, Optional, Tuple
+
+import clemgame
+from backends import Model
+from backends.utils import uses_player_stop_sequences, uses_constrained_decoding
+
+logger = clemgame.get_logger(__name__)
+stdout_logger = clemgame.get_logger("benchmark.run")
+
+CACHE_FILE_NAME = "response_cache.sqlite"
+
+CACHE_READ = "read"
+CACHE_WRITE = "write"
+CACHE_OFF = "off"
+CACHE_MODES = [CACHE_READ, CACHE_WRITE, CACHE_OFF]
+
+# model spec keys that do not change the responses of a model
+IGNORED_SPEC_KEYS = ["model_name", "call_timeout"]
+
+_active_cache: Optional["ResponseCache"] = None
+
+
+class ResponseCache:
+    """
+    All methods open their own connection, so that a cache can be used by several threads (and processes).
+    """
+
+    def __init__(self, cache_path: str, mode: str = CACHE_WRITE, max_size_mb: float = 1024.,
+                 lock_timeout: float = 60.):
+        """
+        :param cache_path: the SQLite file to store the responses to (created if not existing)
+        :param mode: either 'read' or 'write'
+        :param max_size_mb: the maximal size of the stored responses in megabytes
+        :param lock_timeout: the seconds to wait for another process to release the database lock
+        """
+        assert mode in [CACHE_READ, CACHE_WRITE], f"Cache mode must be read or write, but is '{mode}'"
+        self.cache_path = cache_path
+        self.mode = mode
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.lock_timeout = lock_timeout
+        self.num_hits = 0
+        self.num_misses = 0
+        self.__lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        with closing(self._connect()) as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )""")
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    def __enter__(self):
+        global _active_cache
+        _active_cache = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _active_cache
+        _active_cache = None
+        stdout_logger.info(f"Response cache at {self.cache_path} ({self.mode}): "
+                           f"{self.num_hits} hits, {self.num_misses} misses")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.cache_path, timeout=self.lock_timeout, isolation_level=None)
+
+    def lookup(self, model: Model, messages: List[Dict], stop_sequences: List[str] = None,
+               response_pattern: str = None) -> Optional[Tuple[Any, Any, str]]:
+        """
+        :param stop_sequences: the stop sequences of the call (see Player.stop_sequences)
+        :param response_pattern: the response pattern of the call (see Player.response_pattern)
+        :return: the cached prompt, response and response text; or None, when the call is not cached or
+                 not deterministic
+        """
+        key = cache_key(model, messages, stop_sequences, response_pattern)
+        if key is None:
+            return None
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.mode == CACHE_WRITE:
+                connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        with self.__lock:
+            if row is None:
+                self.num_misses += 1
+                return None
+            self.num_hits += 1
+        value = json.loads(row[0])
+        return value["prompt"], value["response"], value["response_text"]
+
+    def store(self, model: Model, messages: List[Dict], prompt: Any, response: Any, response_text: str,
+              stop_sequences: List[str] = None, response_pattern: str = None):
+        """
+        Store the response of a deterministic call (only in write mode). Then remove the least recently used
+        responses, when the cache exceeds its maximal size.
+        """
+        if self.mode != CACHE_WRITE:
+            return
+        key = cache_key(model, messages, stop_sequences, response_pattern)
+        if key is None:
+            return
+        try:
+            value = json.dumps(dict(prompt=prompt, response=response, response_text=response_text))
+        except (TypeError, ValueError) as e:  # the raw response of a backend might not be serializable
+            logger.debug("Cannot cache the response of %s: %s", model.get_name(), e)
+            return
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("INSERT OR REPLACE INTO responses (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                               (key, value, len(value), time.time()))
+            connection.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS total_size FROM responses
+                    ) WHERE total_size > ?
+                )""", (self.max_size,))
+            connection.execute("COMMIT")
+
+
+def cache_key(model: Model, messages: List[Dict], stop_sequences: List[str] = None,
+              response_pattern: str = None) -> Optional[str]:
+    """
+    :return: the hash of the model spec, the messages, the generation arguments, the stop sequences and the response
+             pattern (if used by the model); or None, when the call is not deterministic (temperature > 0)
+    """
+    gen_args = model.get_gen_args()
+    if gen_args.get("temperature") != 0:
+        return None
+    model_spec = {key: value for key, value in model.model_spec.__dict__.items() if key not in IGNORED_SPEC_KEYS}
+    key_object = dict(model_spec=model_spec, messages=messages, gen_args=gen_args)
+    if stop_sequences and uses_player_stop_sequences(model.model_spec):
+        key_object["stop_sequences"] = list(stop_sequences)
+    if response_pattern and uses_constrained_decoding(model.model_spec):
+        key_object["response_pattern"] = response_pattern
+    key_string = json.dumps(key_object, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(key_string.encode("utf-8")).hexdigest()
+
+
+def get_active_cache() -> Optional[ResponseCache]:
+    """
+    :return: the response cache of the current run; or None, if the run does not use a cache
+    """
+    return _active_cache
@@ -0,0 +1,113 @@
+"""
+Estimate the cost of episodes, so that the most expensive ones can be started first.
+
+When episodes are played concurrently, the run takes at least as long as its most expensive episode. Starting the
+episodes in the order of the instances file might start such an episode last, while the other workers are idle.
+Dispatching the longest expected episodes first (LPT scheduling) avoids these long tails.
+
+The cost of an episode is measured in the number of model requests. It is estimated by
+    1. the mean number of requests of previous plays of the same episode (by any dialogue pair) in the results,
+    2. otherwise, the mean number of requests of previously played episodes of the same experiment,
+    3. otherwise, the game metadata: max_turns (or max_attempts_per_game) times the number of players.
+"""
+import glob
+import json
+import os
+from statistics import mean
+from typing import Callable, Dict, List, Set, Tuple
+
+import clemgame
+
+logger = clemgame.get_logger(__name__)
+
+METADATA_TURN_KEYS = ["max_turns", "max_attempts_per_game"]
+
+
+class EpisodeCostEstimator:
+    """
+    Estimates the number of requests of an episode. The requests.json files of a game in the results root
+    are only read once.
+    """
+
+    def __init__(self, results_root: str):
+        self.results_root = results_root
+        self._request_counts: Dict[str, Dict[Tuple[str, int], List[int]]] = dict()
+
+    def estimate(self, game_name: str, num_players: int, experiment_idx: int, experiment: Dict,
+                 episode_idx: int, game_instance: Dict) -> float:
+        """
+        :param num_players: the number of players in the game
+        :param experiment_idx: the index of the experiment in the instances file
+        :param experiment: the experiment config
+        :param episode_idx: the index of the game instance in the experiment
+        :return: the expected number of model requests of the episode
+        """
+        experiment_record_dir = f"{experiment_idx}_{experiment['name']}"
+        request_counts = self._load_request_counts(game_name)
+        if (experiment_record_dir, episode_idx) in request_counts:
+            return mean(request_counts[(experiment_record_dir, episode_idx)])
+        experiment_counts = [count for (record_dir, _), counts in request_counts.items()
+                             if record_dir == experiment_record_dir for count in counts]
+        if experiment_counts:
+            return mean(experiment_counts)
+        return estimate_from_metadata(num_players, experiment, game_instance)
+
+    def _load_request_counts(self, game_name: str) -> Dict[Tuple[str, int], List[int]]:
+        if game_name in self._request_counts:
+            return self._request_counts[game_name]
+        request_counts = dict()
+        pattern = os.path.join(glob.escape(self.results_root), "*", game_name, "*", "episode_*", "requests.json")
+        for requests_file in glob.glob(pattern):
+            episode_dir = os.path.dirname(requests_file)
+            experiment_record_dir = os.path.basename(os.path.dirname(episode_dir))
+            try:
+                episode_idx = int(os.path.basename(episode_dir)[len("episode_"):])
+                with open(requests_file, encoding="utf-8") as f:
+                    num_requests = len(json.load(f))
+            except (OSError, ValueError) as e:  # e.g. truncated files of an interrupted run
+                logger.debug("Ignore %s for cost estimation: %s", requests_file, e)
+                continue
+            request_counts.setdefault((experiment_record_dir, episode_idx), []).append(num_requests)
+        self._request_counts[game_name] = request_counts
+        return request_counts
+
+
+def estimate_from_metadata(num_players: int, experiment: Dict, game_instance: Dict) -> float:
+    """
+    :return: the maximal number of turns given in the game instance or experiment times the number of players;
+             or just the number of players, when the game has no such metadata
+    """
+    configs = [game_instance, experiment, experiment.get("common_config", {})]
+    for key in METADATA_TURN_KEYS:
+        for config in configs:
+            if isinstance(config.get(key), (int, float)):
+                return config[key] * num_players
+    return num_players
+
+
+def longest_first(items: List, costs: List[float]) -> List:
+    """
+    :return: the items sorted by descending cost; items of the same cost keep their order
+    """
+    return [item for _, item in sorted(zip(costs, items), key=lambda pair: -pair[0])]
+
+
+def order_for_model_reuse(dialogue_pairs: List[List], is_loaded: Callable[[object], bool],
+                          key: Callable[[object], str] = str) -> List[List]:
+    """
+    Order the dialogue pairs of a sweep, so that few models have to be loaded again (when the model pool has to
+    evict models): first the pairs of the already loaded models, then always the pair that shares the most models
+    with the previous pair (in the given order for ties).
+
+    :param is_loaded: to tell whether a model is already loaded
+    :param key: to identify a model
+    """
+    remaining = list(dialogue_pairs)
+    ordered = []
+    current: Set[str] = {key(model) for pair in remaining for model in pair if is_loaded(model)}
+    while remaining:
+        next_pair = max(remaining, key=lambda pair: len({key(model) for model in pair} & current))
+        remaining.remove(next_pair)
+        ordered.append(next_pair)
+        current = {key(model) for model in next_pair}
+    return ordered
@@ -0,0 +1,131 @@
+"""
+Timeouts for single model calls and for whole episodes.
+
+The timeouts of the current episode are set as a context (`with episode_timeouts(call_timeout, episode_timeout):`)
+and applied by each Player to its model calls. A call that is not answered within the call timeout (or before
+the episode deadline) raises a CallTimeoutError or an EpisodeTimeoutError, which aborts the episode.
+
+Note: Blocking calls cannot be killed in Python. A timed-out blocking call is abandoned in its (daemon) thread and
+its result is discarded, so that the episode worker is freed. Native async calls (see Player.acall) are cancelled.
+The episode timeout is enforced at the model calls: a game master that does not call a model is not interrupted.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from backends import Model
+
+STATUS_KEY = "episode status"
+STATUS_ABORTED_BY_TIMEOUT = "aborted_by_timeout"
+TIMEOUT_KEY = "timeout"
+
+_call_timeout: contextvars.ContextVar = contextvars.ContextVar("call_timeout", default=None)
+_episode_deadline: contextvars.ContextVar = contextvars.ContextVar("episode_deadline", default=None)
+
+
+class CallTimeoutError(TimeoutError):
+    """
+    Exception to be raised when a model call takes longer than the call timeout.
+    """
+
+    def __init__(self, seconds: float):
+        super().__init__(f"Model call exceeded the call timeout of {seconds}s")
+        self.seconds = seconds
+
+
+class EpisodeTimeoutError(TimeoutError):
+    """
+    Exception to be raised when an episode takes longer than the episode timeout.
+    """
+
+    def __init__(self, seconds: float):
+        super().__init__(f"Episode exceeded the episode timeout of {seconds}s")
+        self.seconds = seconds
+
+
+@contextmanager
+def episode_timeouts(call_timeout: float = None, episode_timeout: float = None):
+    """
+    :param call_timeout: the default seconds for a model call (the model spec might define its own call_timeout)
+    :param episode_timeout: the seconds for the whole episode
+    """
+    deadline = None if episode_timeout is None else (time.monotonic() + episode_timeout, episode_timeout)
+    call_token = _call_timeout.set(call_timeout)
+    deadline_token = _episode_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _call_timeout.reset(call_token)
+        _episode_deadline.reset(deadline_token)
+
+
+def call_with_timeout(model: Model, generate_fn: Callable, *args):
+    """
+    Call the generate_fn in a separate thread and wait at most for the timeout of the current call.
+
+    :raises CallTimeoutError: when the call timeout is exceeded
+    :raises EpisodeTimeoutError: when the episode deadline is exceeded
+    """
+    timeout, timeout_error = _current_timeout(model)
+    if timeout is None:
+        return generate_fn(*args)
+    result = dict()
+    context = contextvars.copy_context()  # e.g. the current episode
+
+    def call():
+        try:
+            result["value"] = context.run(generate_fn, *args)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=call, name=f"call-{model.get_name()}", daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():  # the thread is abandoned and its result discarded
+        raise timeout_error
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+async def acall_with_timeout(model: Model, agenerate_fn: Callable, *args):
+    """
+    Asynchronous variant of call_with_timeout() that cancels the awaited call on timeout.
+    """
+    timeout, timeout_error = _current_timeout(model)
+    if timeout is None:
+        return await agenerate_fn(*args)
+    task = asyncio.ensure_future(agenerate_fn(*args))
+    try:
+        done, _ = await asyncio.wait([task], timeout=timeout)
+    except asyncio.CancelledError:  # e.g. the episode timed out
+        task.cancel()
+        raise
+    if not done:
+        task.cancel()
+        raise timeout_error
+    return task.result()  # raises the exception of the call, if any
+
+
+def _current_timeout(model: Model):
+    """
+    :return: the seconds left for the call and the error to raise when they are exceeded; or (None, None)
+    """
+    call_timeout = _call_timeout.get()
+    if model.model_spec.has_attr("call_timeout"):
+        call_timeout = model.model_spec.call_timeout
+    deadline = _episode_deadline.get()
+    if deadline is None:
+        if call_timeout is None:
+            return None, None
+        return call_timeout, CallTimeoutError(call_timeout)
+    deadline_time, episode_timeout = deadline
+    time_left = deadline_time - time.monotonic()
+    if time_left <= 0:
+        raise EpisodeTimeoutError(episode_timeout)
+    if call_timeout is None or time_left < call_timeout:
+        return time_left, EpisodeTimeoutError(episode_timeout)
+    return call_timeout, CallTimeoutError(call_timeout)
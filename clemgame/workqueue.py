@@ -0,0 +1,222 @@
+"""
+A coordinator-free work queue for playing the episodes of a benchmark run with several worker processes,
+possibly on several machines that share the results directory.
+
+The jobs are stored in a SQLite database in the results root. Each job is an episode, i.e. a
+(game, experiment, game instance, dialogue pair) tuple. A worker leases the next open job for a limited time,
+renews the lease via heartbeats while the episode is played and marks the job as done afterwards. A job whose
+lease has expired (e.g. because the worker crashed) is given to the next worker that asks for a job.
+The jobs with the highest expected cost are leased first (see clemgame.scheduling).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import clemgame
+
+logger = clemgame.get_logger(__name__)
+
+QUEUE_FILE_NAME = "jobs.sqlite"
+
+STATUS_OPEN = "open"
+STATUS_LEASED = "leased"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+@dataclass
+class Job:
+    """ An episode to be played by a worker """
+    job_id: int
+    game_name: str
+    instances_name: str
+    experiment_idx: int
+    experiment_name: str
+    episode_idx: int
+    model_specs: List[Dict]
+    gen_args: Dict
+    attempts: int
+
+
+class WorkQueue:
+    """
+    The job table in the results root. All methods open their own connection, so that a queue can be used
+    by several threads (e.g. the heartbeat thread of a worker).
+
+    Note: SQLite relies on file locks. Make sure that these work on the shared file system (e.g. NFS with lockd).
+    """
+
+    def __init__(self, results_root: str, lock_timeout: float = 60.):
+        """
+        :param results_root: the directory to store the jobs.sqlite file to (created if not existing)
+        :param lock_timeout: the seconds to wait for another worker to release the database lock
+        """
+        os.makedirs(results_root, exist_ok=True)
+        self.results_root = results_root
+        self.db_path = os.path.join(results_root, QUEUE_FILE_NAME)
+        self.lock_timeout = lock_timeout
+        with closing(self._connect()) as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    game_name TEXT NOT NULL,
+                    instances_name TEXT NOT NULL,
+                    experiment_idx INTEGER NOT NULL,
+                    experiment_name TEXT NOT NULL,
+                    episode_idx INTEGER NOT NULL,
+                    model_specs TEXT NOT NULL,
+                    gen_args TEXT NOT NULL,
+                    expected_cost REAL NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    worker_id TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    updated REAL,
+                    UNIQUE (game_name, instances_name, experiment_idx, episode_idx, model_specs, gen_args)
+                )""")
+
+    def _connect(self) -> sqlite3.Connection:
+        # autocommit mode, so that the transactions can be started explicitly with BEGIN IMMEDIATE
+        return sqlite3.connect(self.db_path, timeout=self.lock_timeout, isolation_level=None)
+
+    def add_jobs(self, jobs: List[Dict]) -> int:
+        """
+        Add jobs to the queue. Jobs that are already in the queue (in whatever status) are ignored,
+        so that several workers can safely add the same jobs when they are started.
+
+        :param jobs: dicts with game_name, instances_name, experiment_idx, experiment_name, episode_idx,
+                     model_specs, gen_args and optionally expected_cost
+        :return: the number of jobs newly added
+        """
+        rows = [(job["game_name"], job["instances_name"], job["experiment_idx"], job["experiment_name"],
+                 job["episode_idx"], json.dumps(job["model_specs"], sort_keys=True),
+                 json.dumps(job["gen_args"], sort_keys=True), job.get("expected_cost", 0.), STATUS_OPEN, time.time())
+                for job in jobs]
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            before = connection.total_changes
+            connection.executemany("""
+                INSERT OR IGNORE INTO jobs (game_name, instances_name, experiment_idx, experiment_name, episode_idx,
+                                            model_specs, gen_args, expected_cost, status, updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+            added = connection.total_changes - before
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+        return added
+
+    def lease(self, worker_id: str, lease_seconds: float) -> Optional[Job]:
+        """
+        Lease the open job (or a job whose lease has expired) with the highest expected cost.
+
+        :param worker_id: the worker that leases the job
+        :param lease_seconds: the job is given to another worker, when the lease is not renewed within this time
+        :return: the leased job; or None, if there is currently no job to lease
+        """
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")  # no other worker can lease until we commit
+            row = connection.execute("""
+                SELECT job_id, game_name, instances_name, experiment_idx, experiment_name, episode_idx,
+                       model_specs, gen_args, attempts, status
+                FROM jobs
+                WHERE status = ? OR (status = ? AND lease_expires < ?)
+                ORDER BY expected_cost DESC, job_id LIMIT 1""", (STATUS_OPEN, STATUS_LEASED, now)).fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return None
+            if row[9] == STATUS_LEASED:
+                logger.warning("Lease of job %s expired; it is given to worker %s", row[0], worker_id)
+            connection.execute("""
+                UPDATE jobs SET status = ?, worker_id = ?, lease_expires = ?, attempts = attempts + 1, updated = ?
+                WHERE job_id = ?""", (STATUS_LEASED, worker_id, now + lease_seconds, now, row[0]))
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+        return Job(job_id=row[0], game_name=row[1], instances_name=row[2], experiment_idx=row[3],
+                   experiment_name=row[4], episode_idx=row[5], model_specs=json.loads(row[6]),
+                   gen_args=json.loads(row[7]), attempts=row[8] + 1)
+
+    def heartbeat(self, job: Job, worker_id: str, lease_seconds: float) -> bool:
+        """
+        Renew the lease of a job.
+
+        :return: False, if the job is not leased by the worker anymore (e.g. because the lease expired before)
+        """
+        now = time.time()
+        return self._update(job, worker_id, "lease_expires = ?, updated = ?", (now + lease_seconds, now))
+
+    def complete(self, job: Job, worker_id: str) -> bool:
+        """
+        Mark a job as done.
+
+        :return: False, if the job is not leased by the worker anymore
+        """
+        return self._update(job, worker_id, "status = ?, lease_expires = NULL, updated = ?",
+                            (STATUS_DONE, time.time()))
+
+    def fail(self, job: Job, worker_id: str, max_attempts: int) -> bool:
+        """
+        Give a job back to the queue after a failed attempt; or mark it as failed after max_attempts.
+
+        :return: False, if the job is not leased by the worker anymore
+        """
+        status = STATUS_FAILED if job.attempts >= max_attempts else STATUS_OPEN
+        return self._update(job, worker_id, "status = ?, worker_id = NULL, lease_expires = NULL, updated = ?",
+                            (status, time.time()))
+
+    def _update(self, job: Job, worker_id: str, assignments: str, values: tuple) -> bool:
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(f"UPDATE jobs SET {assignments} "
+                                        f"WHERE job_id = ? AND worker_id = ? AND status = ?",
+                                        values + (job.job_id, worker_id, STATUS_LEASED))
+        return cursor.rowcount == 1
+
+    def count_by_status(self) -> Dict[str, int]:
+        """
+        :return: the number of jobs by status e.g. {'open': 10, 'leased': 2, 'done': 20}
+        """
+        with closing(self._connect()) as connection:
+            rows = connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+
+class Heartbeat:
+    """
+    Renews the lease of a job in a background thread, while the job is processed.
+
+    Use as a context manager: `with Heartbeat(queue, job, worker_id, lease_seconds): ...`
+    """
+
+    def __init__(self, queue: WorkQueue, job: Job, worker_id: str, lease_seconds: float):
+        self.queue = queue
+        self.job = job
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        interval = self.lease_seconds / 3  # renew well before the lease expires
+        while not self.stopped.wait(interval):
+            try:
+                if not self.queue.heartbeat(self.job, self.worker_id, self.lease_seconds):
+                    logger.warning("Worker %s lost the lease of job %s", self.worker_id, self.job.job_id)
+                    return
+            except sqlite3.Error as e:  # retry with the next heartbeat
+                logger.warning("Heartbeat for job %s failed: %s", self.job.job_id, e)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stopped.set()
+        self.thread.join()
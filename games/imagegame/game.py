@@ -87,6 +87,10 @@ class ImageGame:
 
         self.instruction_follower = InstructionFollower(player_models[1])
         self.instruction_giver = InstructionGiver(player_models[0])
+        # the master matches the instructions case-insensitively, either as an instruction or as the termination
+        self.instruction_giver.response_pattern = \
+            f"(?i)(?:{self.player_1_response_pattern})|(?:{self.player_1_terminate_pattern})"
+        self.instruction_follower.response_pattern = self.player_2_response_pattern
 
         self.given_instruction = Instruction()
         self.given_instruction.add_user_message(
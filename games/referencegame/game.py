@@ -49,6 +49,7 @@ class InstructionFollower(Player):
 
     def __init__(self, model_name):
         super().__init__(model_name)
+        self.stop_sequences = ["\n"]  # the response pattern expects a single line (see player_stop_sequences)
 
     def __call__(self, instruction: Instruction, turn_idx):
         return super().__call__(instruction.convert_to_query_messages(), turn_idx)
@@ -62,6 +63,7 @@ class InstructionGiver(Player):
 
     def __init__(self, model_name):
         super().__init__(model_name)
+        self.stop_sequences = ["\n"]  # the response pattern expects a single line (see player_stop_sequences)
 
     def __call__(self, instruction: Instruction, turn_idx):
         return super().__call__(instruction.convert_to_query_messages(), turn_idx)
@@ -93,6 +95,9 @@ class ReferenceGame:
 
         self.instruction_giver = InstructionGiver(player_backends[0])
         self.instruction_follower = InstructionFollower(player_backends[1])
+        # the master matches the responses case-insensitively
+        self.instruction_giver.response_pattern = "(?i)" + self.player_1_response_pattern
+        self.instruction_follower.response_pattern = "(?i)" + self.player_2_response_pattern
 
         self.given_instruction = Instruction()
         self.followed_instruction = Instruction()
@@ -27,6 +27,8 @@ class WordGuesser(Player):
 
     def __init__(self, model: Model):
         super().__init__(model)
+        self.stop_sequences = ["\n"]  # a single GUESS: line (see player_stop_sequences)
+        self.response_pattern = "GUESS:"
 
     def _custom_response(self, messages, turn_idx):
         # mock response
@@ -37,6 +39,8 @@ class WordDescriber(Player):
 
     def __init__(self, model: Model, max_turns):
         super().__init__(model)
+        self.stop_sequences = ["\n"]  # a single CLUE: line (see player_stop_sequences)
+        self.response_pattern = "CLUE:"
         self.max_turns = max_turns
 
     def _custom_response(self, messages, turn_idx):
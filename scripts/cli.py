@@ -3,6 +3,7 @@ import json
 from typing import List
 
 from backends import ModelSpec
+from backends.utils import to_timedelta
 from clemgame import benchmark
 
 """
@@ -20,6 +21,40 @@ from clemgame import benchmark
     If the game supports model expansion (using the single specified model for all players):
     $> python3 scripts/cli.py run -g taboo -m mock
     
+    To run several games (or all games with '-g all') in a single process and with the same loaded models:
+    $> python3 scripts/cli.py run -g taboo referencegame -m mock --max_concurrent_games 2
+    
+    To play up to 8 episodes of an experiment at the same time:
+    $> python3 scripts/cli.py run -g referencegame -m gpt-3.5-turbo-0125 -p 8
+    
+    To continue a run that has been interrupted (only missing or failed episodes are played):
+    $> python3 scripts/cli.py run -g referencegame -m gpt-3.5-turbo-0125 --resume
+    
+    To play only the first of four disjoint slices of the game instances (e.g. on one of four machines):
+    $> python3 scripts/cli.py run -g referencegame -m mock --shard 1/4
+    
+    To add the episodes of a game to the work queue in the results directory and play them with this worker
+    (start more workers with the same command, also on other machines that share the results directory):
+    $> python3 scripts/cli.py worker -g referencegame -m gpt-3.5-turbo-0125 -r /shared/results
+    
+    To start another worker that only plays the jobs already in the queue:
+    $> python3 scripts/cli.py worker -r /shared/results
+    
+    To stop a run gracefully after 2 hours or 10000 model requests (whichever comes first):
+    $> python3 scripts/cli.py run -g all -m gpt-4-0613 --max_wall_time 2:00:00 --max_requests 10000
+    
+    To replay the unchanged turns of a previous run with temperature 0 from the response cache:
+    $> python3 scripts/cli.py run -g taboo -m gpt-4-0613 --cache write
+    
+    To play a game again with the responses recorded in previous results (without calling the model):
+    $> python3 scripts/cli.py run -g taboo -m gpt-4-0613 --replay results/v1.5 -r results/v1.5-replayed
+    
+    To measure the throughput of 16 concurrent episodes with simulated API latencies (but programmatic responses):
+    $> python3 scripts/cli.py run -g referencegame -m synthetic -p 16
+    
+    To evaluate several local models one after the other in one process with at most 40 GB of loaded models:
+    $> python3 scripts/cli.py run -g all -m Qwen1.5-0.5B-Chat-GGUF-q8 openchat_3.5-GGUF-q5 --sweep --max_model_memory 40
+    
     To score all games:
     $> python3 scripts/cli.py score
     
@@ -47,20 +82,109 @@ def read_model_specs(model_strings: List[str]):
     return model_specs
 
 
+def read_shard(shard_string: str):
+    if shard_string is None:
+        return None
+    try:
+        shard_idx, num_shards = [int(value) for value in shard_string.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard must be given as i/n, but is '{shard_string}'")
+    if not 1 <= shard_idx <= num_shards:
+        raise argparse.ArgumentTypeError(f"Shard i/n requires 1 <= i <= n, but is '{shard_string}'")
+    return shard_idx, num_shards
+
+
+def read_wall_time(wall_time_string: str):
+    try:
+        return to_timedelta(wall_time_string)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Wall time must be given as H:MM:SS, but is '{wall_time_string}'")
+
+
+def replay_model_specs(model_specs: List[ModelSpec], replay_root: str):
+    return [ModelSpec.from_dict({**model_spec.__dict__, "backend": "replay", "replay_root": replay_root})
+            for model_spec in model_specs]
+
+
 def read_gen_args(args: argparse.Namespace):
     return dict(temperature=args.temperature, max_tokens=args.max_tokens)
 
 
+def add_timeout_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--call_timeout", type=float,
+                        help="The seconds after which a model call is aborted. A 'call_timeout' in the model "
+                             "registry entry takes precedence. The episode is stored with the episode status "
+                             "'aborted_by_timeout'. Default: None (no timeout).")
+    parser.add_argument("--episode_timeout", type=float,
+                        help="The seconds after which an episode is aborted (at its next model call). The episode "
+                             "is stored with the episode status 'aborted_by_timeout'. Default: None (no timeout).")
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--cache", type=str, choices=["read", "write", "off"], default="off",
+                        help="Look up the responses of deterministic model calls (temperature 0) in a response "
+                             "cache ('read'), and also store the new responses ('write'). Cache hits are marked "
+                             "in the requests.json. Default: off.")
+    parser.add_argument("--cache_file", type=str,
+                        help="The response cache file. Default: response_cache.sqlite in the results directory.")
+    parser.add_argument("--cache_max_mb", type=float, default=1024.,
+                        help="The maximal size of the response cache in megabytes, before the least recently used "
+                             "responses are removed. Default: 1024.")
+
+
 def main(args: argparse.Namespace):
     if args.command_name == "ls":
         benchmark.list_games()
     if args.command_name == "run":
-        benchmark.run(args.game,
-                      model_specs=read_model_specs(args.models),
-                      gen_args=read_gen_args(args),
-                      experiment_name=args.experiment_name,
-                      instances_name=args.instances_name,
-                      results_dir=args.results_dir)
+        model_specs = read_model_specs(args.models)
+        if args.replay:
+            model_specs = replay_model_specs(model_specs, args.replay)
+        run_kwargs = dict(experiment_name=args.experiment_name,
+                          instances_name=args.instances_name,
+                          results_dir=args.results_dir,
+                          parallel_episodes=args.parallel_episodes,
+                          max_concurrent_games=args.max_concurrent_games,
+                          use_async=args.use_async,
+                          resume=args.resume,
+                          shard=args.shard,
+                          max_wall_time=args.max_wall_time,
+                          max_requests=args.max_requests,
+                          max_total_tokens=args.max_total_tokens,
+                          episode_retries=args.episode_retries,
+                          retry_backoff=args.retry_backoff,
+                          call_timeout=args.call_timeout,
+                          episode_timeout=args.episode_timeout,
+                          cache_mode=args.cache,
+                          cache_path=args.cache_file,
+                          cache_max_mb=args.cache_max_mb,
+                          lockstep=args.lockstep)
+        if args.sweep:
+            benchmark.sweep(args.game,
+                            dialogue_pairs=[[model_spec] for model_spec in model_specs],
+                            gen_args=read_gen_args(args),
+                            max_model_memory=args.max_model_memory,
+                            **run_kwargs)
+        else:
+            benchmark.run(args.game,
+                          model_specs=model_specs,
+                          gen_args=read_gen_args(args),
+                          **run_kwargs)
+    if args.command_name == "worker":
+        benchmark.work(args.game,
+                       model_specs=read_model_specs(args.models) if args.models else None,
+                       gen_args=read_gen_args(args),
+                       experiment_name=args.experiment_name,
+                       instances_name=args.instances_name,
+                       results_dir=args.results_dir,
+                       worker_id=args.worker_id,
+                       lease_seconds=args.lease_seconds,
+                       max_attempts=args.max_attempts,
+                       call_timeout=args.call_timeout,
+                       episode_timeout=args.episode_timeout,
+                       cache_mode=args.cache,
+                       cache_path=args.cache_file,
+                       cache_max_mb=args.cache_max_mb,
+                       max_model_memory=args.max_model_memory)
     if args.command_name == "score":
         benchmark.score(args.game, experiment_name=args.experiment_name, results_dir=args.results_dir)
     if args.command_name == "transcribe":
@@ -89,8 +213,9 @@ if __name__ == "__main__":
       Default: None.""")
     run_parser.add_argument("-e", "--experiment_name", type=str,
                             help="Optional argument to only run a specific experiment")
-    run_parser.add_argument("-g", "--game", type=str,
-                            required=True, help="A specific game name (see ls).")
+    run_parser.add_argument("-g", "--game", type=str, nargs="+",
+                            required=True, help="One or more game names (see ls) or 'all' to run all games "
+                                                "in a single process with the same models.")
     run_parser.add_argument("-t", "--temperature", type=float, default=0.0,
                             help="Argument to specify sampling temperature for the models. Default: 0.0.")
     run_parser.add_argument("-l", "--max_tokens", type=int, default=100,
@@ -103,6 +228,91 @@ if __name__ == "__main__":
                             help="A relative or absolute path to the results root directory. "
                                  "For example '-r results/v1.5/de‘ or '-r /absolute/path/for/results'. "
                                  "When not specified, then the results will be located in './results'")
+    run_parser.add_argument("-p", "--parallel_episodes", type=int, default=1,
+                            help="The number of episodes of an experiment to be played concurrently. "
+                                 "Higher values mostly pay off for remote API backends. Default: 1.")
+    run_parser.add_argument("--use_async", action="store_true",
+                            help="Play the concurrent episodes (see -p) as asyncio tasks in a single event loop "
+                                 "instead of worker threads. Backends without a native async client "
+                                 "are called in worker threads anyway, and so are game masters that are no "
+                                 "DialogueGameMaster (e.g. referencegame, imagegame, wordle, privateshared).")
+    run_parser.add_argument("--lockstep", action="store_true",
+                            help="Advance the concurrent episodes (see -p) together, so that the calls of all "
+                                 "episodes to a batching local model (huggingface_local) are generated as one batch "
+                                 "per turn. Cannot be combined with --use_async.")
+    run_parser.add_argument("--resume", action="store_true",
+                            help="Continue a previous run to the same results directory: Only the episodes that are "
+                                 "missing, failed, aborted by a timeout or whose instance changed are played again.")
+    run_parser.add_argument("--shard", type=read_shard,
+                            help="Only play the i-th of n disjoint slices of the game instances e.g. '--shard 2/4'. "
+                                 "Run all n shards (on several machines) with the same results directory to "
+                                 "obtain the results of the full run. The episodes keep their numbering.")
+    run_parser.add_argument("--max_concurrent_games", type=int, default=1,
+                            help="The number of games to be played at the same time, "
+                                 "when more than one game is given. Default: 1.")
+
+    run_parser.add_argument("--max_wall_time", type=read_wall_time,
+                            help="Stop the run after this time given as H:MM:SS e.g. '--max_wall_time 2:30:00'. "
+                                 "No new episodes are started and the running episodes are interrupted. "
+                                 "A summary of the (not) played episodes is stored to the results directory.")
+    run_parser.add_argument("--max_requests", type=int,
+                            help="Stop the run after this number of model requests (see --max_wall_time).")
+    run_parser.add_argument("--max_total_tokens", type=int,
+                            help="Stop the run after this number of prompt and completion tokens in total "
+                                 "(see --max_wall_time). Backends that do not report the token usage "
+                                 "are estimated with four characters per token.")
+    run_parser.add_argument("--episode_retries", type=int, default=2,
+                            help="The number of times an episode that failed due to a transient error (e.g. a rate "
+                                 "limit or a network error) is played again at the end of its experiment. "
+                                 "Default: 2.")
+    run_parser.add_argument("--retry_backoff", type=float, default=10.,
+                            help="The seconds to wait before the first retry of the failed episodes. "
+                                 "The time is doubled for each further retry. Default: 10.")
+    add_timeout_arguments(run_parser)
+    add_cache_arguments(run_parser)
+    run_parser.add_argument("--sweep", action="store_true",
+                            help="Run the games for each of the given models one after the other (instead of "
+                                 "as a dialogue pair). Use --max_model_memory to evict local models in between.")
+    run_parser.add_argument("--max_model_memory", type=float,
+                            help="The gigabytes of memory that the loaded local models may hold during a --sweep, "
+                                 "before the least recently used ones are unloaded. Default: None (no limit).")
+    run_parser.add_argument("--replay", type=str,
+                            help="A results directory of a previous run whose recorded responses of the models are "
+                                 "replayed instead of calling the models (see backends/replay_api.py). The episodes "
+                                 "fail, when the game takes a different course than in the recorded run.")
+
+    worker_parser = sub_parsers.add_parser("worker")
+    worker_parser.add_argument("-g", "--game", type=str, nargs="+",
+                               help="One or more game names (see ls) or 'all' whose episodes are added to the work "
+                                    "queue before playing. When not given, only the jobs already in the queue "
+                                    "are played.")
+    worker_parser.add_argument("-m", "--models", type=str, nargs="*",
+                               help="The dialogue pair for the added episodes (see run). When not given, then the "
+                                    "dialogue partners configured in the experiment are used.")
+    worker_parser.add_argument("-e", "--experiment_name", type=str,
+                               help="Optional argument to only add the episodes of a specific experiment")
+    worker_parser.add_argument("-t", "--temperature", type=float, default=0.0,
+                               help="Argument to specify sampling temperature for the models. Default: 0.0.")
+    worker_parser.add_argument("-l", "--max_tokens", type=int, default=100,
+                               help="Specify the maximum number of tokens to be generated per turn. Default: 100.")
+    worker_parser.add_argument("-i", "--instances_name", type=str, default="instances",
+                               help="The instances file name (.json suffix will be added automatically.")
+    worker_parser.add_argument("-r", "--results_dir", type=str, default="results",
+                               help="A relative or absolute path to the results root directory which contains the "
+                                    "work queue (jobs.sqlite). Use the same directory for all workers.")
+    worker_parser.add_argument("--worker_id", type=str,
+                               help="A name for the worker in the queue. Default: <hostname>-<process id>.")
+    worker_parser.add_argument("--lease_seconds", type=float, default=300.,
+                               help="A job is given to another worker, when its worker does not send a heartbeat "
+                                    "for this time e.g. because it crashed. Default: 300.")
+    worker_parser.add_argument("--max_attempts", type=int, default=3,
+                               help="The number of times a job with transient errors (e.g. rate limits) is played, "
+                                    "before it is marked as failed. Jobs with other errors fail at once. Default: 3.")
+    add_timeout_arguments(worker_parser)
+    add_cache_arguments(worker_parser)
+    worker_parser.add_argument("--max_model_memory", type=float,
+                               help="The gigabytes of memory that the loaded local models may hold, before the least "
+                                    "recently used ones are unloaded. Default: None (no limit).")
 
     score_parser = sub_parsers.add_parser("score")
     score_parser.add_argument("-e", "--experiment_name", type=str,
@@ -124,4 +334,7 @@ if __name__ == "__main__":
                                         "For example '-r results/v1.5/de‘ or '-r /absolute/path/for/results'. "
                                         "When not specified, then the results will be located in './results'")
 
-    main(parser.parse_args())
+    cli_args = parser.parse_args()
+    if cli_args.command_name == "run" and cli_args.use_async and cli_args.lockstep:
+        parser.error("--lockstep cannot be combined with --use_async")
+    main(cli_args)
@@ -0,0 +1,90 @@
+"""
+A stub game for the tests of running benchmarks: each episode of the single-player game prompts the player twice
+with the game id and the turn index and logs the responses. The played episodes and the responses are recorded in
+class attributes of the game master (see StubGameMaster.reset()).
+"""
+from typing import Dict, List
+
+from backends import Model, ModelSpec
+from clemgame.clemgame import GameBenchmark, GameMaster, Player
+
+
+class StubModel(Model):
+    """
+    Responds with the given response text or, by default, with the last message in upper case.
+    """
+
+    def __init__(self, model_name: str = "stub", response_text: str = None, response: Dict = None, **model_spec):
+        super().__init__(ModelSpec(model_name=model_name, **model_spec))
+        self.set_gen_args(temperature=0.0)
+        self.response_text = response_text
+        self.response = response
+
+    def generate_response(self, messages):
+        response_text = messages[-1]["content"].upper() if self.response_text is None else self.response_text
+        response = {"choices": [messages[-1]["content"]]} if self.response is None else self.response
+        return messages, response, response_text
+
+
+class StubPlayer(Player):
+
+    def _custom_response(self, messages, turn_idx):
+        return "counted"
+
+
+class StubGameMaster(GameMaster):
+    prompt_prefix = "count"
+    played_game_ids: List[int] = []
+    responses: List[str] = []
+    failures: Dict[int, List[Exception]] = {}  # the exceptions to be raised by the next plays of a game
+
+    def __init__(self, game_name: str, experiment: Dict, player_models: List[Model]):
+        super().__init__(game_name, experiment, player_models)
+        self.game_id = None
+        self.player = None
+
+    @classmethod
+    def reset(cls):
+        cls.prompt_prefix = "count"
+        cls.played_game_ids = []
+        cls.responses = []
+        cls.failures = {}
+
+    def setup(self, **game_instance):
+        self.game_id = game_instance["game_id"]
+        self.player = StubPlayer(self.player_models[0])
+        self.log_players({"GM": f"Game master for {self.name}", "Player 1": self.player_models[0].get_name()})
+
+    def play(self) -> None:
+        if StubGameMaster.failures.get(self.game_id):
+            raise StubGameMaster.failures[self.game_id].pop(0)
+        self.log_next_turn()
+        for turn_idx in range(2):
+            messages = [{"role": "user", "content": f"{StubGameMaster.prompt_prefix} {self.game_id} {turn_idx}"}]
+            prompt, response, response_text = self.player(messages, turn_idx)
+            StubGameMaster.responses.append(response_text)
+            self.log_event(from_="Player 1", to="GM", action={"type": "get message", "content": response_text},
+                           call=(prompt, response))
+        StubGameMaster.played_game_ids.append(self.game_id)
+
+
+class StubGameBenchmark(GameBenchmark):
+
+    def __init__(self, game_name: str = "countinggame", experiment_name: str = "counting", num_instances: int = 10):
+        super().__init__(game_name)
+        self.instances = {"experiments": [{
+            "name": experiment_name,
+            "game_instances": [{"game_id": game_id} for game_id in range(num_instances)]
+        }]}
+
+    def setup(self, instances_name: str = None):
+        pass  # the instances are given directly
+
+    def get_description(self) -> str:
+        return f"Stub game {self.name} for testing"
+
+    def is_single_player(self) -> bool:
+        return True
+
+    def create_game_master(self, experiment: Dict, player_models: List[Model]) -> GameMaster:
+        return StubGameMaster(self.name, experiment, player_models)
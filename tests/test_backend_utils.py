@@ -0,0 +1,37 @@
+import unittest
+from datetime import timedelta
+
+from backends.utils import assisted_generation_info, to_timedelta
+
+
+class AssistedGenerationInfoTestCase(unittest.TestCase):
+
+    def test_accepted_draft_tokens(self):
+        # 10 tokens in 4 steps: each step adds one token of the model, the other 6 are accepted draft tokens
+        self.assertEqual(assisted_generation_info(num_generated=10, num_steps=4, num_draft_tokens=8),
+                         {"draft_tokens": 8, "accepted_draft_tokens": 6, "acceptance_rate": 0.75,
+                          "tokens_per_step": 2.5})
+
+    def test_no_accepted_draft_tokens(self):
+        self.assertEqual(assisted_generation_info(num_generated=3, num_steps=3, num_draft_tokens=9),
+                         {"draft_tokens": 9, "accepted_draft_tokens": 0, "acceptance_rate": 0.,
+                          "tokens_per_step": 1.})
+
+    def test_rates_are_zero_without_steps_or_draft_tokens(self):
+        info = assisted_generation_info(num_generated=0, num_steps=0, num_draft_tokens=0)
+        self.assertEqual((info["acceptance_rate"], info["tokens_per_step"]), (0., 0.))
+
+    def test_rates_are_rounded(self):
+        info = assisted_generation_info(num_generated=7, num_steps=3, num_draft_tokens=9)
+        self.assertEqual((info["acceptance_rate"], info["tokens_per_step"]), (0.444, 2.333))
+
+
+class ToTimedeltaTestCase(unittest.TestCase):
+
+    def test_to_timedelta(self):
+        self.assertEqual(to_timedelta("0:01:23.500000"), timedelta(minutes=1, seconds=23.5))
+        self.assertEqual(to_timedelta("2 days, 1:00:00"), timedelta(days=2, hours=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
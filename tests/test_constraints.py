@@ -0,0 +1,38 @@
+import unittest
+
+from backends.constraints import ResponseConstraint, regex_to_gbnf
+
+REFERENCE_PATTERN = r'(?i)^answer:\s(?P<content>first|second|third)\n*(?P<remainder>.*)'
+
+
+class ResponseConstraintTestCase(unittest.TestCase):
+
+    def test_prefixes_of_valid_responses_are_allowed(self):
+        constraint = ResponseConstraint(REFERENCE_PATTERN)
+        self.assertTrue(constraint.allows("\n An"))
+        self.assertTrue(constraint.allows("Answer: sec"))
+        self.assertFalse(constraint.allows("Answer: fourth"))
+        self.assertFalse(constraint.allows("The answer"))
+
+    def test_only_valid_responses_are_complete(self):
+        constraint = ResponseConstraint(r"^instruction: [^\n]+$")
+        self.assertFalse(constraint.is_complete("instruction: "))
+        self.assertTrue(constraint.is_complete("instruction: put an X"))
+        self.assertFalse(constraint.allows("instruction: put an X\nthen"))
+
+
+class RegexToGBNFTestCase(unittest.TestCase):
+
+    def test_translation(self):
+        self.assertEqual(regex_to_gbnf("GUESS:"), 'root ::= [ \\t\\n]* ("GUESS:") [^\\x00]*\n')
+        self.assertEqual(regex_to_gbnf(r'^[^a-c\d]x{1,2}$'),
+                         'root ::= [ \\t\\n]* ([^0-9a-c] (("x") ("x")?))\n')
+        self.assertIn('([Ff] [Ii] [Rr] [Ss] [Tt]) | ', regex_to_gbnf(REFERENCE_PATTERN))
+
+    def test_unsupported_constructs(self):
+        with self.assertRaises(ValueError):
+            regex_to_gbnf(r"(?=a)b")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import asyncio
+import unittest
+from typing import Dict, List
+
+from backends import CustomResponseModel, Model
+from clemgame.clemgame import DialogueGameMaster, Player
+
+
+class EchoPlayer(Player):
+
+    def _custom_response(self, messages, turn_idx):
+        return f"echo {turn_idx}: {messages[-1]['content']}"
+
+
+class EchoGame(DialogueGameMaster):
+
+    def __init__(self, experiment: Dict, player_models: List[Model]):
+        super().__init__("echogame", experiment, player_models)
+        self.max_turns = experiment["max_turns"]
+
+    def _on_setup(self, **game_instance):
+        self.player = EchoPlayer(self.player_models[0])
+        self.add_player(self.player)
+
+    def _on_before_game(self):
+        self.add_user_message(self.player, "Hello")
+
+    def _after_add_player_response(self, player: Player, utterance: str):
+        self.add_user_message(player, f"Turn {self.current_turn + 1}")
+
+    def _does_game_proceed(self):
+        return self.current_turn < self.max_turns
+
+
+def strip_timestamps(turns):
+    return [[{k: v for k, v in event.items() if k != "timestamp"} for event in turn] for turn in turns]
+
+
+class DialogueGameMasterTestCase(unittest.TestCase):
+
+    def test_aplay_logs_same_interactions_as_play(self):
+        experiment = {"name": "test", "max_turns": 3}
+
+        game = EchoGame(experiment, [CustomResponseModel()])
+        game.setup(game_id=0)
+        game.play()
+
+        async_game = EchoGame(experiment, [CustomResponseModel()])
+        async_game.setup(game_id=0)
+        asyncio.run(async_game.aplay())
+
+        self.assertEqual(len(async_game.interactions["turns"]), 3)
+        self.assertEqual(strip_timestamps(game.interactions["turns"]),
+                         strip_timestamps(async_game.interactions["turns"]))
+        self.assertEqual(game.messages_by_names, async_game.messages_by_names)
+        self.assertEqual(len(async_game.requests), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
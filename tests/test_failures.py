@@ -0,0 +1,42 @@
+import unittest
+
+from backends import ContextExceededError
+from clemgame.failures import is_transient_error
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class APIStatusError(Exception):
+
+    def __init__(self, status_code: int):
+        super().__init__(f"Status {status_code}")
+        self.status_code = status_code
+
+
+class FailuresTestCase(unittest.TestCase):
+
+    def test_transient_errors(self):
+        self.assertTrue(is_transient_error(ConnectionResetError()))
+        self.assertTrue(is_transient_error(TimeoutError()))
+        self.assertTrue(is_transient_error(RateLimitError()))
+        self.assertTrue(is_transient_error(APIStatusError(503)))
+
+    def test_deterministic_errors(self):
+        self.assertFalse(is_transient_error(ContextExceededError()))
+        self.assertFalse(is_transient_error(KeyError("player")))
+        self.assertFalse(is_transient_error(APIStatusError(400)))
+
+    def test_transient_cause(self):
+        try:
+            try:
+                raise RateLimitError()
+            except RateLimitError as e:
+                raise RuntimeError("game failed") from e
+        except RuntimeError as e:
+            self.assertTrue(is_transient_error(e))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import timedelta
+
+from backends import CustomResponseModel
+from backends.utils import to_timedelta
+from clemgame.budget import RunBudget
+from stub_game import StubGameBenchmark, StubGameMaster, StubModel
+
+GAME_NAME = "countinggame"
+
+
+class SleepingModel(StubModel):
+
+    def __init__(self, seconds: float, **model_spec):
+        super().__init__("sleeping", response_text="counted", **model_spec)
+        self.seconds = seconds
+
+    def generate_response(self, messages):
+        time.sleep(self.seconds)
+        return super().generate_response(messages)
+
+
+class BatchingModel(StubModel):
+
+    def __init__(self):
+        super().__init__("batching", response_text="counted")
+        self.batch_sizes = []
+
+    def generate_response(self, messages):
+        return self.generate_batch([messages])[0]
+
+    def generate_batch(self, batch_messages):
+        self.batch_sizes.append(len(batch_messages))
+        return [StubModel.generate_response(self, messages) for messages in batch_messages]
+
+
+class GameBenchmarkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+        self.experiment_dir = os.path.join(self.results_dir, "programmatic-t0.0--programmatic-t0.0",
+                                           GAME_NAME, "0_counting")
+        StubGameMaster.reset()
+
+    def tearDown(self):
+        shutil.rmtree(self.results_dir)
+
+    def test_parallel_episodes_store_episodes_by_index(self):
+        StubGameBenchmark().run([CustomResponseModel()], results_dir=self.results_dir, parallel_episodes=4)
+        self.assertEqual(sorted(StubGameMaster.played_game_ids), list(range(10)))
+        for game_id in range(10):
+            with open(os.path.join(self.experiment_dir, f"episode_{game_id}", "requests.json")) as f:
+                self.assertIn(f"count {game_id} 0", f.read())
+
+    def test_resume_only_plays_incomplete_episodes(self):
+        StubGameBenchmark().run([CustomResponseModel()], results_dir=self.results_dir)
+        os.remove(os.path.join(self.experiment_dir, "episode_3", "interactions.json"))
+        shutil.rmtree(os.path.join(self.experiment_dir, "episode_7"))
+        StubGameMaster.played_game_ids = []
+
+        StubGameBenchmark().run([CustomResponseModel()], results_dir=self.results_dir, resume=True)
+        self.assertEqual(sorted(StubGameMaster.played_game_ids), [3, 7])
+
+    def test_resume_keeps_the_previous_duration_when_interrupted(self):
+        StubGameBenchmark().run([CustomResponseModel()], results_dir=self.results_dir)
+        experiment_file = os.path.join(self.experiment_dir, "experiment_counting.json")
+        with open(experiment_file) as f:
+            experiment_config = json.load(f)
+        experiment_config["duration"] = "1:00:00"
+        with open(experiment_file, "w") as f:
+            json.dump(experiment_config, f)
+        shutil.rmtree(os.path.join(self.experiment_dir, "episode_7"))
+        StubGameMaster.failures = {7: [KeyboardInterrupt()]}
+
+        with self.assertRaises(KeyboardInterrupt):
+            StubGameBenchmark().run([CustomResponseModel()], results_dir=self.results_dir, resume=True)
+        with open(experiment_file) as f:
+            self.assertEqual(to_timedelta(json.load(f)["duration"]), timedelta(hours=1))
+
+    def test_shards_are_disjoint_and_complete(self):
+        played_by_shard = []
+        for shard_idx in range(1, 4):
+            StubGameMaster.played_game_ids = []
+            StubGameBenchmark().run([CustomResponseModel()], results_dir=self.results_dir, shard=(shard_idx, 3))
+            played_by_shard.append(set(StubGameMaster.played_game_ids))
+        self.assertEqual(set.union(*played_by_shard), set(range(10)))
+        self.assertEqual(sum(len(played) for played in played_by_shard), 10)
+        self.assertEqual(sorted(os.listdir(self.experiment_dir)),
+                         sorted([f"episode_{game_id}" for game_id in range(10)] + ["experiment_counting.json"]))
+
+    def test_run_stops_when_budget_is_exhausted(self):
+        with RunBudget(max_requests=3) as budget:
+            StubGameBenchmark().run([StubModel("constant", response_text="counted",
+                                              response={"usage": {"total_tokens": 10}})],
+                                    results_dir=self.results_dir)
+        self.assertEqual(StubGameMaster.played_game_ids, [0])
+        self.assertEqual(budget.num_tokens, 30)
+        summary_file = budget.store_summary(self.results_dir)
+        with open(summary_file) as f:
+            summary = json.load(f)
+        self.assertEqual(summary["counts"], {"played": 1, "aborted_by_timeout": 0, "failed": 0,
+                                             "failed_transient": 0, "interrupted": 1, "not_started": 8})
+        self.assertEqual(summary["episodes"]["interrupted"][0]["episode"], "0_counting/episode_1")
+        self.assertFalse(os.path.exists(os.path.join(self.experiment_dir, "episode_1", "interactions.json")))
+
+    def test_transient_failures_are_retried(self):
+        StubGameMaster.failures = {3: [ConnectionError(), TimeoutError()],
+                                       5: [ConnectionError(), ConnectionError(), ConnectionError()],
+                                       7: [ValueError(), ValueError()]}
+        with RunBudget() as budget:
+            StubGameBenchmark().run([CustomResponseModel()], results_dir=self.results_dir,
+                                        parallel_episodes=4, episode_retries=2, retry_backoff=0)
+        self.assertEqual(sorted(StubGameMaster.played_game_ids), [0, 1, 2, 3, 4, 6, 8, 9])
+        self.assertEqual(len(StubGameMaster.failures[7]), 1)  # not retried
+        counts = budget.summary()["counts"]
+        self.assertEqual((counts["played"], counts["failed"], counts["failed_transient"]), (8, 1, 1))
+
+    def test_no_retry_wait_beyond_the_budget(self):
+        StubGameMaster.failures = {5: [ConnectionError()]}
+        start = time.time()
+        with RunBudget(max_wall_time=timedelta(seconds=30)) as budget:
+            StubGameBenchmark().run([CustomResponseModel()], results_dir=self.results_dir,
+                                        episode_retries=1, retry_backoff=60)
+        self.assertLess(time.time() - start, 10)
+        self.assertNotIn(5, StubGameMaster.played_game_ids)
+        self.assertEqual(budget.summary()["counts"]["failed_transient"], 1)
+
+    def assert_aborted_by_timeout(self, game_id: int, timeout_type: str):
+        episode_dir = os.path.join(self.results_dir, "sleeping-t0.0--sleeping-t0.0", GAME_NAME, "0_counting",
+                                   f"episode_{game_id}")
+        with open(os.path.join(episode_dir, "interactions.json")) as f:
+            interactions = json.load(f)
+        self.assertEqual(interactions["episode status"], "aborted_by_timeout")
+        self.assertEqual(interactions["timeout"]["type"], timeout_type)
+
+    def test_call_timeout_aborts_episode(self):
+        benchmark = StubGameBenchmark()
+        benchmark.instances["experiments"][0]["game_instances"] = [{"game_id": 0}]
+        benchmark.run([SleepingModel(1.)], results_dir=self.results_dir, call_timeout=.05)
+        self.assertEqual(StubGameMaster.played_game_ids, [])
+        self.assert_aborted_by_timeout(0, "call")
+
+        benchmark.compute_scores(self.results_dir)
+        with open(os.path.join(self.results_dir, "sleeping-t0.0--sleeping-t0.0", GAME_NAME, "0_counting",
+                               "episode_0", "scores.json")) as f:
+            self.assertEqual(json.load(f)["episode scores"]["Aborted"], 1)
+
+    def test_resume_plays_episodes_aborted_by_timeout_again(self):
+        benchmark = StubGameBenchmark()
+        benchmark.instances["experiments"][0]["game_instances"] = [{"game_id": 0}]
+        benchmark.run([SleepingModel(1.)], results_dir=self.results_dir, call_timeout=.05)
+        self.assert_aborted_by_timeout(0, "call")
+
+        benchmark.run([SleepingModel(0.)], results_dir=self.results_dir, resume=True)
+        self.assertEqual(StubGameMaster.played_game_ids, [0])
+
+    def test_model_spec_call_timeout_with_async(self):
+        benchmark = StubGameBenchmark()
+        benchmark.instances["experiments"][0]["game_instances"] = [{"game_id": 0}]
+        benchmark.run([SleepingModel(1., call_timeout=.05)], results_dir=self.results_dir, use_async=True)
+        self.assert_aborted_by_timeout(0, "call")
+
+    def test_episode_timeout_aborts_episode(self):
+        benchmark = StubGameBenchmark()
+        benchmark.instances["experiments"][0]["game_instances"] = [{"game_id": 0}, {"game_id": 1}]
+        benchmark.run([SleepingModel(.1)], results_dir=self.results_dir, episode_timeout=.15, call_timeout=1.)
+        self.assertEqual(StubGameMaster.played_game_ids, [])
+        self.assert_aborted_by_timeout(0, "episode")
+        self.assert_aborted_by_timeout(1, "episode")
+
+    def test_lockstep_is_not_combined_with_async(self):
+        with self.assertRaises(ValueError):
+            StubGameBenchmark().run([BatchingModel()], results_dir=self.results_dir, parallel_episodes=5,
+                                        use_async=True, lockstep=True)
+        self.assertEqual(StubGameMaster.played_game_ids, [])
+
+    def test_lockstep_batches_the_calls_of_concurrent_episodes(self):
+        model = BatchingModel()
+        StubGameBenchmark().run([model], results_dir=self.results_dir, parallel_episodes=5, lockstep=True)
+        self.assertEqual(sorted(StubGameMaster.played_game_ids), list(range(10)))
+        self.assertEqual(sum(model.batch_sizes), 20)
+        self.assertLess(len(model.batch_sizes), 20)
+        self.assertEqual(max(model.batch_sizes), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+
+import backends
+from backends import load_model, load_models, load_model_registry, is_model_loaded
+from backends.synthetic_api import SyntheticModel
+from clemgame.scheduling import order_for_model_reuse
+
+SYNTHETIC_SPEC = {"model_name": "synthetic-pooled", "backend": "synthetic", "seed": 1}
+
+
+class LocalSyntheticModel(SyntheticModel):
+    """ Pretends to hold a gigabyte of memory """
+
+    def get_memory_footprint(self) -> int:
+        return 1024 ** 3
+
+    def unload(self):
+        self.random = None
+
+
+class LocalSynthetic(backends.Backend):
+
+    def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
+        return LocalSyntheticModel(model_spec)
+
+
+class ModelPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        load_model_registry()
+
+    def tearDown(self):
+        backends.set_model_memory_budget(None)
+
+    def test_identical_specs_share_the_model(self):
+        model = load_model(SYNTHETIC_SPEC, dict(temperature=0.0, max_tokens=100))
+        self.assertIs(load_model(dict(SYNTHETIC_SPEC), dict(max_tokens=100, temperature=0.0)), model)
+
+    def test_other_gen_args_share_the_loaded_model(self):
+        model = load_model(SYNTHETIC_SPEC, dict(temperature=0.0, max_tokens=100))
+        other_model = load_model(SYNTHETIC_SPEC, dict(temperature=0.7, max_tokens=100))
+        self.assertIsNot(other_model, model)
+        self.assertIs(other_model.random, model.random)  # e.g. the weights of a local model
+        self.assertEqual((model.get_temperature(), other_model.get_temperature()), (0.0, 0.7))
+
+    def test_shared_models_do_not_share_the_gen_args(self):
+        model_spec = dict(SYNTHETIC_SPEC, model_name="synthetic-pooled-gen-args")
+        model = load_model(model_spec, dict(temperature=0.0, max_tokens=100))
+        other_model = load_model(model_spec, None)
+        other_model.set_gen_arg("max_tokens", 10)
+        self.assertEqual(model.get_gen_arg("max_tokens"), 100)
+
+    def test_registered_model_name_is_unified(self):
+        self.assertIs(load_model("synthetic", dict(temperature=0.0)),
+                      load_model({"model_name": "synthetic", "backend": "synthetic"}, dict(temperature=0.0)))
+
+    def test_least_recently_used_models_are_evicted(self):
+        backends.set_model_memory_budget(2 * 1024 ** 3)
+        backends._backend_registry["local_synthetic"] = LocalSynthetic()
+        model_specs = [{"model_name": f"local-{idx}", "backend": "local_synthetic"} for idx in range(3)]
+        first_model, second_model = load_models(model_specs[:2], dict(temperature=0.0))
+        load_model(model_specs[0], dict(temperature=0.0))  # now the second one is the least recently used
+        load_model(model_specs[2], dict(temperature=0.0))
+        self.assertEqual([is_model_loaded(model_spec) for model_spec in model_specs], [True, False, True])
+        self.assertIsNone(second_model.random)
+        self.assertIsNotNone(first_model.random)
+
+    def test_order_for_model_reuse(self):
+        dialogue_pairs = [["a", "b"], ["c", "d"], ["a", "c"], ["b", "e"]]
+        ordered = order_for_model_reuse(dialogue_pairs, is_loaded=lambda model: model == "d")
+        self.assertEqual(ordered, [["c", "d"], ["a", "c"], ["a", "b"], ["b", "e"]])
+
+
+if __name__ == '__main__':
+    unittest.main()
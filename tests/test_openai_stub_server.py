@@ -0,0 +1,50 @@
+import json
+import unittest
+import urllib.error
+import urllib.request
+
+from backends.openai_stub_server import StubOpenAIServer
+
+
+def post_chat_completion(base_url: str, content: str):
+    request = urllib.request.Request(f"{base_url}/chat/completions", method="POST",
+                                     data=json.dumps({"model": "stub", "messages": [
+                                         {"role": "user", "content": content}]}).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return json.load(response)
+
+
+class StubOpenAIServerTestCase(unittest.TestCase):
+
+    def start_server(self, **kwargs) -> StubOpenAIServer:
+        server = StubOpenAIServer(port=0, **kwargs).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def test_scripted_responses(self):
+        server = self.start_server(responses=["first", "second"])
+        contents = [post_chat_completion(server.base_url(), "hello")["choices"][0]["message"]["content"]
+                    for _ in range(3)]
+        self.assertEqual(contents, ["first", "second", "first"])
+        with urllib.request.urlopen(f"{server.base_url()}/models", timeout=5) as response:
+            self.assertEqual([model["id"] for model in json.load(response)["data"]], ["stub"])
+
+    def test_echo_response(self):
+        server = self.start_server()
+        completion = post_chat_completion(server.base_url(), "hello")
+        self.assertEqual(completion["choices"][0]["message"], {"role": "assistant", "content": "hello"})
+        self.assertEqual(completion["usage"]["prompt_tokens"], 1)
+
+    def test_rate_limit_errors_with_retry_after(self):
+        server = self.start_server(rate_429=1., retry_after=2)
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            post_chat_completion(server.base_url(), "hello")
+        self.assertEqual(context.exception.code, 429)
+        self.assertEqual(context.exception.headers["Retry-After"], "2")
+        with urllib.request.urlopen(f"{server.base_url()}/stats", timeout=5) as response:
+            self.assertEqual(json.load(response), {"429": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
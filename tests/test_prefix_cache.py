@@ -0,0 +1,210 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from backends.context import episode_context
+from backends.utils import TokenPrefixTrie, PrefixStateCache, IncrementalTokenizer, DialogueKVCache, \
+    GenerationBatcher, truncate_at_stop_sequence
+
+
+class TokenPrefixTrieTestCase(unittest.TestCase):
+
+    def test_insert_returns_shared_prefix_length(self):
+        trie = TokenPrefixTrie()
+        self.assertEqual(trie.insert([1, 2, 3, 4, 5]), 0)
+        self.assertEqual(trie.insert([1, 2, 3, 9]), 3)
+        self.assertEqual(trie.insert([1, 2, 3, 9, 7]), 4)
+        self.assertEqual(trie.insert([1, 2]), 2)
+        self.assertEqual(trie.insert([8]), 0)
+
+    def test_longest_value(self):
+        trie = TokenPrefixTrie()
+        trie.insert([1, 2, 3, 4, 5])
+        trie.set_value([1, 2], "short")
+        trie.set_value([1, 2, 3, 4], "long")
+        self.assertEqual(trie.longest_value([1, 2, 3, 4, 6]), (4, "long"))
+        self.assertEqual(trie.longest_value([1, 2, 3, 6]), (2, "short"))
+        self.assertEqual(trie.longest_value([1, 3]), (0, None))
+        trie.set_value([1, 2, 3, 4], None)
+        self.assertEqual(trie.longest_value([1, 2, 3, 4, 5]), (2, "short"))
+
+
+class PrefixStateCacheTestCase(unittest.TestCase):
+
+    def test_states_of_common_prefixes(self):
+        cache = PrefixStateCache(max_states=1, min_tokens=3)
+        instructions = [1, 2, 3, 4]
+        cache.update(instructions + [10, 11], lambda num_tokens: num_tokens)
+        self.assertEqual(cache.lookup(instructions + [12]), (0, None))  # nothing shared yet
+
+        cache.update(instructions + [12], lambda num_tokens: num_tokens)
+        self.assertEqual(cache.lookup(instructions + [13, 14]), (4, 4))
+
+        cache.update([1, 2, 5], lambda num_tokens: num_tokens)  # too short to be cached
+        self.assertEqual(cache.lookup([1, 2, 6]), (0, None))
+
+        cache.update([7, 8, 9, 1], lambda num_tokens: num_tokens)
+        cache.update([7, 8, 9, 2], lambda num_tokens: num_tokens)  # evicts the state of the instructions
+        self.assertEqual(cache.lookup([7, 8, 9, 3]), (3, 3))
+        self.assertEqual(cache.lookup(instructions + [15]), (0, None))
+
+
+def dialogue(num_turns, name="dialogue"):
+    messages = [{"role": "user", "content": f"{name} instructions"}]
+    for turn_idx in range(num_turns):
+        messages += [{"role": "assistant", "content": f"answer {turn_idx}"}, {"role": "user", "content": "next"}]
+    return messages
+
+
+class DialogueKVCacheTestCase(unittest.TestCase):
+
+    def test_lookup_returns_the_longest_cached_prefix(self):
+        cache = DialogueKVCache()
+        cache.store(dialogue(0), [1], "first turn")
+        cache.store(dialogue(1), [1, 2], "second turn")
+        self.assertEqual(cache.lookup(dialogue(3)), ([1, 2], "second turn"))
+        self.assertIsNone(cache.lookup(dialogue(0, name="other")))
+
+    def test_lookup_pops_the_entry(self):
+        cache = DialogueKVCache()
+        cache.store(dialogue(0), [1], "first turn")
+        self.assertEqual(cache.lookup(dialogue(1)), ([1], "first turn"))
+        self.assertIsNone(cache.lookup(dialogue(1)))
+
+    def test_least_recently_stored_entries_are_evicted(self):
+        cache = DialogueKVCache(max_dialogues=2)
+        for name in ["a", "b", "c"]:
+            cache.store(dialogue(0, name), [1], name)
+        self.assertIsNone(cache.lookup(dialogue(1, "a")))
+        self.assertEqual(cache.lookup(dialogue(1, "b")), ([1], "b"))
+        self.assertEqual(cache.lookup(dialogue(1, "c")), ([1], "c"))
+
+    def test_entries_of_finished_episodes_are_removed(self):
+        cache = DialogueKVCache()
+        with episode_context("game", "pair", "0_experiment/episode_0"):
+            cache.store(dialogue(0, "finished"), [1], "finished")
+        with episode_context("game", "pair", "0_experiment/episode_1"):
+            cache.store(dialogue(0, "running"), [1], "running")
+            cache.store(dialogue(0, "other"), [1], "other")
+            self.assertEqual(len(cache.entries), 2)
+            self.assertIsNone(cache.lookup(dialogue(1, "finished")))
+            self.assertEqual(cache.lookup(dialogue(1, "running")), ([1], "running"))
+
+
+class GenerationBatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def generate_batch(self, batch_prompt_token_ids, generation_kwargs):
+        with self.lock:
+            self.batches.append((batch_prompt_token_ids, generation_kwargs))
+        return [prompt_token_ids + [generation_kwargs["temperature"]] for prompt_token_ids in batch_prompt_token_ids]
+
+    def generate_concurrently(self, batcher, requests):
+        with ThreadPoolExecutor(len(requests)) as executor:
+            futures = [executor.submit(batcher.generate, *request) for request in requests]
+            return [future.result(timeout=5) for future in futures]
+
+    def test_requests_are_batched_by_generation_kwargs(self):
+        batcher = GenerationBatcher(self.generate_batch, max_batch_size=4, max_wait_ms=2000)
+        results = self.generate_concurrently(batcher, [([1], {"temperature": 0}), ([2], {"temperature": 1}),
+                                                       ([3], {"temperature": 0}), ([4], {"temperature": 1})])
+        batcher.stop()
+        self.assertEqual(results, [([1, 0], 2), ([2, 1], 2), ([3, 0], 2), ([4, 1], 2)])
+        self.assertEqual(sorted((sorted(prompts), kwargs["temperature"]) for prompts, kwargs in self.batches),
+                         [([[1], [3]], 0), ([[2], [4]], 1)])
+
+    def test_lone_request_is_handed_back(self):
+        batcher = GenerationBatcher(self.generate_batch, max_batch_size=4, max_wait_ms=10)
+        self.assertIsNone(batcher.generate([1], {"temperature": 0}))
+        batcher.stop()
+        self.assertEqual(self.batches, [])
+
+    def test_exception_reaches_each_caller(self):
+        def fail(batch_prompt_token_ids, generation_kwargs):
+            raise ValueError("out of memory")
+
+        batcher = GenerationBatcher(fail, max_batch_size=2, max_wait_ms=2000)
+        with ThreadPoolExecutor(2) as executor:
+            futures = [executor.submit(batcher.generate, [idx], {"temperature": 0}) for idx in range(2)]
+            for future in futures:
+                self.assertRaises(ValueError, future.result, 5)
+        batcher.stop()
+
+    def test_stop_ends_the_thread(self):
+        batcher = GenerationBatcher(self.generate_batch, max_batch_size=2, max_wait_ms=10)
+        batcher.generate([1], {"temperature": 0})
+        thread = batcher.thread
+        batcher.stop()
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(batcher.thread)
+        self.assertIsNone(batcher.generate([1], {"temperature": 0}))  # restarted on demand
+        batcher.stop()
+
+
+def render(messages):
+    return "".join(f"<{message['role']}>{message['content']}" for message in messages) + "<assistant>"
+
+
+class IncrementalTokenizerTestCase(unittest.TestCase):
+
+    def test_only_the_appended_text_is_tokenized(self):
+        tokenized_texts = []
+
+        def tokenize(text):
+            tokenized_texts.append(text)
+            return [ord(char) for char in text]
+
+        tokenizer = IncrementalTokenizer(tokenize, verify_every=0)
+        messages = [{"role": "user", "content": "first"}]
+        tokenizer(messages, render(messages))
+        messages = messages + [{"role": "assistant", "content": "answer"}, {"role": "user", "content": "second"}]
+        token_ids = tokenizer(messages, render(messages))
+        self.assertEqual(token_ids, [ord(char) for char in render(messages)])
+        self.assertEqual(tokenized_texts[-1], "answer<user>second<assistant>")
+
+    def test_prefix_dependent_tokenization_is_detected(self):
+        tokenizer = IncrementalTokenizer(lambda text: [0] + [ord(char) for char in text])  # like a prefix space
+        messages = [{"role": "user", "content": "first"}]
+        tokenizer(messages, render(messages))
+        messages = messages + [{"role": "assistant", "content": "answer"}, {"role": "user", "content": "second"}]
+        self.assertEqual(tokenizer(messages, render(messages)), [0] + [ord(char) for char in render(messages)])
+        self.assertFalse(tokenizer.is_incremental)
+
+    def test_each_new_shape_is_verified(self):
+        def tokenize(text):  # merges a user message ending with x and a following system message
+            head, separator, tail = text.partition("x<system>")
+            return [ord(char) for char in head] + ([-1] + tokenize(tail) if separator else [])
+
+        def render_history(messages):
+            return "".join(f"<{message['role']}>{message['content']}" for message in messages)
+
+        tokenizer = IncrementalTokenizer(tokenize)
+        messages = [{"role": "user", "content": "first"}]
+        tokenizer(messages, render_history(messages))
+        for _ in range(5):
+            messages = messages + [{"role": "assistant", "content": "answer"}, {"role": "user", "content": "x"}]
+            tokenizer(messages, render_history(messages))
+        self.assertTrue(tokenizer.is_incremental)
+        messages = messages + [{"role": "system", "content": "note"}]
+        self.assertEqual(tokenizer(messages, render_history(messages)), tokenize(render_history(messages)))
+        self.assertFalse(tokenizer.is_incremental)
+
+
+class StopSequenceTestCase(unittest.TestCase):
+
+    def test_truncate_at_first_stop_sequence(self):
+        self.assertEqual(truncate_at_stop_sequence("Answer: first\nAnswer: second", ["\n"]), "Answer: first")
+        self.assertEqual(truncate_at_stop_sequence("a</s>b\nc", ["\n", "</s>"]), "a")
+        self.assertEqual(truncate_at_stop_sequence("no stop", ["\n"]), "no stop")
+
+    def test_leading_stop_sequences_are_ignored(self):
+        self.assertEqual(truncate_at_stop_sequence("\n\nGUESS: pear\nmore", ["\n"]), "\n\nGUESS: pear")
+        self.assertEqual(truncate_at_stop_sequence("\n", ["\n"]), "\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
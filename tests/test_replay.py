@@ -0,0 +1,64 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from typing import Dict, List
+
+from backends import ModelSpec
+from backends.replay_api import Replay
+from stub_game import StubGameBenchmark, StubGameMaster, StubModel
+
+GAME_NAME = "echogame"
+DIALOGUE_PAIR = "echo-t0.0--echo-t0.0"
+
+
+class ReplayTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.recorded_dir = tempfile.mkdtemp()
+        self.replayed_dir = tempfile.mkdtemp()
+        StubGameMaster.reset()
+        StubGameMaster.prompt_prefix = "echo"
+        self.echo_game().run([StubModel("echo")], results_dir=self.recorded_dir)
+        self.recorded_responses = StubGameMaster.responses
+        StubGameMaster.responses = []
+        self.replay_model = Replay().get_model_for(
+            ModelSpec(model_name="echo", backend="replay", replay_root=self.recorded_dir))
+        self.replay_model.set_gen_args(temperature=0.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.recorded_dir)
+        shutil.rmtree(self.replayed_dir)
+
+    @staticmethod
+    def echo_game() -> StubGameBenchmark:
+        return StubGameBenchmark(GAME_NAME, "echo", num_instances=3)
+
+    def requests_of(self, results_dir: str, episode_idx: int) -> List[Dict]:
+        with open(os.path.join(results_dir, DIALOGUE_PAIR, GAME_NAME, "0_echo", f"episode_{episode_idx}",
+                               "requests.json")) as f:
+            return json.load(f)
+
+    def test_replay_returns_recorded_responses(self):
+        for use_async in [False, True]:
+            StubGameMaster.responses = []
+            self.echo_game().run([self.replay_model], results_dir=self.replayed_dir, parallel_episodes=2,
+                                 use_async=use_async, call_timeout=5.)
+            self.assertEqual(sorted(StubGameMaster.responses), sorted(self.recorded_responses))
+            for episode_idx in range(3):
+                recorded, replayed = self.requests_of(self.recorded_dir, episode_idx), \
+                    self.requests_of(self.replayed_dir, episode_idx)
+                self.assertEqual([request["manipulated_prompt_obj"] for request in recorded],
+                                 [request["manipulated_prompt_obj"] for request in replayed])
+
+    def test_replay_fails_on_divergence(self):
+        StubGameMaster.prompt_prefix = "changed"
+        self.echo_game().run([self.replay_model], results_dir=self.replayed_dir)
+        self.assertEqual(StubGameMaster.responses, [])
+        self.assertFalse(os.path.exists(os.path.join(self.replayed_dir, DIALOGUE_PAIR, GAME_NAME, "0_echo",
+                                                     "episode_0", "interactions.json")))
+
+
+if __name__ == '__main__':
+    unittest.main()
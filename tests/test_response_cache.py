@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from backends import Model, ModelSpec
+from clemgame.clemgame import Player
+from clemgame.response_cache import ResponseCache
+
+
+class EchoModel(Model):
+
+    def __init__(self, temperature: float = 0.0, **model_spec):
+        super().__init__(ModelSpec(model_name="echo", model_id="echo-1", backend="echo", **model_spec))
+        self.set_gen_args(temperature=temperature, max_tokens=100)
+        self.num_calls = 0
+
+    def generate_response(self, messages):
+        self.num_calls += 1
+        return messages, {"choices": [messages[-1]["content"]]}, messages[-1]["content"]
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.cache_dir, "response_cache.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_player_returns_cached_responses(self):
+        model = EchoModel()
+        player = Player(model)
+        messages = [{"role": "user", "content": "hello"}]
+        with ResponseCache(self.cache_path, mode="write") as cache:
+            _, first_response, _ = player(messages, 0)
+            _, second_response, response_text = player(messages, 1)
+        self.assertEqual(model.num_calls, 1)
+        self.assertEqual(response_text, "hello")
+        self.assertEqual(first_response["clem_cache"], {"hit": False})
+        self.assertEqual(second_response["clem_cache"], {"hit": True})
+        self.assertEqual((cache.num_hits, cache.num_misses), (1, 1))
+
+        _, response, _ = player(messages, 2)  # the cache is not active anymore
+        self.assertEqual(model.num_calls, 2)
+        self.assertNotIn("clem_cache", response)
+
+    def test_only_deterministic_calls_are_cached(self):
+        model = EchoModel(temperature=0.7)
+        cache = ResponseCache(self.cache_path, mode="write")
+        messages = [{"role": "user", "content": "hello"}]
+        cache.store(model, messages, messages, {}, "hello")
+        self.assertIsNone(cache.lookup(model, messages))
+
+    def test_used_stop_sequences_are_part_of_the_key(self):
+        model = EchoModel()
+        cache = ResponseCache(self.cache_path, mode="write")
+        messages = [{"role": "user", "content": "hello"}]
+        cache.store(model, messages, messages, {}, "hello", ["\n"])
+        self.assertEqual(cache.lookup(model, messages)[2], "hello")  # the model does not use them
+
+        model = EchoModel(player_stop_sequences=True)
+        cache.store(model, messages, messages, {}, "hello", ["\n"])
+        self.assertIsNone(cache.lookup(model, messages))
+        self.assertEqual(cache.lookup(model, messages, ["\n"])[2], "hello")
+
+    def test_used_response_pattern_is_part_of_the_key(self):
+        cache = ResponseCache(self.cache_path, mode="write")
+        messages = [{"role": "user", "content": "hello"}]
+        cache.store(EchoModel(), messages, messages, {}, "hello", response_pattern="GUESS:")
+        self.assertEqual(cache.lookup(EchoModel(), messages)[2], "hello")  # the model does not use it
+
+        model = EchoModel(constrained_decoding=True)
+        cache.store(model, messages, messages, {}, "GUESS: hello", response_pattern="GUESS:")
+        self.assertIsNone(cache.lookup(model, messages))
+        self.assertEqual(cache.lookup(model, messages, response_pattern="GUESS:")[2], "GUESS: hello")
+
+    def test_read_mode_does_not_store(self):
+        model = EchoModel()
+        messages = [{"role": "user", "content": "hello"}]
+        ResponseCache(self.cache_path, mode="read").store(model, messages, messages, {}, "hello")
+        self.assertIsNone(ResponseCache(self.cache_path, mode="write").lookup(model, messages))
+
+    def test_least_recently_used_responses_are_evicted(self):
+        model = EchoModel()
+        cache = ResponseCache(self.cache_path, mode="write", max_size_mb=1e-3)  # about 1000 characters
+        conversations = [[{"role": "user", "content": f"{idx}" * 200}] for idx in range(3)]
+        for messages in conversations[:2]:
+            cache.store(model, messages, messages, {}, messages[0]["content"])
+        self.assertIsNotNone(cache.lookup(model, conversations[0]))  # now the second one is least recently used
+        cache.store(model, conversations[2], conversations[2], {}, conversations[2][0]["content"])
+        self.assertIsNotNone(cache.lookup(model, conversations[0]))
+        self.assertIsNone(cache.lookup(model, conversations[1]))
+        self.assertIsNotNone(cache.lookup(model, conversations[2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
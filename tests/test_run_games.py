@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import backends
+from clemgame import benchmark
+from stub_game import StubGameBenchmark, StubGameMaster, StubModel
+
+
+class CountingBackend(backends.Backend):
+
+    def __init__(self):
+        self.loaded_models = []
+
+    def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
+        model = StubModel(model_spec.model_name, response_text="counted", backend="counting")
+        self.loaded_models.append(model)
+        return model
+
+
+class RunGamesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+        self.backend = CountingBackend()
+        backends._backend_registry["counting"] = self.backend
+        StubGameMaster.reset()
+
+    def tearDown(self):
+        shutil.rmtree(self.results_dir)
+        del backends._backend_registry["counting"]
+
+    def test_concurrent_games_share_the_models(self):
+        games = {"game_a": StubGameBenchmark("game_a", num_instances=3),
+                 "game_b": StubGameBenchmark("game_b", num_instances=4)}
+        with mock.patch.object(benchmark, "load_benchmark", lambda game_name, do_setup: games[game_name]):
+            benchmark.run(["game_a", "game_b"], [{"model_name": "counting-shared", "backend": "counting"}],
+                          dict(temperature=0.0), results_dir=self.results_dir, max_concurrent_games=2)
+        self.assertEqual(len(self.backend.loaded_models), 1)
+        self.assertEqual(len(StubGameMaster.played_game_ids), 7)
+        dialogue_pair_dir = os.path.join(self.results_dir, "counting-shared-t0.0--counting-shared-t0.0")
+        self.assertEqual(sorted(os.listdir(dialogue_pair_dir)), ["game_a", "game_b"])
+        for game_name, num_instances in [("game_a", 3), ("game_b", 4)]:
+            experiment_dir = os.path.join(dialogue_pair_dir, game_name, "0_counting")
+            self.assertEqual(sorted(name for name in os.listdir(experiment_dir) if name.startswith("episode_")),
+                             [f"episode_{idx}" for idx in range(num_instances)])
+
+
+if __name__ == '__main__':
+    unittest.main()
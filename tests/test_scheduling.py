@@ -0,0 +1,46 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from clemgame.scheduling import EpisodeCostEstimator, estimate_from_metadata, longest_first
+
+
+def store_requests(results_dir: str, dialogue_pair: str, episode_idx: int, num_requests: int):
+    episode_dir = os.path.join(results_dir, dialogue_pair, "wordgame", "0_words", f"episode_{episode_idx}")
+    os.makedirs(episode_dir)
+    with open(os.path.join(episode_dir, "requests.json"), "w") as f:
+        json.dump([{}] * num_requests, f)
+
+
+class SchedulingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+        self.experiment = {"name": "words", "common_config": {"max_attempts_per_game": 6}}
+
+    def tearDown(self):
+        shutil.rmtree(self.results_dir)
+
+    def test_estimate_from_metadata(self):
+        self.assertEqual(estimate_from_metadata(2, self.experiment, {"game_id": 0}), 12)
+        self.assertEqual(estimate_from_metadata(2, {"name": "taboo", "max_turns": 3}, {"game_id": 0}), 6)
+        self.assertEqual(estimate_from_metadata(2, {"name": "reference"}, {"game_id": 0}), 2)
+
+    def test_estimate_prefers_previous_requests(self):
+        store_requests(self.results_dir, "a--a", 0, 4)
+        store_requests(self.results_dir, "b--b", 0, 8)
+        store_requests(self.results_dir, "a--a", 1, 3)
+        estimator = EpisodeCostEstimator(self.results_dir)
+        self.assertEqual(estimator.estimate("wordgame", 2, 0, self.experiment, 0, {}), 6)
+        self.assertEqual(estimator.estimate("wordgame", 2, 0, self.experiment, 1, {}), 3)
+        self.assertEqual(estimator.estimate("wordgame", 2, 0, self.experiment, 2, {}), 5)  # experiment mean
+        self.assertEqual(estimator.estimate("wordgame", 2, 1, {"name": "other"}, 0, {}), 2)  # metadata
+
+    def test_longest_first_is_stable(self):
+        self.assertEqual(longest_first(["a", "b", "c", "d"], [1, 3, 1, 2]), ["b", "d", "a", "c"])
+
+
+if __name__ == '__main__':
+    unittest.main()
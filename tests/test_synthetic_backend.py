@@ -0,0 +1,49 @@
+import asyncio
+import unittest
+
+from backends import ModelSpec
+from backends.synthetic_api import Synthetic, SyntheticAPIError
+from clemgame.clemgame import Player
+from clemgame.failures import is_transient_error
+
+
+class CountingPlayer(Player):
+
+    def _custom_response(self, messages, turn_idx):
+        return f"count {turn_idx}"
+
+
+def load_synthetic_model(**model_spec):
+    model = Synthetic().get_model_for(ModelSpec(model_name="synthetic", backend="synthetic", seed=1, **model_spec))
+    model.set_gen_args(temperature=0.0, max_tokens=100)
+    return model
+
+
+class SyntheticBackendTestCase(unittest.TestCase):
+
+    def test_responses_are_the_programmatic_ones(self):
+        model = load_synthetic_model(latency={"distribution": "fixed", "seconds": 0.01},
+                                     completion_tokens={"distribution": "fixed", "tokens": 7})
+        player = CountingPlayer(model)
+        _, response, response_text = player([{"role": "user", "content": "count"}], 3)
+        self.assertEqual(response_text, "count 3")
+        self.assertEqual(response["latency"], 0.01)
+        self.assertEqual(response["usage"]["completion_tokens"], 7)
+
+        _, _, response_text = asyncio.run(player.acall([{"role": "user", "content": "count"}], 4))
+        self.assertEqual(response_text, "count 4")
+
+    def test_lognormal_latency(self):
+        model = load_synthetic_model(latency={"distribution": "lognormal", "median": 2.0, "sigma": 0.5})
+        latencies = sorted(model.sample_latency() for _ in range(1001))
+        self.assertAlmostEqual(latencies[500], 2.0, delta=0.2)
+
+    def test_injected_errors_are_transient(self):
+        player = CountingPlayer(load_synthetic_model(error_rate=1.0))
+        with self.assertRaises(SyntheticAPIError) as context:
+            player([{"role": "user", "content": "count"}], 0)
+        self.assertTrue(is_transient_error(context.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import shutil
+import tempfile
+import time
+import unittest
+
+from clemgame.workqueue import WorkQueue
+
+
+def make_jobs(num_episodes: int):
+    return [dict(game_name="countinggame", instances_name="instances", experiment_idx=0,
+                 experiment_name="counting", episode_idx=episode_idx,
+                 model_specs=[{"model_name": "programmatic"}], gen_args={"temperature": 0.0})
+            for episode_idx in range(num_episodes)]
+
+
+class WorkQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+        self.queue = WorkQueue(self.results_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.results_dir)
+
+    def test_jobs_are_added_only_once(self):
+        self.assertEqual(self.queue.add_jobs(make_jobs(3)), 3)
+        self.assertEqual(WorkQueue(self.results_dir).add_jobs(make_jobs(5)), 2)
+        self.assertEqual(self.queue.count_by_status(), {"open": 5})
+
+    def test_leased_jobs_are_not_given_to_other_workers(self):
+        self.queue.add_jobs(make_jobs(2))
+        job_1 = self.queue.lease("worker-1", lease_seconds=60)
+        job_2 = self.queue.lease("worker-2", lease_seconds=60)
+        self.assertNotEqual(job_1.episode_idx, job_2.episode_idx)
+        self.assertIsNone(self.queue.lease("worker-3", lease_seconds=60))
+        self.assertTrue(self.queue.complete(job_1, "worker-1"))
+        self.assertEqual(self.queue.count_by_status(), {"done": 1, "leased": 1})
+
+    def test_expired_lease_is_given_to_another_worker(self):
+        self.queue.add_jobs(make_jobs(1))
+        job = self.queue.lease("worker-1", lease_seconds=0.05)
+        time.sleep(0.1)
+        taken_over = self.queue.lease("worker-2", lease_seconds=60)
+        self.assertEqual(taken_over.job_id, job.job_id)
+        self.assertEqual(taken_over.attempts, 2)
+        self.assertFalse(self.queue.heartbeat(job, "worker-1", lease_seconds=60))
+        self.assertFalse(self.queue.complete(job, "worker-1"))
+        self.assertTrue(self.queue.complete(taken_over, "worker-2"))
+
+    def test_failed_jobs_are_retried_until_max_attempts(self):
+        self.queue.add_jobs(make_jobs(1))
+        for _ in range(2):
+            job = self.queue.lease("worker-1", lease_seconds=60)
+            self.queue.fail(job, "worker-1", max_attempts=2)
+        self.assertIsNone(self.queue.lease("worker-1", lease_seconds=60))
+        self.assertEqual(self.queue.count_by_status(), {"failed": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()